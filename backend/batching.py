@@ -0,0 +1,162 @@
+import queue
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from PIL import Image
+
+from backend.cancellation import RequestCancelled, RequestContext
+from backend.utils.metrics import LOCAL_BATCH_SIZE, LOCAL_QUEUE_DEPTH
+
+
+def _settle(future: Future, outcome) -> None:
+    # The caller may have cancelled its future already, and setting a done
+    # future raises InvalidStateError, which would kill the worker thread
+    if future.done():
+        return
+    if isinstance(outcome, BaseException):
+        future.set_exception(outcome)
+    else:
+        future.set_result(outcome)
+
+
+@dataclass
+class BatchRequest:
+    image: Image.Image
+    question: str
+    context: RequestContext | None = None
+    future: Future = field(default_factory=Future)
+
+
+class LocalBatcher:
+    """Collects local inference requests into micro-batches.
+
+    Requests that arrive within `max_wait_ms` of the first queued request are
+    grouped (up to `max_batch_size`) and handed to `run_batch` in one call, so
+    the model runs a single padded `generate` instead of one per caller.
+    Requests cancelled while queued are dropped before the batch runs, and
+    `run_batch` may return an exception in place of an output to fail just
+    that caller.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[
+            [list[Image.Image], list[str], list[RequestContext | None]], list
+        ],
+        max_batch_size: int = 4,
+        max_wait_ms: float = 50,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._worker, name="local-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None)  # Wake the worker up
+        self._thread.join()
+        self._thread = None
+
+        # Fail anything that was still waiting
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                _settle(request.future, RuntimeError("Local batcher stopped"))
+        LOCAL_QUEUE_DEPTH.set(0)
+
+    def queue_depth(self) -> int:
+        # Requests still waiting for a batch (approximate, like qsize)
+        return self._queue.qsize()
+
+    def capacity(self) -> int:
+        return self.max_batch_size
+
+    def submit(
+        self,
+        image: Image.Image,
+        question: str,
+        context: RequestContext | None = None,
+    ) -> Future:
+        if not self._running:
+            raise RuntimeError("Local batcher is not running")
+        request = BatchRequest(image=image, question=question, context=context)
+        self._queue.put(request)
+        LOCAL_QUEUE_DEPTH.inc()
+        return request.future
+
+    def _collect(self) -> list[BatchRequest]:
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # Shutdown sentinel: serve what we have, then exit
+                self._queue.put(None)
+                break
+            batch.append(request)
+
+        LOCAL_QUEUE_DEPTH.dec(len(batch))
+        return batch
+
+    def _worker(self):
+        while self._running:
+            batch = self._collect()
+
+            # Nobody is waiting for these any more
+            live = []
+            for request in batch:
+                if request.context is not None and request.context.should_stop():
+                    _settle(request.future, RequestCancelled(request.context.reason))
+                else:
+                    live.append(request)
+            batch = live
+            if not batch:
+                continue
+
+            LOCAL_BATCH_SIZE.observe(len(batch))
+            try:
+                outputs = self.run_batch(
+                    [r.image for r in batch],
+                    [r.question for r in batch],
+                    [r.context for r in batch],
+                )
+                if len(outputs) != len(batch):
+                    raise RuntimeError(
+                        f"Batch returned {len(outputs)} outputs for {len(batch)} requests"
+                    )
+            except Exception as e:  # noqa: BLE001 - handed to the waiting callers
+                for request in batch:
+                    _settle(request.future, e)
+                continue
+
+            for request, output in zip(batch, outputs):
+                _settle(request.future, output)
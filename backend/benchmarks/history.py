@@ -0,0 +1,125 @@
+"""Measure /history page latency as the history table grows.
+
+Grows a scratch DuckDB database step by step, adding users as it goes so
+each keeps about the same number of entries and only the table gets bigger.
+Entries of all users are interleaved in time, as they are in production. At
+each size it times the first page and the deepest page (through the keyset
+cursor) of get_user_history, and the first page with the unindexed top-N
+query it replaced.
+
+    python -m backend.benchmarks.history --sizes 100000 1000000 10000000
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from backend.db.database import Database, encode_cursor
+
+PAGE = 50
+
+TOP_N_QUERY = """
+    SELECT id, question, image_url, response, timestamp
+    FROM history
+    WHERE user_uuid = ?
+    ORDER BY timestamp DESC
+    LIMIT ?
+"""
+
+
+def user_id(n: int) -> str:
+    # Random-looking, like the real uuid4 strings
+    return hashlib.md5(str(n).encode()).hexdigest()
+
+
+def grow(db: Database, start: int, end: int, rows_per_user: int) -> int:
+    # Bulk-loaded in SQL; going through add_history_entry would take hours.
+    # md5 here matches user_id()
+    con = db.cursor()
+    first_user, users = -(-start // rows_per_user), -(-end // rows_per_user)
+    con.execute(
+        """
+        INSERT INTO users (uuid, email)
+        SELECT md5(i::VARCHAR), 'user-' || i || '@example.com'
+        FROM range(?, ?) t(i)
+        """,
+        (first_user, users),
+    )
+    con.execute(
+        """
+        INSERT INTO history (id, user_uuid, question, image_url, response, timestamp)
+        SELECT uuid(), md5((hash(i) % ?)::VARCHAR), 'Question ' || i, NULL,
+               'Response ' || i, TIMESTAMP '2024-01-01' + to_seconds(i)
+        FROM range(?, ?) t(i)
+        """,
+        (users, start, end),
+    )
+    return users
+
+
+def top_n_page(db: Database, user_uuid: str):
+    return db.cursor().execute(TOP_N_QUERY, (user_uuid, PAGE)).fetchall()
+
+
+def time_ms(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def measure(db: Database, users: int, samples: int):
+    first, deep, top_n = [], [], []
+    for _ in range(samples):
+        user_uuid = user_id(random.randrange(users))
+        first.append(time_ms(db.get_user_history, user_uuid, PAGE))
+        # Walk to the last page, timing only the final request
+        cursor = None
+        while True:
+            page = db.get_user_history(user_uuid, PAGE + 1, cursor)
+            if len(page) <= PAGE:
+                break
+            cursor = encode_cursor(page[PAGE - 1])
+        deep.append(time_ms(db.get_user_history, user_uuid, PAGE, cursor))
+        top_n.append(time_ms(top_n_page, db, user_uuid))
+    return [statistics.median(t) for t in (first, deep, top_n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[100_000, 1_000_000, 4_000_000, 10_000_000],
+    )
+    parser.add_argument("--rows-per-user", type=int, default=500)
+    parser.add_argument("--samples", type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(db_path=os.path.join(directory, "history.duckdb"))
+        db.initialize_db()
+
+        print(
+            f"{'rows':>10} {'load s':>8} {'first ms':>9} {'last ms':>8} {'top-n ms':>9}"
+        )
+        rows = 0
+        for size in sorted(args.sizes):
+            start = time.perf_counter()
+            users = grow(db, rows, size, args.rows_per_user)
+            load_seconds = time.perf_counter() - start
+            rows = size
+            first, deep, top_n = measure(db, users, args.samples)
+            print(
+                f"{rows:>10} {load_seconds:>8.1f} {first:>9.2f} "
+                f"{deep:>8.2f} {top_n:>9.2f}"
+            )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
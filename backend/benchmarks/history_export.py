@@ -0,0 +1,95 @@
+"""Compare the row-by-row and columnar history serialization paths.
+
+For one user with N entries, times (and traces the peak Python heap of)
+get_user_history's per-row dicts followed by json.dumps, against the
+streamed iter_user_history_json batches that /history/{user_uuid}/export
+joins into NDJSON.
+
+    python -m backend.benchmarks.history_export --rows 1000 10000 100000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from backend.db.database import Database
+
+USER_UUID = "benchmark-user"
+
+
+def fill(db: Database, rows: int):
+    con = db.cursor()
+    con.execute("DELETE FROM history")
+    con.execute(
+        """
+        INSERT INTO history (id, user_uuid, question, image_url, response, timestamp)
+        SELECT uuid(), ?, 'Solve question ' || i || ' for x, please',
+               CASE WHEN i % 2 = 0 THEN 'uploads/ab/cd/' || md5(i::VARCHAR) || '.jpg' END,
+               repeat('Step ' || i || ': rearrange both sides. ', 8),
+               TIMESTAMP '2024-01-01' + to_seconds(i)
+        FROM range(?) t(i)
+        """,
+        (USER_UUID, rows),
+    )
+
+
+def rows_path(db: Database, rows: int) -> int:
+    history = db.get_user_history(USER_UUID, limit=rows)
+    return len(json.dumps(history))
+
+
+def columnar_path(db: Database, rows: int) -> int:
+    size = 0
+    for batch in db.iter_user_history_json(USER_UUID):
+        size += len("\n".join(batch)) + 1
+    return size
+
+
+def run(fn, db: Database, rows: int, runs: int):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(db, rows)
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    fn(db, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(db_path=os.path.join(directory, "export.duckdb"))
+        db.initialize_db()
+        db.cursor().execute(
+            "INSERT INTO users (uuid, email) VALUES (?, 'benchmark@example.com')",
+            (USER_UUID,),
+        )
+
+        print(
+            f"{'rows':>8} {'dicts ms':>9} {'dicts MB':>9} "
+            f"{'columnar ms':>12} {'columnar MB':>12}"
+        )
+        for rows in args.rows:
+            fill(db, rows)
+            dicts_ms, dicts_mb = run(rows_path, db, rows, args.runs)
+            columnar_ms, columnar_mb = run(columnar_path, db, rows, args.runs)
+            print(
+                f"{rows:>8} {dicts_ms:>9.1f} {dicts_mb:>9.1f} "
+                f"{columnar_ms:>12.1f} {columnar_mb:>12.1f}"
+            )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Compare local model precision modes.
+
+Each mode is loaded in a fresh process so resident memory is not polluted by
+the previous one. Reports load time, resident memory after load, peak
+resident memory and decode throughput on a synthetic worksheet image.
+
+    python -m backend.benchmarks.precision --modes fp32 bf16 int8 --runs 3
+"""
+
+import argparse
+import multiprocessing as mp
+import resource
+import time
+
+from PIL import Image, ImageDraw
+
+QUESTION = "Solve for x and show each step."
+
+
+def sample_image() -> Image.Image:
+    image = Image.new("RGB", (896, 672), color="white")
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(["2x + 5 = 15", "3(x - 4) = 9", "x^2 - 9 = 0"]):
+        draw.text((60, 80 + i * 160), f"{i + 1}) {line}", fill="black")
+    return image
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_mode(precision: str, runs: int, max_new_tokens: int, results):
+    # Imported here so the parent process never loads torch/transformers
+    from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+
+    from backend.local_model import (
+        apply_precision,
+        build_messages,
+        precision_dtype,
+        prepare_inputs,
+    )
+    from backend.utils.consts import BASE_MODEL, DEVICE
+
+    start = time.perf_counter()
+    model = Qwen2VLForConditionalGeneration.from_pretrained(
+        BASE_MODEL, dtype=precision_dtype(precision)
+    )
+    model.to(DEVICE)
+    model = apply_precision(model, precision, DEVICE)
+    processor = AutoProcessor.from_pretrained(BASE_MODEL)
+    load_seconds = time.perf_counter() - start
+    loaded_rss = rss_mb()
+
+    inputs = prepare_inputs(processor, DEVICE, build_messages(sample_image(), QUESTION))
+    prompt_tokens = inputs.input_ids.shape[1]
+
+    # Warm up kernels and allocator before timing
+    model.generate(**inputs, max_new_tokens=4, do_sample=False)
+
+    generated = 0
+    elapsed = 0.0
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = model.generate(
+            **inputs, max_new_tokens=max_new_tokens, do_sample=False
+        )
+        elapsed += time.perf_counter() - start
+        generated += output.shape[1] - prompt_tokens
+
+    results.put(
+        {
+            "precision": precision,
+            "load_s": load_seconds,
+            "rss_mb": loaded_rss,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "tokens_per_s": generated / elapsed if elapsed else 0.0,
+            "latency_s": elapsed / runs,
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    rows = []
+    for precision in args.modes:
+        process = ctx.Process(
+            target=run_mode,
+            args=(precision, args.runs, args.max_new_tokens, results),
+        )
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f"{precision}: failed with exit code {process.exitcode}")
+            continue
+        rows.append(results.get())
+
+    print(
+        f"{'mode':<6} {'load s':>8} {'rss MB':>8} {'peak MB':>8} "
+        f"{'tok/s':>8} {'latency s':>10}"
+    )
+    for row in rows:
+        print(
+            f"{row['precision']:<6} {row['load_s']:>8.1f} {row['rss_mb']:>8.0f} "
+            f"{row['peak_rss_mb']:>8.0f} {row['tokens_per_s']:>8.2f} "
+            f"{row['latency_s']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
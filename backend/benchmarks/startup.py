@@ -0,0 +1,120 @@
+"""Compare local model cold-start from the hub cache and from a snapshot.
+
+Each source is loaded in a fresh process. Reports the time to load the model
+and processor, the warmup generation time, resident memory, and how much of
+it is file-backed (shareable through the page cache across replicas) versus
+private anonymous memory.
+
+    python -m backend.snapshot --output /tmp/qwen2-vl-fp32 --precision fp32
+    python -m backend.benchmarks.startup --snapshot /tmp/qwen2-vl-fp32 --precision fp32
+
+Pass --drop-caches (root only) to empty the page cache before every load, so
+the numbers include reading the weights from disk.
+"""
+
+import argparse
+import multiprocessing as mp
+import time
+
+
+def memory_mb() -> dict:
+    # smaps_rollup splits resident memory into file-backed and anonymous pages
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[key] = int(value.split()[0]) / 1024
+    return {
+        "rss_mb": fields.get("Rss", 0.0),
+        "anon_mb": fields.get("Anonymous", 0.0),
+        "file_mb": fields.get("Rss", 0.0) - fields.get("Anonymous", 0.0),
+    }
+
+
+def drop_page_cache():
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def run_source(name: str, snapshot: str, precision: str, results):
+    start = time.perf_counter()
+    # Imported here so the import cost is part of the measured cold start
+    from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+
+    from backend.local_model import apply_precision, precision_dtype, warmup_local
+    from backend.snapshot import model_source
+    from backend.utils.consts import DEVICE
+
+    import_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    source, source_kwargs = model_source(precision, snapshot)
+    model = Qwen2VLForConditionalGeneration.from_pretrained(
+        source, dtype=precision_dtype(precision), **source_kwargs
+    )
+    model.to(DEVICE)
+    model = apply_precision(model, precision, DEVICE)
+    processor = AutoProcessor.from_pretrained(source, **source_kwargs)
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    warmup_local(model, processor, DEVICE)
+    warmup_seconds = time.perf_counter() - start
+
+    results.put(
+        {
+            "source": name,
+            "import_s": import_seconds,
+            "load_s": load_seconds,
+            "warmup_s": warmup_seconds,
+            **memory_mb(),
+        }
+    )
+
+
+def main():
+    from backend.utils.consts import LOCAL_PRECISION
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--snapshot", help="Directory from python -m backend.snapshot")
+    parser.add_argument("--precision", default=LOCAL_PRECISION)
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--drop-caches", action="store_true")
+    args = parser.parse_args()
+
+    sources = [("hub", "")]
+    if args.snapshot:
+        sources.append(("snapshot", args.snapshot))
+
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    rows = []
+    for _ in range(args.runs):
+        for name, snapshot in sources:
+            if args.drop_caches:
+                drop_page_cache()
+            process = ctx.Process(
+                target=run_source, args=(name, snapshot, args.precision, results)
+            )
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                print(f"{name}: failed with exit code {process.exitcode}")
+                continue
+            rows.append(results.get())
+
+    print(
+        f"{'source':<9} {'import s':>9} {'load s':>8} {'warmup s':>9} "
+        f"{'rss MB':>8} {'anon MB':>8} {'file MB':>8}"
+    )
+    for row in rows:
+        print(
+            f"{row['source']:<9} {row['import_s']:>9.1f} {row['load_s']:>8.1f} "
+            f"{row['warmup_s']:>9.1f} {row['rss_mb']:>8.0f} {row['anon_mb']:>8.0f} "
+            f"{row['file_mb']:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
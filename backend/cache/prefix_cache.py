@@ -0,0 +1,60 @@
+import copy
+import threading
+
+import torch
+
+from backend.utils.metrics import PREFIX_CACHE_EVENTS
+
+
+class PrefixKVCache:
+    """Past key/values for a constant prompt prefix, computed once.
+
+    Every request whose input_ids start with the same tokens can start
+    generation from a copy of this cache instead of re-running prefill over
+    the prefix. The cache is tied to the model object and prefix it was built
+    from, so a reloaded model or an edited prompt never reuses stale state.
+    """
+
+    def __init__(self, model, input_ids: torch.Tensor, past_key_values):
+        self._model_id = id(model)
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, model, processor, device, prefix_text: str):
+        input_ids = processor.tokenizer(
+            prefix_text, add_special_tokens=False, return_tensors="pt"
+        ).input_ids.to(device)
+
+        # Text-only prefix: plain sequential positions, no multimodal rope state
+        model.model.rope_deltas = None
+        with torch.inference_mode():
+            outputs = model(input_ids=input_ids, use_cache=True)
+
+        return cls(model, input_ids, outputs.past_key_values)
+
+    def __len__(self):
+        return self.input_ids.shape[-1]
+
+    def is_valid_for(self, model, input_ids: torch.Tensor) -> bool:
+        if id(model) != self._model_id:
+            PREFIX_CACHE_EVENTS.labels(event="stale_model").inc()
+            return False
+
+        length = len(self)
+        if (
+            input_ids.shape[0] != 1
+            or input_ids.shape[-1] <= length
+            or not torch.equal(input_ids[0, :length].cpu(), self.input_ids[0].cpu())
+        ):
+            PREFIX_CACHE_EVENTS.labels(event="mismatch").inc()
+            return False
+
+        PREFIX_CACHE_EVENTS.labels(event="hit").inc()
+        return True
+
+    def fresh_cache(self):
+        # generate() appends to the cache in place, so each request gets a copy
+        with self._lock:
+            return copy.deepcopy(self.past_key_values)
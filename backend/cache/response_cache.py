@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import duckdb
+from PIL import Image
+
+from backend.utils.metrics import RESPONSE_CACHE_EVENTS
+
+
+def image_content_hash(image: Image.Image) -> str:
+    # Hash the decoded pixels, not the file bytes, so the same picture saved
+    # under a different name or container metadata still matches
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = 8) -> str:
+    # Difference hash: survives re-encoding, resizing and small colour shifts
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def make_cache_key(
+    image: Image.Image,
+    question: str,
+    mode: str,
+    settings: dict,
+    perceptual: bool = False,
+) -> str:
+    image_key = perceptual_hash(image) if perceptual else image_content_hash(image)
+    payload = json.dumps(
+        {
+            "image": image_key,
+            "question": normalize_question(question),
+            "mode": mode,
+            "settings": settings,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier cache of model responses.
+
+    The memory tier is a bounded LRU. The optional disk tier is a DuckDB
+    table that survives restarts; memory misses fall through to it and disk
+    hits are promoted back into memory.
+    """
+
+    def __init__(self, max_entries: int = 256, db_path: str | None = None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._con = None
+
+        if db_path:
+            if os.path.dirname(db_path):
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            self._con = duckdb.connect(db_path)
+            self._con.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key VARCHAR PRIMARY KEY,
+                    response VARCHAR,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                RESPONSE_CACHE_EVENTS.labels(tier="memory", event="hit").inc()
+                return self._entries[key]
+        RESPONSE_CACHE_EVENTS.labels(tier="memory", event="miss").inc()
+
+        if self._con is None:
+            return None
+
+        with self._lock:
+            row = self._con.execute(
+                "SELECT response FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            RESPONSE_CACHE_EVENTS.labels(tier="disk", event="miss").inc()
+            return None
+
+        RESPONSE_CACHE_EVENTS.labels(tier="disk", event="hit").inc()
+        self._put_memory(key, row[0])
+        return row[0]
+
+    def put(self, key: str, response: str):
+        self._put_memory(key, response)
+
+        if self._con is not None:
+            with self._lock:
+                self._con.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, response) VALUES (?, ?)",
+                    (key, response),
+                )
+
+    def _put_memory(self, key: str, response: str):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                RESPONSE_CACHE_EVENTS.labels(tier="memory", event="eviction").inc()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._con is not None:
+                self._con.execute("DELETE FROM response_cache")
+
+    def close(self):
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
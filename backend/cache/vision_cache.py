@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import torch
+
+from backend.utils.metrics import VISION_CACHE_BYTES, VISION_CACHE_EVENTS
+
+
+@dataclass
+class VisionFeatures:
+    image_grid_thw: torch.Tensor
+    image_embeds: tuple[torch.Tensor, ...]
+
+    @property
+    def nbytes(self) -> int:
+        tensors = (self.image_grid_thw, *self.image_embeds)
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class VisionFeatureCache:
+    """LRU cache of vision-encoder outputs keyed by image content hash.
+
+    Entries are evicted least-recently-used first once the total tensor size
+    exceeds `max_bytes`. An entry larger than the whole budget is not stored.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> VisionFeatures | None:
+        with self._lock:
+            features = self._entries.get(key)
+            if features is None:
+                VISION_CACHE_EVENTS.labels(event="miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            VISION_CACHE_EVENTS.labels(event="hit").inc()
+            return features
+
+    def put(self, key: str, features: VisionFeatures):
+        size = features.nbytes
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous.nbytes
+
+            self._entries[key] = features
+            self.total_bytes += size
+
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+                VISION_CACHE_EVENTS.labels(event="eviction").inc()
+
+            VISION_CACHE_BYTES.set(self.total_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            VISION_CACHE_BYTES.set(0)
@@ -0,0 +1,80 @@
+import threading
+import time
+from collections.abc import Callable
+
+
+class RequestCancelled(Exception):
+    """Raised when a request's client went away or its deadline passed."""
+
+    def __init__(self, reason: str = "cancelled"):
+        super().__init__(
+            "Inference timed out" if reason == "timeout" else "Request cancelled"
+        )
+        self.reason = reason
+
+
+class RequestContext:
+    """Deadline, cancellation flag and token budget for one inference request.
+
+    The API handler owns it and the inference code polls `should_stop()`
+    between tokens. Deadlines are wall-clock times so a context can be rebuilt
+    inside a pool worker process from `deadline` alone.
+    """
+
+    def __init__(
+        self,
+        timeout: float | None = None,
+        max_new_tokens: int | None = None,
+        deadline: float | None = None,
+        cancel_check: Callable[[], bool] | None = None,
+    ):
+        if deadline is None and timeout:
+            deadline = time.time() + timeout
+        self.deadline = deadline
+        self.max_new_tokens = max_new_tokens
+        self._cancel_check = cancel_check
+        self._reason = None
+        self._callbacks: list[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def reason(self) -> str | None:
+        if self._reason is None:
+            if self._cancel_check is not None and self._cancel_check():
+                self._reason = "cancelled"
+            elif self.expired():
+                self._reason = "timeout"
+        return self._reason
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def remaining(self) -> float | None:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def should_stop(self) -> bool:
+        return self.reason is not None
+
+    def check(self):
+        reason = self.reason
+        if reason is not None:
+            raise RequestCancelled(reason)
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if self._reason is not None:
+                return
+            self._reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(reason)
+
+    def on_cancel(self, callback: Callable[[str], None]):
+        # Runs on explicit cancel(); a passed deadline is noticed by polling
+        with self._lock:
+            if self._reason is None:
+                self._callbacks.append(callback)
+                return
+        callback(self._reason)
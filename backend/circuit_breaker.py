@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable
+
+from backend.cancellation import RequestCancelled
+from backend.utils.metrics import REMOTE_CIRCUIT_STATE, REMOTE_CIRCUIT_TRANSITIONS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Gauge values for REMOTE_CIRCUIT_STATE
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Remote model unavailable (circuit open)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker driven by error rate and latency.
+
+    While closed, the outcomes of the last `window` calls are kept; a call
+    that fails or takes longer than `slow_call_seconds` counts as bad. Once
+    at least `min_calls` are recorded and the bad fraction reaches
+    `failure_rate`, the breaker opens and every call fails fast with
+    CircuitOpen. After `open_seconds` it lets `half_open_calls` probes
+    through: if they all succeed it closes again, one bad probe reopens it.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float | None = None,
+        window: int = 20,
+        min_calls: int = 10,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 2,
+        clock=time.monotonic,
+    ):
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = max(1, min_calls)
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(1, half_open_calls)
+        self._clock = clock
+        self._outcomes = deque(maxlen=max(self.min_calls, window))
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        REMOTE_CIRCUIT_STATE.set(STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.open_seconds - self._clock())
+
+    def _transition(self, state: str):
+        self._state = state
+        REMOTE_CIRCUIT_STATE.set(STATE_VALUES[state])
+        REMOTE_CIRCUIT_TRANSITIONS.labels(state=state).inc()
+        if state == OPEN:
+            self._opened_at = self._clock()
+        elif state == HALF_OPEN:
+            self._probes = 0
+            self._probe_successes = 0
+        else:
+            self._outcomes.clear()
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and self._clock() >= self._opened_at + self.open_seconds:
+            self._transition(HALF_OPEN)
+
+    def acquire(self):
+        """Admit one call or raise CircuitOpen; pair with release()."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return
+            retry_after = max(0.0, self._opened_at + self.open_seconds - self._clock())
+        raise CircuitOpen(retry_after)
+
+    def release(self, ok: bool | None, duration: float | None = None):
+        """Record an admitted call's outcome; ok=None means it didn't finish."""
+        if ok and self.slow_call_seconds is not None and duration is not None:
+            ok = duration <= self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if ok is None:
+                    # Free the probe slot for another caller
+                    self._probes = max(0, self._probes - 1)
+                elif not ok:
+                    self._transition(OPEN)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self._transition(CLOSED)
+                return
+            if self._state != CLOSED or ok is None:
+                return
+            self._outcomes.append(ok)
+            if len(self._outcomes) < self.min_calls:
+                return
+            bad = self._outcomes.count(False) / len(self._outcomes)
+            if bad >= self.failure_rate:
+                self._transition(OPEN)
+
+    def _abandoned(self, duration: float) -> bool | None:
+        # A call cancelled after running past the slow-call threshold still
+        # says the upstream is slow; one cancelled earlier says nothing
+        if self.slow_call_seconds is not None and duration > self.slow_call_seconds:
+            return False
+        return None
+
+    async def call(self, awaitable: Awaitable):
+        try:
+            self.acquire()
+        except CircuitOpen:
+            # Never awaited; close it so Python doesn't warn
+            close = getattr(awaitable, "close", None)
+            if close is not None:
+                close()
+            raise
+        start = time.perf_counter()
+        try:
+            result = await awaitable
+        except asyncio.CancelledError:
+            self.release(self._abandoned(time.perf_counter() - start))
+            raise
+        except Exception:
+            self.release(False)
+            raise
+        self.release(True, time.perf_counter() - start)
+        return result
+
+    async def stream(self, tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+        # Streams are judged by time to first token; their total length
+        # depends on the answer, not on upstream health
+        try:
+            self.acquire()
+        except CircuitOpen:
+            await tokens.aclose()
+            raise
+        start = time.perf_counter()
+        first_token = None
+        outcome = None
+        try:
+            async for token in tokens:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                yield token
+            outcome = True
+        except (asyncio.CancelledError, GeneratorExit, RequestCancelled):
+            # Stopped by our side: healthy if tokens were already flowing
+            if first_token is not None:
+                outcome = True
+            else:
+                outcome = self._abandoned(time.perf_counter() - start)
+            raise
+        except Exception:
+            outcome = False
+            raise
+        finally:
+            await tokens.aclose()
+            self.release(outcome, first_token)
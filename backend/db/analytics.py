@@ -0,0 +1,247 @@
+"""Usage summaries kept next to the history table.
+
+Every history write also folds its rows into these tables, in the same
+transaction, so the analytics endpoints read a few small tables instead of
+scanning history. Rows are only ever added, never subtracted: entries moved
+out of the history table later still count.
+"""
+
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+from datetime import date
+
+import duckdb
+
+TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS analytics_daily (
+        day DATE PRIMARY KEY,
+        requests BIGINT NOT NULL
+    )
+    """,
+    # Distinct users per day can't be summed; one row per user and day can
+    """
+    CREATE TABLE IF NOT EXISTS analytics_user_daily (
+        day DATE,
+        user_uuid VARCHAR,
+        requests BIGINT NOT NULL,
+        PRIMARY KEY (day, user_uuid)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analytics_users (
+        user_uuid VARCHAR PRIMARY KEY,
+        requests BIGINT NOT NULL,
+        image_requests BIGINT NOT NULL,
+        first_seen TIMESTAMP NOT NULL,
+        last_seen TIMESTAMP NOT NULL
+    )
+    """,
+    # Power-of-two length buckets: `le` is the bucket's upper bound
+    """
+    CREATE TABLE IF NOT EXISTS analytics_lengths (
+        field VARCHAR,
+        le BIGINT,
+        entries BIGINT NOT NULL,
+        characters BIGINT NOT NULL,
+        PRIMARY KEY (field, le)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analytics_images (
+        image_url VARCHAR PRIMARY KEY,
+        uses BIGINT NOT NULL
+    )
+    """,
+)
+
+LENGTH_FIELDS = ("question", "response")
+
+UPSERTS = {
+    "daily": """
+        INSERT INTO analytics_daily VALUES (?, ?)
+        ON CONFLICT (day) DO UPDATE SET requests = requests + excluded.requests
+    """,
+    "user_daily": """
+        INSERT INTO analytics_user_daily VALUES (?, ?, ?)
+        ON CONFLICT (day, user_uuid)
+        DO UPDATE SET requests = requests + excluded.requests
+    """,
+    "users": """
+        INSERT INTO analytics_users VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_uuid) DO UPDATE SET
+            requests = requests + excluded.requests,
+            image_requests = image_requests + excluded.image_requests,
+            first_seen = least(first_seen, excluded.first_seen),
+            last_seen = greatest(last_seen, excluded.last_seen)
+    """,
+    "lengths": """
+        INSERT INTO analytics_lengths VALUES (?, ?, ?, ?)
+        ON CONFLICT (field, le) DO UPDATE SET
+            entries = entries + excluded.entries,
+            characters = characters + excluded.characters
+    """,
+    "images": """
+        INSERT INTO analytics_images VALUES (?, ?)
+        ON CONFLICT (image_url) DO UPDATE SET uses = uses + excluded.uses
+    """,
+}
+
+
+def length_bucket(length: int) -> int:
+    # 0, 1, 2, 4, 8, ...: the smallest power of two >= length
+    return 0 if length <= 0 else 1 << (length - 1).bit_length()
+
+
+def summarize(rows: Iterable) -> dict[str, list[tuple]]:
+    """Collapse history rows into one upsert per summary key.
+
+    Rows are (id, user_uuid, question, image_url, response, timestamp).
+    """
+    daily = Counter()
+    user_daily = Counter()
+    users: dict[str, list] = {}
+    lengths = defaultdict(lambda: [0, 0])
+    images = Counter()
+    for _, user_uuid, question, image_url, response, timestamp in rows:
+        day = timestamp.date()
+        daily[day] += 1
+        user_daily[day, user_uuid] += 1
+        user = users.setdefault(user_uuid, [0, 0, timestamp, timestamp])
+        user[0] += 1
+        user[1] += image_url is not None
+        user[2] = min(user[2], timestamp)
+        user[3] = max(user[3], timestamp)
+        for field, text in zip(LENGTH_FIELDS, (question, response)):
+            length = len(text or "")
+            bucket = lengths[field, length_bucket(length)]
+            bucket[0] += 1
+            bucket[1] += length
+        if image_url is not None:
+            images[image_url] += 1
+    return {
+        "daily": list(daily.items()),
+        "user_daily": [(day, user, n) for (day, user), n in user_daily.items()],
+        "users": [(user, *stats) for user, stats in users.items()],
+        "lengths": [(field, le, *n) for (field, le), n in lengths.items()],
+        "images": list(images.items()),
+    }
+
+
+def update(con: duckdb.DuckDBPyConnection, rows: Iterable):
+    # Runs inside the caller's transaction, right after the history insert
+    for table, values in summarize(rows).items():
+        if values:
+            con.executemany(UPSERTS[table], values)
+
+
+def rebuild(con: duckdb.DuckDBPyConnection, source: str = "history"):
+    """Recompute every summary from `source` (a table or view of history)."""
+    for table in ("daily", "user_daily", "users", "lengths", "images"):
+        con.execute(f"DELETE FROM analytics_{table}")
+    con.execute(f"""
+        INSERT INTO analytics_daily
+        SELECT timestamp::DATE, count(*) FROM {source} GROUP BY ALL
+    """)
+    con.execute(f"""
+        INSERT INTO analytics_user_daily
+        SELECT timestamp::DATE, user_uuid, count(*) FROM {source} GROUP BY ALL
+    """)
+    con.execute(f"""
+        INSERT INTO analytics_users
+        SELECT user_uuid, count(*), count(image_url), min(timestamp), max(timestamp)
+        FROM {source} GROUP BY ALL
+    """)
+    for field in LENGTH_FIELDS:
+        # Same buckets as length_bucket()
+        con.execute(f"""
+            INSERT INTO analytics_lengths
+            SELECT '{field}',
+                   CASE WHEN length <= 1 THEN length
+                        ELSE 1::BIGINT << ceil(log2(length))::INTEGER END,
+                   count(*), sum(length)
+            FROM (SELECT length(coalesce({field}, '')) AS length FROM {source})
+            GROUP BY ALL
+        """)
+    con.execute(f"""
+        INSERT INTO analytics_images
+        SELECT image_url, count(*) FROM {source}
+        WHERE image_url IS NOT NULL GROUP BY ALL
+    """)
+
+
+def requests_per_day(con: duckdb.DuckDBPyConnection, since: date) -> list[dict]:
+    results = con.execute(
+        """
+        SELECT d.day, d.requests, count(u.user_uuid)
+        FROM analytics_daily d
+        LEFT JOIN analytics_user_daily u USING (day)
+        WHERE d.day >= ?
+        GROUP BY d.day, d.requests
+        ORDER BY d.day
+    """,
+        (since,),
+    ).fetchall()
+    return [
+        {"day": day.isoformat(), "requests": requests, "active_users": active}
+        for day, requests, active in results
+    ]
+
+
+def user_activity(
+    con: duckdb.DuckDBPyConnection, limit: int, user_uuid: str | None = None
+) -> list[dict]:
+    where = "WHERE user_uuid = ?" if user_uuid else ""
+    params = (user_uuid, limit) if user_uuid else (limit,)
+    results = con.execute(
+        f"""
+        SELECT user_uuid, requests, image_requests, first_seen, last_seen
+        FROM analytics_users
+        {where}
+        ORDER BY requests DESC, user_uuid
+        LIMIT ?
+    """,
+        params,
+    ).fetchall()
+    return [
+        {
+            "user_uuid": row[0],
+            "requests": row[1],
+            "image_requests": row[2],
+            "first_seen": row[3].isoformat(),
+            "last_seen": row[4].isoformat(),
+        }
+        for row in results
+    ]
+
+
+def length_distributions(con: duckdb.DuckDBPyConnection) -> dict[str, dict]:
+    results = con.execute("""
+        SELECT field, le, entries, characters FROM analytics_lengths
+        ORDER BY field, le
+    """).fetchall()
+    distributions = {
+        field: {"entries": 0, "mean": 0.0, "buckets": []} for field in LENGTH_FIELDS
+    }
+    characters = Counter()
+    for field, le, entries, chars in results:
+        distribution = distributions[field]
+        distribution["entries"] += entries
+        distribution["buckets"].append({"le": le, "entries": entries})
+        characters[field] += chars
+    for field, distribution in distributions.items():
+        if distribution["entries"]:
+            distribution["mean"] = characters[field] / distribution["entries"]
+    return distributions
+
+
+def image_reuse(con: duckdb.DuckDBPyConnection) -> dict:
+    requests, images = con.execute("""
+        SELECT coalesce(sum(uses), 0), count(*) FROM analytics_images
+    """).fetchone()
+    return {
+        "image_requests": requests,
+        "distinct_images": images,
+        # Share of image requests that sent an image seen before
+        "reuse_rate": (requests - images) / requests if requests else 0.0,
+    }
@@ -0,0 +1,230 @@
+"""Cold storage for old history rows.
+
+The archive job moves history rows older than a cutoff out of DuckDB into
+Parquet files partitioned by day, `<archive dir>/history/day=YYYY-MM-DD/`.
+Each run writes one batch, recorded in history_archive_batches in the same
+transaction that deletes the rows, so a run that fails part way leaves files
+no batch owns; those are removed before the views are next built. The
+history_archive view reads the files and history_all is the union of hot
+and archived rows, which exports, image lookups and analytics rebuilds read.
+
+Export and import move users and all of history between databases, e.g. to
+rebuild a bloated database file from scratch. DuckDB takes a lock on the
+file, so run these while the API is stopped:
+
+    python -m backend.db.archive archive --older-than-days 90
+    python -m backend.db.archive export /backups/2024-06-01
+    python -m backend.db.archive import /backups/2024-06-01
+"""
+
+import argparse
+import glob
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+
+import duckdb
+
+HISTORY_COLUMNS = "id, user_uuid, question, image_url, response, timestamp"
+
+BATCHES_TABLE = """
+    CREATE TABLE IF NOT EXISTS history_archive_batches (
+        batch_id VARCHAR PRIMARY KEY,
+        rows BIGINT NOT NULL,
+        oldest TIMESTAMP NOT NULL,
+        newest TIMESTAMP NOT NULL,
+        archived_at TIMESTAMP NOT NULL
+    )
+"""
+
+# COPY ... APPEND insists on a {uuid} in the name; the batch id goes first
+BATCH_FILE = re.compile(r"^batch-(?P<batch>[0-9a-f]{32})-.+\.parquet$")
+
+
+def sql_path(path: str) -> str:
+    return "'" + path.replace("'", "''") + "'"
+
+
+def history_glob(directory: str) -> str:
+    return os.path.join(directory, "history", "*", "*.parquet")
+
+
+def batch_files(directory: str) -> dict[str, list[str]]:
+    files: dict[str, list[str]] = {}
+    for path in glob.glob(history_glob(directory)):
+        match = BATCH_FILE.match(os.path.basename(path))
+        if match:
+            files.setdefault(match["batch"], []).append(path)
+    return files
+
+
+def remove_orphans(con: duckdb.DuckDBPyConnection, directory: str) -> int:
+    """Delete archive files whose batch never committed."""
+    committed = {
+        row[0]
+        for row in con.execute(
+            "SELECT batch_id FROM history_archive_batches"
+        ).fetchall()
+    }
+    removed = 0
+    for batch, paths in batch_files(directory).items():
+        if batch not in committed:
+            for path in paths:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def create_views(con: duckdb.DuckDBPyConnection, directory: str):
+    # read_parquet fails on a glob without matches, so until the first batch
+    # the archive is an empty query with the same columns. `day` is the
+    # partition key; filtering on it skips whole directories
+    if batch_files(directory):
+        source = f"""
+            SELECT {HISTORY_COLUMNS}, day
+            FROM read_parquet({sql_path(history_glob(directory))}, hive_partitioning = true)
+        """
+    else:
+        source = (
+            f"SELECT {HISTORY_COLUMNS}, timestamp::DATE AS day FROM history WHERE false"
+        )
+    con.execute(f"CREATE OR REPLACE VIEW history_archive AS {source}")
+    con.execute(f"""
+        CREATE OR REPLACE VIEW history_all AS
+        SELECT {HISTORY_COLUMNS} FROM history
+        UNION ALL
+        SELECT {HISTORY_COLUMNS} FROM history_archive
+    """)
+
+
+def newest_archived(con: duckdb.DuckDBPyConnection):
+    return con.execute("SELECT max(newest) FROM history_archive_batches").fetchone()[0]
+
+
+def archive(con: duckdb.DuckDBPyConnection, directory: str, cutoff: datetime) -> int:
+    """Move history rows older than `cutoff` into a new Parquet batch.
+
+    Runs inside the caller's transaction; returns the number of rows moved.
+    """
+    rows, oldest, newest = con.execute(
+        "SELECT count(*), min(timestamp), max(timestamp) FROM history WHERE timestamp < ?",
+        (cutoff,),
+    ).fetchone()
+    if not rows:
+        return 0
+
+    batch = uuid.uuid4().hex
+    target = os.path.join(directory, "history")
+    os.makedirs(target, exist_ok=True)
+    # Sorted by user so each row group's min/max user_uuid statistics let a
+    # history lookup skip most of the file
+    con.execute(
+        f"""
+        COPY (
+            SELECT {HISTORY_COLUMNS}, timestamp::DATE AS day
+            FROM history
+            WHERE timestamp < ?
+            ORDER BY user_uuid, timestamp
+        ) TO {sql_path(target)} (
+            FORMAT PARQUET,
+            PARTITION_BY (day),
+            COMPRESSION ZSTD,
+            FILENAME_PATTERN 'batch-{batch}-{{uuid}}',
+            APPEND
+        )
+    """,
+        (cutoff,),
+    )
+    con.execute(
+        "INSERT INTO history_archive_batches VALUES (?, ?, ?, ?, ?)",
+        (batch, rows, oldest, newest, datetime.now()),
+    )
+    con.execute("DELETE FROM history WHERE timestamp < ?", (cutoff,))
+    return rows
+
+
+def export_data(con: duckdb.DuckDBPyConnection, directory: str) -> tuple[int, int]:
+    """Write all users and history (hot and archived) under `directory`."""
+    if os.path.exists(directory) and os.listdir(directory):
+        raise FileExistsError(f"Export directory is not empty: {directory}")
+    os.makedirs(directory, exist_ok=True)
+    users = con.execute(f"""
+        COPY (SELECT uuid, email, created_at FROM users ORDER BY uuid)
+        TO {sql_path(os.path.join(directory, "users.parquet"))} (FORMAT PARQUET)
+    """).fetchone()[0]
+    rows = con.execute(f"""
+        COPY (
+            SELECT {HISTORY_COLUMNS}, timestamp::DATE AS day
+            FROM history_all
+            ORDER BY user_uuid, timestamp
+        ) TO {sql_path(os.path.join(directory, "history"))} (
+            FORMAT PARQUET,
+            PARTITION_BY (day),
+            COMPRESSION ZSTD
+        )
+    """).fetchone()[0]
+    return users, rows
+
+
+def import_data(con: duckdb.DuckDBPyConnection, directory: str) -> tuple[int, int]:
+    """Load an export_data directory; runs inside the caller's transaction.
+
+    Users whose uuid or email already exists are kept as they are, and
+    history rows already present (hot or archived) are skipped, so the same
+    export can be imported twice. Returns the users and rows added.
+    """
+    users_before = con.execute("SELECT count(*) FROM users").fetchone()[0]
+    con.execute(f"""
+        INSERT OR IGNORE INTO users (uuid, email, created_at)
+        SELECT uuid, email, created_at
+        FROM read_parquet({sql_path(os.path.join(directory, "users.parquet"))})
+    """)
+    users = con.execute("SELECT count(*) FROM users").fetchone()[0] - users_before
+
+    if not glob.glob(history_glob(directory)):
+        return users, 0
+    # Rows of users that didn't import (their email belongs to someone else
+    # here) would break the foreign key
+    rows = con.execute(f"""
+        INSERT INTO history ({HISTORY_COLUMNS})
+        SELECT {HISTORY_COLUMNS}
+        FROM read_parquet({sql_path(history_glob(directory))}, hive_partitioning = true)
+        WHERE user_uuid IN (SELECT uuid FROM users)
+          AND id NOT IN (SELECT id FROM history_all)
+    """).fetchone()[0]
+    return users, rows
+
+
+def main():
+    from backend.db.database import Database
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive_parser = commands.add_parser("archive", help="archive old history rows")
+    archive_parser.add_argument("--older-than-days", type=float, required=True)
+    export_parser = commands.add_parser("export", help="export users and history")
+    export_parser.add_argument("directory")
+    import_parser = commands.add_parser("import", help="import an export")
+    import_parser.add_argument("directory")
+    args = parser.parse_args()
+
+    db = Database()
+    try:
+        db.initialize_db()
+        if args.command == "archive":
+            cutoff = datetime.now() - timedelta(days=args.older_than_days)
+            rows = db.archive_history(cutoff)
+            print(f"Archived {rows} history rows older than {cutoff:%Y-%m-%d %H:%M}")
+        elif args.command == "export":
+            users, rows = db.export_data(args.directory)
+            print(f"Exported {users} users and {rows} history rows")
+        else:
+            users, rows = db.import_data(args.directory)
+            print(f"Imported {users} users and {rows} history rows")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
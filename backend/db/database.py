@@ -1,33 +1,143 @@
-import duckdb
-import uuid
-from datetime import datetime
-from typing import Optional
+import base64
+import binascii
+import functools
 import os
+import threading
+import time
+import uuid
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timedelta
+
+import duckdb
 
-from backend.utils.consts import DB_PATH
 from backend.datamodels.datamodels import User
+from backend.db import analytics, archive
+from backend.utils.consts import ARCHIVE_DIR, DB_PATH
+from backend.utils.metrics import DB_OPERATION_SECONDS, HISTORY_ARCHIVED_ROWS
+
+# (id, user_uuid, question, image_url, response, timestamp)
+HistoryRow = tuple[uuid.UUID, str, str, str | None, str, datetime]
+
+
+def history_row(
+    user_uuid: str, question: str, response: str, image_url: str | None = None
+) -> HistoryRow:
+    # Id and timestamp are fixed when the entry is made, not when it's written
+    return (uuid.uuid4(), user_uuid, question, image_url, response, datetime.now())
+
+
+class InvalidCursor(ValueError):
+    """A history page cursor that wasn't produced by encode_cursor."""
+
+
+def encode_cursor(entry: dict) -> str:
+    # Opaque to clients: the (timestamp, id) key of the last entry on a page
+    raw = f"{entry['timestamp']}|{entry['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, entry_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), uuid.UUID(entry_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(f"Invalid history cursor: {cursor!r}") from None
+
+
+def timed(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            DB_OPERATION_SECONDS.labels(operation=fn.__name__).observe(
+                time.perf_counter() - start
+            )
+
+    return wrapper
+
+
+# get_user_history fetches pages up to this size row by row through the
+# primary key; larger limits are read in one pass
+KEYED_FETCH_MAX_ROWS = 200
+
+# Same text as datetime.isoformat(), which leaves out zero microseconds
+ISO_TIMESTAMP = """
+    CASE WHEN epoch_us(timestamp) % 1000000 = 0
+        THEN strftime(timestamp, '%Y-%m-%dT%H:%M:%S')
+        ELSE strftime(timestamp, '%Y-%m-%dT%H:%M:%S.%f')
+    END
+"""
+
+INSERT_HISTORY = """
+    INSERT INTO history (id, user_uuid, question, image_url, response, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
 
 
 class Database:
-    def __init__(self, db_path: str = DB_PATH):
+    def __init__(self, db_path: str = DB_PATH, archive_dir: str | None = None):
         self.db_path = db_path
+        # Parquet files of archived history; by default next to the database
+        # file, one directory per database
+        self.archive_dir = os.path.abspath(
+            archive_dir or ARCHIVE_DIR or os.path.splitext(db_path)[0] + "_archive"
+        )
+        # Newest archived timestamp: pages entirely newer than it never need
+        # to look at the archive
+        self._archived_until = None
         self.con = None
+        self._lock = threading.Lock()
+        # History writes all upsert the same few summary rows, which DuckDB's
+        # optimistic concurrency would reject from concurrent transactions
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._cursors = []
+        # Bumped on close so threads don't reuse cursors of an old connection
+        self._generation = 0
 
     def connect(self):
-        if os.path.dirname(self.db_path):
-            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        self.con = duckdb.connect(self.db_path)
+        with self._lock:
+            if self.con:
+                return
+            if os.path.dirname(self.db_path):
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self.con = duckdb.connect(self.db_path)
 
     def close(self):
-        if self.con:
-            self.con.close()
-            self.con = None
+        with self._lock:
+            for cursor in self._cursors:
+                cursor.close()
+            self._cursors = []
+            self._generation += 1
+            if self.con:
+                self.con.close()
+                self.con = None
 
-    def initialize_db(self):
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        """This thread's cursor on the shared connection.
+
+        A DuckDB connection object must not be used by several threads at
+        once; cursors share its database but are independent, so each
+        worker thread gets its own.
+        """
         if not self.con:
             self.connect()
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            with self._lock:
+                local.cursor = self.con.cursor()
+                local.generation = self._generation
+                self._cursors.append(local.cursor)
+        return local.cursor
 
-        self.con.execute("""
+    @timed
+    def initialize_db(self):
+        con = self.cursor()
+
+        con.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 uuid VARCHAR PRIMARY KEY,
                 email VARCHAR UNIQUE NOT NULL,
@@ -35,7 +145,7 @@ class Database:
             )
         """)
 
-        self.con.execute("""
+        con.execute("""
             CREATE TABLE IF NOT EXISTS history (
                 id UUID PRIMARY KEY,
                 user_uuid VARCHAR,
@@ -47,12 +157,30 @@ class Database:
             )
         """)
 
-    def add_user(self, user: User):
-        if not self.con:
-            self.connect()
+        # DuckDB only scans an index for equality on all of its columns, so
+        # get_user_history could never use one on (user_uuid, timestamp)
+        con.execute("""
+            CREATE INDEX IF NOT EXISTS history_user ON history (user_uuid)
+        """)
+
+        con.execute(archive.BATCHES_TABLE)
+        archive.remove_orphans(con, self.archive_dir)
+        archive.create_views(con, self.archive_dir)
+        self._archived_until = archive.newest_archived(con)
 
+        for table in analytics.TABLES:
+            con.execute(table)
+        # History written before the summaries existed is counted once
+        backfill = con.execute("""
+            SELECT EXISTS (FROM history) AND NOT EXISTS (FROM analytics_daily)
+        """).fetchone()[0]
+        if backfill:
+            self.rebuild_analytics()
+
+    @timed
+    def add_user(self, user: User):
         try:
-            self.con.execute(
+            self.cursor().execute(
                 """
                 INSERT INTO users (uuid, email) VALUES (?, ?)
             """,
@@ -62,55 +190,119 @@ class Database:
         except duckdb.ConstraintException:
             return False
 
-    def get_user(self, user_uuid: str) -> Optional[User]:
-        if not self.con:
-            self.connect()
-
-        result = self.con.execute(
-            """
+    @timed
+    def get_user(self, user_uuid: str) -> User | None:
+        result = (
+            self.cursor()
+            .execute(
+                """
             SELECT uuid, email FROM users WHERE uuid = ?
         """,
-            (user_uuid,),
-        ).fetchone()
+                (user_uuid,),
+            )
+            .fetchone()
+        )
+
+        if result:
+            return User(uuid=result[0], email=result[1])
+        return None
+
+    @timed
+    def get_user_by_email(self, email: str) -> User | None:
+        result = (
+            self.cursor()
+            .execute(
+                """
+            SELECT uuid, email FROM users WHERE email = ?
+        """,
+                (email,),
+            )
+            .fetchone()
+        )
 
         if result:
             return User(uuid=result[0], email=result[1])
         return None
 
+    @timed
     def add_history_entry(
         self,
         user_uuid: str,
         question: str,
         response: str,
-        image_url: Optional[str] = None,
+        image_url: str | None = None,
     ):
-        if not self.con:
-            self.connect()
+        row = history_row(user_uuid, question, response, image_url)
+        self._insert_history([row])
+        return row[0]
 
-        entry_id = uuid.uuid4()
-        self.con.execute(
-            """
-            INSERT INTO history (id, user_uuid, question, image_url, response, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """,
-            (entry_id, user_uuid, question, image_url, response, datetime.now()),
-        )
-        return entry_id
+    @timed
+    def add_history_entries(self, rows: Iterable[HistoryRow]):
+        """Insert many history rows in one transaction: all or none."""
+        self._insert_history(list(rows))
 
-    def get_user_history(self, user_uuid: str, limit: int = 50):
-        if not self.con:
-            self.connect()
+    def _insert_history(self, rows: list[HistoryRow]):
+        # The analytics summaries change in the same transaction, so they
+        # always agree with what was written
+        con = self.cursor()
+        with self._write_lock:
+            con.execute("BEGIN TRANSACTION")
+            try:
+                con.executemany(INSERT_HISTORY, rows)
+                analytics.update(con, rows)
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
 
-        results = self.con.execute(
-            """
-            SELECT id, question, image_url, response, timestamp 
-            FROM history 
-            WHERE user_uuid = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        """,
-            (user_uuid, limit),
-        ).fetchall()
+    @timed
+    def get_user_history(
+        self, user_uuid: str, limit: int = 50, before: str | None = None
+    ):
+        """Newest entries first, starting after the `before` cursor.
+
+        Keyset pagination on (timestamp, id): a page far back costs the same
+        as the first one, unlike OFFSET which reads and skips every newer row.
+        Archived entries are merged in once the page reaches back to them.
+        """
+        params = [user_uuid]
+        after_cursor = "TRUE"
+        timestamp = None
+        if before:
+            timestamp, entry_id = decode_cursor(before)
+            after_cursor = "timestamp < ? OR (timestamp = ? AND id < ?)"
+            params += [timestamp, timestamp, entry_id]
+
+        con = self.cursor()
+        if limit > KEYED_FETCH_MAX_ROWS:
+            # Past a page or so, reading the rows in one pass beats fetching
+            # each one through the primary key
+            results = con.execute(
+                f"""
+                SELECT id, question, image_url, response, timestamp
+                FROM history
+                WHERE user_uuid = ? AND ({after_cursor})
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            """,
+                (*params, limit),
+            ).fetchall()
+        else:
+            results = self._history_page(con, params, after_cursor, limit)
+
+        archived_until = self._archived_until
+        if archived_until is not None and (
+            len(results) < limit or results[-1][4] <= archived_until
+        ):
+            # Archived rows are normally all older than the hot ones, but an
+            # import can put old rows back in history, so merge rather than
+            # append
+            archived = self._archived_page(
+                con, params, after_cursor, limit, timestamp or archived_until
+            )
+            results = sorted(
+                results + archived, key=lambda row: (row[4], row[0]), reverse=True
+            )[:limit]
 
         history = []
         for row in results:
@@ -125,6 +317,213 @@ class Database:
             )
         return history
 
+    def _history_page(self, con, params, after_cursor, limit):
+        # Left to itself DuckDB plans this as a top-N over the whole table,
+        # which gets slower as the table grows. Instead the user_uuid index
+        # finds the user's (id, timestamp) keys, MATERIALIZED keeps them
+        # from being folded back into that plan, and only the page's rows
+        # are then fetched by primary key
+        keys = con.execute(
+            f"""
+            WITH entries AS MATERIALIZED (
+                SELECT id, timestamp FROM history WHERE user_uuid = ?
+            )
+            SELECT id FROM entries
+            WHERE {after_cursor}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        """,
+            (*params, limit),
+        ).fetchall()
+        if not keys:
+            return []
+
+        return con.execute(
+            f"""
+            SELECT id, question, image_url, response, timestamp
+            FROM history
+            WHERE id IN ({", ".join("?" * len(keys))})
+            ORDER BY timestamp DESC, id DESC
+        """,
+            [key[0] for key in keys],
+        ).fetchall()
+
+    def _archived_page(self, con, params, after_cursor, limit, newest):
+        # The day filter skips partitions newer than the page outright
+        return con.execute(
+            f"""
+            SELECT id, question, image_url, response, timestamp
+            FROM history_archive
+            WHERE user_uuid = ? AND ({after_cursor}) AND day <= ?
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        """,
+            (*params, newest.date(), limit),
+        ).fetchall()
+
+    @timed
+    def get_image_urls(self) -> set:
+        # Archived rows still reference their uploads
+        results = (
+            self.cursor()
+            .execute(
+                """
+            SELECT DISTINCT image_url FROM history_all WHERE image_url IS NOT NULL
+        """
+            )
+            .fetchall()
+        )
+        return {row[0] for row in results}
+
+    @timed
+    def get_archived_image_urls(self) -> set:
+        results = (
+            self.cursor()
+            .execute(
+                """
+            SELECT DISTINCT image_url FROM history_archive WHERE image_url IS NOT NULL
+        """
+            )
+            .fetchall()
+        )
+        return {row[0] for row in results}
+
+    @timed
+    def replace_image_url(self, old: str, new: str) -> bool:
+        """Point history at a re-encoded upload; False if archived rows use it.
+
+        Archived rows live in Parquet files that aren't rewritten, so an
+        upload they reference has to stay where it is.
+        """
+        con = self.cursor()
+        with self._write_lock:
+            con.execute("BEGIN TRANSACTION")
+            try:
+                archived = con.execute(
+                    "SELECT EXISTS (FROM history_archive WHERE image_url = ?)", (old,)
+                ).fetchone()[0]
+                if not archived:
+                    con.execute(
+                        "UPDATE history SET image_url = ? WHERE image_url = ?",
+                        (new, old),
+                    )
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+        return not archived
+
+    @timed
+    def archive_history(self, cutoff: datetime) -> int:
+        """Move history older than `cutoff` to Parquet; returns rows moved."""
+        con = self.cursor()
+        with self._write_lock:
+            con.execute("BEGIN TRANSACTION")
+            try:
+                rows = archive.archive(con, self.archive_dir, cutoff)
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                archive.remove_orphans(con, self.archive_dir)
+                raise
+            if rows:
+                archive.create_views(con, self.archive_dir)
+                self._archived_until = archive.newest_archived(con)
+                # Writes the deletes out so their blocks can be reused
+                # instead of the file growing
+                con.execute("CHECKPOINT")
+        HISTORY_ARCHIVED_ROWS.inc(rows)
+        return rows
+
+    @timed
+    def export_data(self, directory: str):
+        """Write users and all of history to Parquet files in `directory`."""
+        return archive.export_data(self.cursor(), directory)
+
+    @timed
+    def import_data(self, directory: str):
+        """Load an export_data directory, skipping what's already here."""
+        con = self.cursor()
+        with self._write_lock:
+            con.execute("BEGIN TRANSACTION")
+            try:
+                users, rows = archive.import_data(con, directory)
+                if rows:
+                    analytics.rebuild(con, "history_all")
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+        return users, rows
+
+    @timed
+    def rebuild_analytics(self):
+        con = self.cursor()
+        with self._write_lock:
+            con.execute("BEGIN TRANSACTION")
+            try:
+                analytics.rebuild(con, "history_all")
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+
+    @timed
+    def get_requests_per_day(self, days: int = 30):
+        since = datetime.now().date() - timedelta(days=days - 1)
+        return analytics.requests_per_day(self.cursor(), since)
+
+    @timed
+    def get_user_activity(self, limit: int = 50, user_uuid: str | None = None):
+        return analytics.user_activity(self.cursor(), limit, user_uuid)
+
+    @timed
+    def get_length_distributions(self):
+        return analytics.length_distributions(self.cursor())
+
+    @timed
+    def get_image_reuse(self):
+        return analytics.image_reuse(self.cursor())
+
+    def iter_user_history_json(
+        self, user_uuid: str, batch_size: int = 1000
+    ) -> Iterator[list[str]]:
+        """A user's whole history, newest first, as batches of JSON objects.
+
+        The objects match get_user_history's dicts but are rendered by
+        DuckDB's vectorized to_json, so no Python object is built per row.
+        The query gets its own cursor, since batches may be pulled from
+        different threads.
+        """
+        start = time.perf_counter()
+        con = self.cursor().cursor()
+        try:
+            con.execute(
+                f"""
+                SELECT to_json({{
+                    'id': id,
+                    'question': question,
+                    'image_url': image_url,
+                    'response': response,
+                    'timestamp': {ISO_TIMESTAMP}
+                }})
+                FROM history_all
+                WHERE user_uuid = ?
+                ORDER BY timestamp DESC, id DESC
+            """,
+                (user_uuid,),
+            )
+            while True:
+                rows = con.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+        finally:
+            con.close()
+            DB_OPERATION_SECONDS.labels(operation="iter_user_history_json").observe(
+                time.perf_counter() - start
+            )
+
 
 if __name__ == "__main__":
     db = Database()
@@ -0,0 +1,128 @@
+import asyncio
+
+import duckdb
+
+from backend.db.database import Database, HistoryRow, history_row
+from backend.executors import Executors
+from backend.utils.metrics import (
+    DB_ERRORS,
+    HISTORY_WRITER_BATCH_SIZE,
+    HISTORY_WRITER_PENDING,
+)
+
+
+class HistoryWriter:
+    """Queues history inserts and writes them in batched transactions.
+
+    A batch is written once `batch_size` entries are waiting or the oldest
+    has waited `flush_interval` seconds, whichever comes first, so requests
+    don't wait on DuckDB at all. Only when `max_pending` entries pile up
+    does a request help flush before queueing its own. The inserts run on
+    the executors' DB pool, like the API's other database calls.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        executors: Executors,
+        batch_size: int = 100,
+        flush_interval: float = 0.1,
+        max_pending: int = 10000,
+    ):
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max(self.batch_size, max_pending)
+        self.executors = executors
+        self._pending: list[HistoryRow] = []
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closed = False
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def submit(
+        self,
+        user_uuid: str,
+        question: str,
+        response: str,
+        image_url: str | None = None,
+    ):
+        row = history_row(user_uuid, question, response, image_url)
+        if self._closed:
+            await self._write([row])
+            return row[0]
+        if len(self._pending) >= self.max_pending:
+            # The writer is falling behind; wait rather than grow without bound
+            await self.flush()
+        self._pending.append(row)
+        self._update_pending()
+        return row[0]
+
+    async def flush(self):
+        """Write everything queued so far; returns once it's in the database."""
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[: self.batch_size]
+                del self._pending[: self.batch_size]
+                self._update_pending()
+                await self._write(batch)
+
+    async def close(self):
+        self._closed = True
+        if self._task is not None:
+            self._has_pending.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def _update_pending(self):
+        HISTORY_WRITER_PENDING.set(len(self._pending))
+        if self._pending:
+            self._has_pending.set()
+        else:
+            self._has_pending.clear()
+        if len(self._pending) >= self.batch_size:
+            self._batch_full.set()
+        else:
+            self._batch_full.clear()
+
+    async def _loop(self):
+        while not self._closed:
+            await self._has_pending.wait()
+            if self._closed:
+                return
+            if not self._batch_full.is_set():
+                # Give concurrent requests a moment to join the batch
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+                except TimeoutError:
+                    pass
+            await self.flush()
+
+    async def _write(self, batch: list[HistoryRow]):
+        HISTORY_WRITER_BATCH_SIZE.observe(len(batch))
+        try:
+            await self.executors.run("db", self.db.add_history_entries, batch)
+            return
+        except duckdb.Error as e:
+            if len(batch) == 1:
+                DB_ERRORS.labels(operation="save_history").inc()
+                print(f"Failed to save history: {e}")
+                return
+            DB_ERRORS.labels(operation="save_history_batch").inc()
+        # One bad row (say, an unknown user) fails the whole transaction;
+        # write the rest one by one so only that row is lost
+        for row in batch:
+            try:
+                await self.executors.run("db", self.db.add_history_entries, [row])
+            except duckdb.Error as e:
+                DB_ERRORS.labels(operation="save_history").inc()
+                print(f"Failed to save history: {e}")
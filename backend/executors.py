@@ -0,0 +1,78 @@
+import asyncio
+import contextvars
+import functools
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.utils.metrics import EVENT_LOOP_LAG, EXECUTOR_QUEUE_SECONDS
+
+
+class Executors:
+    """Bounded thread pools for the blocking work async handlers await.
+
+    DB queries, file I/O and image decoding each get their own pool so a
+    burst of one kind (say, large uploads being decoded) can't take every
+    thread the others need, and none of it runs on the event loop.
+    """
+
+    def __init__(
+        self, db_threads: int = 1, io_threads: int = 8, decode_threads: int = 4
+    ):
+        sizes = {"db": db_threads, "io": io_threads, "decode": decode_threads}
+        self._pools: dict[str, ThreadPoolExecutor] = {
+            name: ThreadPoolExecutor(max_workers=max(1, size), thread_name_prefix=name)
+            for name, size in sizes.items()
+        }
+
+    async def run(self, pool: str, fn: Callable, *args, **kwargs):
+        submitted = time.perf_counter()
+
+        def call():
+            EXECUTOR_QUEUE_SECONDS.labels(pool=pool).observe(
+                time.perf_counter() - submitted
+            )
+            return fn(*args, **kwargs)
+
+        # Like starlette's run_in_threadpool, carry contextvars into the thread
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._pools[pool], functools.partial(context.run, call)
+        )
+
+    def shutdown(self, wait: bool = True):
+        for executor in self._pools.values():
+            executor.shutdown(wait=wait)
+
+
+class LoopLagMonitor:
+    """Records how late the event loop wakes up from a fixed sleep.
+
+    Any time past `interval` is time the loop spent running something else
+    without yielding, which every other request on it had to wait out.
+    """
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - self.interval))
@@ -1,28 +1,159 @@
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from threading import Lock, Thread
+
+import torch
 from PIL import Image
 from qwen_vl_utils import process_vision_info
-import time
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from transformers.modeling_outputs import BaseModelOutputWithPooling
 
+from backend.cache.prefix_cache import PrefixKVCache
+from backend.cache.response_cache import image_content_hash
+from backend.cache.vision_cache import VisionFeatures
+from backend.cancellation import RequestCancelled, RequestContext
+from backend.speculative import (
+    prompt_lookup_kwargs,
+    record_acceptance,
+    track_draft_acceptance,
+)
 
-def query_local(model, processor, device, image: Image.Image, question: str):
-    start_time = time.time()
-    print("starting local inference at: %s" % (start_time))
-    if not image:
-        raise ValueError("Missing image")
+MAX_NEW_TOKENS = 512
+PROMPT_LOOKUP_NGRAM = 3
+WARMUP_MAX_NEW_TOKENS = 8
+
+PRECISION_DTYPES = {
+    "fp32": torch.float32,
+    "bf16": torch.bfloat16,
+    "int8": torch.float32,  # Weights are loaded in fp32, then quantized
+}
+
+# Math Tutor Prompt Engineering
+# Qwen2-VL keeps per-generation state on the module (model.model.rope_deltas),
+# so generate() calls on one model must never overlap. The batcher thread,
+# streams and warmup all generate under this lock
+GENERATE_LOCK = Lock()
+
+SYSTEM_PROMPT = "You are a patient and helpful math tutor. Help the student solve the math problem shown in the image. Show your work step-by-step."
+
+
+def precision_dtype(precision: str) -> torch.dtype:
+    if precision not in PRECISION_DTYPES:
+        raise ValueError(
+            f"Unknown precision {precision!r}, expected one of {list(PRECISION_DTYPES)}"
+        )
+    return PRECISION_DTYPES[precision]
 
-    # Math Tutor Prompt Engineering
-    system_prompt = "You are a patient and helpful math tutor. Help the student solve the math problem shown in the image. Show your work step-by-step."
-    full_prompt = f"{system_prompt}\n\nQuestion: {question}"
 
-    messages = [
+def apply_precision(model, precision: str, device: str):
+    # bf16 is handled at load time through precision_dtype; int8 swaps every
+    # nn.Linear for a dynamically quantized one (weights int8, activations
+    # quantized on the fly), which only has CPU kernels
+    if precision == "int8":
+        if device != "cpu":
+            raise ValueError("int8 dynamic quantization is only supported on CPU")
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return model.eval()
+
+
+class CancellationCriteria(StoppingCriteria):
+    """Stops each sequence whose request was cancelled, timed out or used up
+    its own token budget; checked after every generated token."""
+
+    def __init__(self, contexts: list[RequestContext | None], prompt_length: int):
+        self.contexts = contexts
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids.shape[1] - self.prompt_length
+        done = [
+            context is not None
+            and (
+                context.should_stop()
+                or (
+                    context.max_new_tokens is not None
+                    and generated >= context.max_new_tokens
+                )
+            )
+            for context in self.contexts
+        ]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+def generation_limits(
+    contexts: list[RequestContext | None], prompt_length: int
+) -> dict:
+    if all(context is None for context in contexts):
+        return {"max_new_tokens": MAX_NEW_TOKENS}
+    # generate() runs to the largest budget; rows with a smaller one are
+    # finished early by the stopping criterion
+    budgets = [
+        min(context.max_new_tokens or MAX_NEW_TOKENS, MAX_NEW_TOKENS)
+        if context is not None
+        else MAX_NEW_TOKENS
+        for context in contexts
+    ]
+    return {
+        "max_new_tokens": max(budgets),
+        "stopping_criteria": StoppingCriteriaList(
+            [CancellationCriteria(contexts, prompt_length)]
+        ),
+    }
+
+
+def build_messages(image: Image.Image, question: str):
+    # The tutor instructions go in the system turn so every prompt starts with
+    # the same tokens, which lets the prefix KV cache skip their prefill
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
         {
             "role": "user",
             "content": [
                 {"type": "image", "image": image},
-                {"type": "text", "text": full_prompt},
+                {"type": "text", "text": f"Question: {question}"},
             ],
-        }
+        },
     ]
 
+
+def prompt_prefix(processor) -> str:
+    # Everything the chat template renders before the first image token is
+    # identical for every request
+    template = processor.apply_chat_template(
+        build_messages(None, ""), tokenize=False, add_generation_prompt=True
+    )
+    return template[: template.index(processor.image_token)]
+
+
+def build_prefix_cache(model, processor, device) -> PrefixKVCache:
+    # The prefill resets rope_deltas too, so it mustn't overlap a generation
+    with GENERATE_LOCK:
+        return PrefixKVCache.build(model, processor, device, prompt_prefix(processor))
+
+
+def prefix_cache_kwargs(model, inputs, prefix_cache) -> dict:
+    if prefix_cache is None or not prefix_cache.is_valid_for(
+        model, inputs["input_ids"]
+    ):
+        return {}
+    return {"past_key_values": prefix_cache.fresh_cache()}
+
+
+@contextmanager
+def exclusive_generation(model, generate_kwargs: dict):
+    with GENERATE_LOCK:
+        if "past_key_values" in generate_kwargs:
+            # Force the 3D rope positions to be recomputed over the whole
+            # prompt instead of reusing the previous request's deltas. Only
+            # safe here: another thread's generation would lose its positions
+            model.model.rope_deltas = None
+        yield
+
+
+def prepare_inputs(processor, device, messages):
     text = processor.apply_chat_template(
         messages, tokenize=False, add_generation_prompt=True
     )
@@ -33,9 +164,98 @@ def query_local(model, processor, device, image: Image.Image, question: str):
         text=text, images=images, videos=video_inputs, padding=True, return_tensors="pt"
     )
 
-    inputs = inputs.to(device)
+    return inputs.to(device)
+
+
+def prepare_cached_inputs(model, processor, device, messages, image, vision_cache):
+    # Same as prepare_inputs, but the vision tower output is looked up by image
+    # content and handed to generate() as mm_encoder_outputs, so a follow-up
+    # question on the same image only pays for text prefill and decode
+    image_key = image_content_hash(image)
+    features = vision_cache.get(image_key)
+
+    text = processor.apply_chat_template(
+        messages, tokenize=False, add_generation_prompt=True
+    )
+
+    if features is None:
+        images, video_inputs = process_vision_info(messages)
+        inputs = processor(
+            text=text,
+            images=images,
+            videos=video_inputs,
+            padding=True,
+            return_tensors="pt",
+        ).to(device)
+
+        pixel_values = inputs.pop("pixel_values")
+        with torch.inference_mode():
+            vision = model.get_image_features(
+                pixel_values, inputs["image_grid_thw"], return_dict=True
+            )
+        features = VisionFeatures(
+            image_grid_thw=inputs["image_grid_thw"],
+            image_embeds=tuple(t.detach() for t in vision.pooler_output),
+        )
+        vision_cache.put(image_key, features)
+    else:
+        # Expand the image placeholder ourselves and only run the tokenizer
+        image_tokens = processor.replace_image_token(
+            {"image_grid_thw": features.image_grid_thw}, image_idx=0
+        )
+        text = text.replace(processor.image_token, image_tokens, 1)
+        inputs = processor(text=text, padding=True, return_tensors="pt").to(device)
+        inputs["image_grid_thw"] = features.image_grid_thw
+
+    mm_encoder_outputs = {
+        "image": BaseModelOutputWithPooling(pooler_output=features.image_embeds)
+    }
+    return inputs, {"mm_encoder_outputs": mm_encoder_outputs}
+
+
+def query_local(
+    model,
+    processor,
+    device,
+    image: Image.Image,
+    question: str,
+    vision_cache=None,
+    prefix_cache=None,
+    prompt_lookup_tokens: int = 0,
+    prompt_lookup_ngram: int = PROMPT_LOOKUP_NGRAM,
+    context: RequestContext | None = None,
+):
+    start_time = time.time()
+    print("starting local inference at: %s" % (start_time))
+    if not image:
+        raise ValueError("Missing image")
+
+    messages = build_messages(image, question)
+    if vision_cache is not None:
+        inputs, generate_kwargs = prepare_cached_inputs(
+            model, processor, device, messages, image, vision_cache
+        )
+    else:
+        inputs, generate_kwargs = prepare_inputs(processor, device, messages), {}
+    speculative = prompt_lookup_kwargs(prompt_lookup_tokens, prompt_lookup_ngram)
+    if speculative:
+        generate_kwargs.update(speculative)
+    else:
+        # Prompt lookup diverges from greedy decoding when generate() starts
+        # from a pre-filled KV cache, so the two are not combined
+        generate_kwargs.update(prefix_cache_kwargs(model, inputs, prefix_cache))
 
-    generated_ids = model.generate(**inputs, max_new_tokens=512)
+    generate_kwargs.update(generation_limits([context], len(inputs.input_ids[0])))
+
+    with (
+        exclusive_generation(model, generate_kwargs),
+        track_draft_acceptance(model, enabled=bool(speculative)) as draft_stats,
+    ):
+        generated_ids = model.generate(**inputs, **generate_kwargs)
+    if speculative:
+        record_acceptance(draft_stats, len(generated_ids[0]) - len(inputs.input_ids[0]))
+    if context is not None:
+        context.check()
 
     print("inputs generated")
     generated_ids_trimmed = [
@@ -55,3 +275,165 @@ def query_local(model, processor, device, image: Image.Image, question: str):
     print("local %s --- " % (time.time() - start_time))
 
     return output_text[0]
+
+
+def warmup_local(model, processor, device, **query_kwargs):
+    # One short generation on a blank image so lazy init, kernel selection and
+    # allocator growth happen before the first real request
+    image = Image.new("RGB", (112, 112), color="white")
+    context = RequestContext(max_new_tokens=WARMUP_MAX_NEW_TOKENS)
+    return query_local(
+        model, processor, device, image, "What is 1+1?", context=context, **query_kwargs
+    )
+
+
+def query_local_batch(
+    model,
+    processor,
+    device,
+    images: list[Image.Image],
+    questions: list[str],
+    contexts: list[RequestContext | None] | None = None,
+) -> list[str]:
+    start_time = time.time()
+    print(f"starting batched local inference ({len(images)}) at: {start_time}")
+    if len(images) != len(questions):
+        raise ValueError("Images and questions must have the same length")
+    if not all(images):
+        raise ValueError("Missing image")
+
+    conversations = [
+        build_messages(image, question) for image, question in zip(images, questions)
+    ]
+
+    texts = [
+        processor.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+        for messages in conversations
+    ]
+
+    batch_images, video_inputs = process_vision_info(conversations)
+
+    # Decoder-only generation needs left padding so every prompt ends at the
+    # same position and new tokens line up across the batch
+    inputs = processor(
+        text=texts,
+        images=batch_images,
+        videos=video_inputs,
+        padding=True,
+        padding_side="left",
+        return_tensors="pt",
+    )
+
+    inputs = inputs.to(device)
+
+    if contexts is None:
+        contexts = [None] * len(images)
+    with GENERATE_LOCK:
+        generated_ids = model.generate(
+            **inputs, **generation_limits(contexts, len(inputs.input_ids[0]))
+        )
+
+    generated_ids_trimmed = [
+        out_ids[len(in_ids) :]
+        for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+    ]
+
+    output_text = processor.batch_decode(
+        generated_ids_trimmed,
+        skip_special_tokens=True,
+        clean_up_tokenization_spaces=False,
+    )
+
+    print("local batch %s --- " % (time.time() - start_time))
+
+    # Rows stopped by their own cancellation or deadline get the exception
+    # in place of the partial text
+    return [
+        RequestCancelled(context.reason)
+        if context is not None and context.should_stop()
+        else text
+        for context, text in zip(contexts, output_text)
+    ]
+
+
+def stream_local(
+    model,
+    processor,
+    device,
+    image: Image.Image,
+    question: str,
+    vision_cache=None,
+    prefix_cache=None,
+    prompt_lookup_tokens: int = 0,
+    prompt_lookup_ngram: int = PROMPT_LOOKUP_NGRAM,
+    context: RequestContext | None = None,
+) -> Iterator[str]:
+    start_time = time.time()
+    print(f"starting local streaming inference at: {start_time}")
+    if not image:
+        raise ValueError("Missing image")
+
+    messages = build_messages(image, question)
+    if vision_cache is not None:
+        inputs, generate_kwargs = prepare_cached_inputs(
+            model, processor, device, messages, image, vision_cache
+        )
+    else:
+        inputs, generate_kwargs = prepare_inputs(processor, device, messages), {}
+    speculative = prompt_lookup_kwargs(prompt_lookup_tokens, prompt_lookup_ngram)
+    if speculative:
+        generate_kwargs.update(speculative)
+    else:
+        # Prompt lookup diverges from greedy decoding when generate() starts
+        # from a pre-filled KV cache, so the two are not combined
+        generate_kwargs.update(prefix_cache_kwargs(model, inputs, prefix_cache))
+    generate_kwargs.update(generation_limits([context], len(inputs.input_ids[0])))
+
+    streamer = TextIteratorStreamer(
+        processor.tokenizer,
+        skip_prompt=True,
+        skip_special_tokens=True,
+        clean_up_tokenization_spaces=False,
+    )
+
+    errors = []
+
+    # generate() blocks until done, so it runs on its own thread and pushes
+    # decoded text into the streamer as tokens are produced
+    def generate():
+        try:
+            with (
+                exclusive_generation(model, generate_kwargs),
+                track_draft_acceptance(model, enabled=bool(speculative)) as stats,
+            ):
+                generated_ids = model.generate(
+                    **inputs, **generate_kwargs, streamer=streamer
+                )
+            if speculative:
+                record_acceptance(
+                    stats, len(generated_ids[0]) - len(inputs.input_ids[0])
+                )
+        except Exception as e:  # noqa: BLE001 - re-raised by the consumer
+            errors.append(e)
+            streamer.end()  # Unblock the consumer
+
+    generation = Thread(target=generate, daemon=True)
+    generation.start()
+
+    for text in streamer:
+        if text:
+            yield text
+    # Only reached once the streamer has ended, so the join is quick. A
+    # consumer that stops early (a disconnected client) closes the generator
+    # at the yield, possibly on the event loop, and mustn't wait for a thread
+    # that may still be queued behind a batch; that one stops by itself at
+    # the cancelled context
+    generation.join()
+    print(f"local stream {time.time() - start_time} --- ")
+
+    if errors:
+        raise errors[0]
+    if context is not None:
+        context.check()
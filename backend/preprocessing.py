@@ -0,0 +1,73 @@
+import math
+from typing import BinaryIO
+
+from PIL import Image, ImageOps
+
+from backend.utils.consts import IMAGE_MAX_VISION_TOKENS, IMAGE_MIN_VISION_TOKENS
+from backend.utils.metrics import IMAGE_VISION_TOKENS
+
+# Qwen2-VL cuts images into 14px patches and merges 2x2 patches into one
+# vision token, so every token covers a 28x28 pixel cell
+PATCH_SIZE = 14
+MERGE_SIZE = 2
+TOKEN_CELL = PATCH_SIZE * MERGE_SIZE
+
+
+def vision_token_count(width: int, height: int) -> int:
+    return (width // TOKEN_CELL) * (height // TOKEN_CELL)
+
+
+def fit_to_vision_budget(
+    width: int,
+    height: int,
+    max_tokens: int = IMAGE_MAX_VISION_TOKENS,
+    min_tokens: int = IMAGE_MIN_VISION_TOKENS,
+) -> tuple[int, int]:
+    # Same rounding as the Qwen2-VL image processor: snap both sides to the
+    # token grid, then scale down (or up) to stay within the token budget
+    max_pixels = max_tokens * TOKEN_CELL * TOKEN_CELL
+    min_pixels = min_tokens * TOKEN_CELL * TOKEN_CELL
+
+    new_h = max(TOKEN_CELL, round(height / TOKEN_CELL) * TOKEN_CELL)
+    new_w = max(TOKEN_CELL, round(width / TOKEN_CELL) * TOKEN_CELL)
+
+    if new_h * new_w > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        new_h = max(TOKEN_CELL, math.floor(height / beta / TOKEN_CELL) * TOKEN_CELL)
+        new_w = max(TOKEN_CELL, math.floor(width / beta / TOKEN_CELL) * TOKEN_CELL)
+    elif new_h * new_w < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        new_h = math.ceil(height * beta / TOKEN_CELL) * TOKEN_CELL
+        new_w = math.ceil(width * beta / TOKEN_CELL) * TOKEN_CELL
+
+    return new_w, new_h
+
+
+def preprocess_image(
+    source: str | BinaryIO | Image.Image,
+    max_tokens: int = IMAGE_MAX_VISION_TOKENS,
+    min_tokens: int = IMAGE_MIN_VISION_TOKENS,
+) -> Image.Image:
+    image = source if isinstance(source, Image.Image) else Image.open(source)
+
+    width, height = image.size
+    target = fit_to_vision_budget(width, height, max_tokens, min_tokens)
+
+    # JPEG can decode straight at 1/2, 1/4 or 1/8 scale. draft() picks the
+    # smallest scale that is still at least the target size, so a 12 MP photo
+    # never gets fully decoded just to be thrown away by the resize below
+    if image.format == "JPEG" and target[0] * target[1] < width * height:
+        image.draft("RGB", target)
+
+    # Phone photos are often stored sideways with an EXIF orientation tag
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    # Orientation may have swapped width and height
+    target = fit_to_vision_budget(*image.size, max_tokens, min_tokens)
+    if image.size != target:
+        image = image.resize(target, Image.Resampling.LANCZOS)
+
+    IMAGE_VISION_TOKENS.observe(vision_token_count(*image.size))
+    return image
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+
+import httpx
+
+from backend.utils.metrics import (
+    REMOTE_ATTEMPTS,
+    REMOTE_BYTES_SENT,
+    REMOTE_HEDGES,
+    REMOTE_IN_FLIGHT,
+)
+
+# Worth retrying: rate limiting and transient upstream failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RemoteError(Exception):
+    """The remote model call failed, after retries where they applied."""
+
+    def __init__(
+        self,
+        message: str,
+        status: int | None = None,
+        retry_after: float | None = None,
+    ):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status in RETRY_STATUSES
+
+
+def status_error(response: httpx.Response) -> RemoteError:
+    return RemoteError(
+        f"Remote returned {response.status_code}: {response.text[:200]}",
+        status=response.status_code,
+        retry_after=retry_after_seconds(response),
+    )
+
+
+def retry_after_seconds(response: httpx.Response) -> float | None:
+    try:
+        return max(0.0, float(response.headers["retry-after"]))
+    except (KeyError, ValueError):
+        return None
+
+
+class RemoteEngine:
+    """Asyncio client for the remote model's OpenAI-compatible chat API.
+
+    Every request shares one pooled keep-alive httpx client and a semaphore
+    caps the calls in flight. Each attempt has its own timeout, and 429/5xx
+    responses or transport errors are retried with full-jitter exponential
+    backoff. With hedging on, a call that runs past the chosen latency
+    percentile gets a second copy and whichever answers first wins.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        token: str | None = None,
+        max_concurrency: int = 64,
+        timeout: float = 60.0,
+        connect_timeout: float = 5.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.25,
+        backoff_max: float = 8.0,
+        hedge_percentile: float = 0.0,
+        hedge_min_samples: int = 20,
+        latency_window: int = 200,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = max(1, hedge_min_samples)
+
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self._client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            headers=headers,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+            transport=transport,
+        )
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._latencies = deque(maxlen=latency_window)
+
+    async def close(self):
+        await self._client.aclose()
+
+    def hedge_delay(self) -> float | None:
+        if self.hedge_percentile <= 0 or len(self._latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+        return ordered[index]
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def _payload(self, messages: list[dict], max_tokens: int, stream: bool) -> bytes:
+        payload = {"model": self.model, "messages": messages, "max_tokens": max_tokens}
+        if stream:
+            payload["stream"] = True
+        # Serialized once per call; retries and hedges resend the same bytes
+        return json.dumps(payload).encode("utf-8")
+
+    def _post_kwargs(self, body: bytes) -> dict:
+        REMOTE_BYTES_SENT.inc(len(body))
+        return {"content": body, "headers": {"Content-Type": "application/json"}}
+
+    async def _attempt(self, payload: bytes) -> str:
+        async with self._semaphore:
+            REMOTE_IN_FLIGHT.inc()
+            start = time.perf_counter()
+            try:
+                # wait_for bounds the whole attempt, not just each socket read
+                response = await asyncio.wait_for(
+                    self._client.post(
+                        "/chat/completions", **self._post_kwargs(payload)
+                    ),
+                    self.timeout,
+                )
+            finally:
+                REMOTE_IN_FLIGHT.dec()
+        if response.status_code >= 400:
+            raise status_error(response)
+        self._latencies.append(time.perf_counter() - start)
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def _call(self, payload: bytes) -> str:
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await self._attempt(payload)
+                REMOTE_ATTEMPTS.labels(result="success").inc()
+                return result
+            except (httpx.TransportError, TimeoutError) as e:
+                error = RemoteError(f"Remote request failed: {type(e).__name__}: {e}")
+            except RemoteError as e:
+                error = e
+
+            if not error.retryable or attempt == self.max_retries:
+                REMOTE_ATTEMPTS.labels(result="failed").inc()
+                raise error
+            REMOTE_ATTEMPTS.labels(result="retried").inc()
+            await asyncio.sleep(self.backoff(attempt, error.retry_after))
+
+    async def chat(self, messages: list[dict], max_tokens: int) -> str:
+        payload = self._payload(messages, max_tokens, stream=False)
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._call(payload)
+
+        primary = asyncio.ensure_future(self._call(payload))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            REMOTE_HEDGES.labels(outcome="launched").inc()
+            hedge = asyncio.ensure_future(self._call(payload))
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            REMOTE_HEDGES.labels(outcome="won").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The loser (or both, if our caller gave up) is cancelled
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def stream_chat(
+        self, messages: list[dict], max_tokens: int
+    ) -> AsyncIterator[str]:
+        # Retried only until the first token; after that a failure surfaces
+        # to the caller since the partial answer has already been sent
+        payload = self._payload(messages, max_tokens, stream=True)
+        for attempt in range(self.max_retries + 1):
+            yielded = False
+            try:
+                async with self._semaphore:
+                    REMOTE_IN_FLIGHT.inc()
+                    try:
+                        async with self._client.stream(
+                            "POST", "/chat/completions", **self._post_kwargs(payload)
+                        ) as response:
+                            if response.status_code >= 400:
+                                await response.aread()
+                                raise status_error(response)
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[len("data:") :].strip()
+                                if data == "[DONE]":
+                                    break
+                                choices = json.loads(data).get("choices") or []
+                                if not choices:
+                                    continue
+                                delta = (choices[0].get("delta") or {}).get("content")
+                                if delta:
+                                    yielded = True
+                                    yield delta
+                    finally:
+                        REMOTE_IN_FLIGHT.dec()
+                REMOTE_ATTEMPTS.labels(result="success").inc()
+                return
+            except httpx.TransportError as e:
+                error = RemoteError(f"Remote request failed: {type(e).__name__}: {e}")
+            except RemoteError as e:
+                error = e
+
+            if yielded or not error.retryable or attempt == self.max_retries:
+                REMOTE_ATTEMPTS.labels(result="failed").inc()
+                raise error
+            REMOTE_ATTEMPTS.labels(result="retried").inc()
+            await asyncio.sleep(self.backoff(attempt, error.retry_after))
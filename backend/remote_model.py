@@ -1,24 +1,92 @@
-from huggingface_hub import InferenceClient
-from PIL import Image
-import time
+import asyncio
 import base64
+import time
+from collections.abc import AsyncIterator
 from io import BytesIO
 
-def query_remote(image: Image.Image, question: str, client: InferenceClient):
-    start_time = time.time()
-    print("starting remote inference... %s" %(start_time))
+from PIL import Image
 
-    if not image:
-        raise ValueError("Missing image")
+from backend.cancellation import RequestContext
+from backend.executors import Executors
+from backend.remote_engine import RemoteEngine
+from backend.utils.consts import (
+    REMOTE_IMAGE_MAX_BYTES,
+    REMOTE_IMAGE_MAX_SIDE,
+    REMOTE_JPEG_QUALITY,
+)
+from backend.utils.metrics import REMOTE_ENCODE_SECONDS, REMOTE_PAYLOAD_BYTES
 
-    buffered = BytesIO()
+MAX_TOKENS = 256
+
+
+JPEG_MAGIC = b"\xff\xd8\xff"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+EXIF_ORIENTATION = 0x0112
+
+
+def passthrough_mime(
+    original: bytes | None,
+    max_bytes: int = REMOTE_IMAGE_MAX_BYTES,
+    max_side: int = REMOTE_IMAGE_MAX_SIDE,
+) -> str | None:
+    """MIME type to send the upload as-is with, or None if it must be re-encoded."""
+    if not original or len(original) > max_bytes:
+        return None
+    if original.startswith(JPEG_MAGIC):
+        mime = "image/jpeg"
+    elif original.startswith(PNG_MAGIC):
+        mime = "image/png"
+    else:
+        return None
+
+    # Image.open only parses the header, so this is cheap
+    try:
+        with Image.open(BytesIO(original)) as image:
+            if max(image.size) > max_side:
+                return None
+            # CMYK JPEGs and sideways phone photos don't render reliably
+            if mime == "image/jpeg" and image.mode not in ("RGB", "L"):
+                return None
+            if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+                return None
+    except Exception:  # noqa: BLE001 - anything odd is re-encoded instead
+        return None
+    return mime
+
+
+def encode_remote_image(
+    image: Image.Image,
+    original: bytes | None = None,
+    max_side: int = REMOTE_IMAGE_MAX_SIDE,
+    quality: int = REMOTE_JPEG_QUALITY,
+) -> tuple[str, bytes]:
+    mime = passthrough_mime(original, max_side=max_side)
+    if mime is not None:
+        REMOTE_PAYLOAD_BYTES.labels(source="passthrough").observe(len(original))
+        return mime, original
+
+    start = time.perf_counter()
     if image.mode != "RGB":
         image = image.convert("RGB")
-    image.save(buffered, format="JPEG")
-    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    image_url = f"data:image/jpeg;base64,{img_str}"
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    data = buffered.getvalue()
+    REMOTE_ENCODE_SECONDS.observe(time.perf_counter() - start)
+    REMOTE_PAYLOAD_BYTES.labels(source="encoded").observe(len(data))
+    return "image/jpeg", data
+
+
+def build_remote_messages(
+    image: Image.Image, question: str, original: bytes | None = None
+):
+    mime, data = encode_remote_image(image, original)
+    img_str = base64.b64encode(data).decode("utf-8")
+    image_url = f"data:{mime};base64,{img_str}"
 
-    messages = [
+    return [
         {
             "role": "user",
             "content": [
@@ -28,8 +96,70 @@ def query_remote(image: Image.Image, question: str, client: InferenceClient):
         }
     ]
 
-    response = client.chat.completions.create(messages=messages, max_tokens=256)
+
+async def remote_messages(
+    image: Image.Image,
+    question: str,
+    original: bytes | None,
+    executors: Executors | None,
+):
+    # Encoding (when the upload can't be sent as-is) is CPU-bound; it runs on
+    # the API's decode pool, or a worker thread when there is none
+    if executors is not None:
+        return await executors.run(
+            "decode", build_remote_messages, image, question, original
+        )
+    return await asyncio.to_thread(build_remote_messages, image, question, original)
+
+
+async def query_remote(
+    image: Image.Image,
+    question: str,
+    engine: RemoteEngine,
+    max_tokens: int = MAX_TOKENS,
+    original: bytes | None = None,
+    executors: Executors | None = None,
+):
+    start_time = time.time()
+    print("starting remote inference... %s" %(start_time))
+
+    if not image:
+        raise ValueError("Missing image")
+
+    messages = await remote_messages(image, question, original, executors)
+
+    content = await engine.chat(messages, max_tokens=max_tokens)
 
     print("remote time %s --- " % (time.time() - start_time))
 
-    return response.choices[0].message.content
\ No newline at end of file
+    return content
+
+
+async def stream_remote(
+    image: Image.Image,
+    question: str,
+    engine: RemoteEngine,
+    max_tokens: int = MAX_TOKENS,
+    context: RequestContext | None = None,
+    original: bytes | None = None,
+    executors: Executors | None = None,
+) -> AsyncIterator[str]:
+    start_time = time.time()
+    print(f"starting remote streaming inference... {start_time}")
+
+    if not image:
+        raise ValueError("Missing image")
+
+    messages = await remote_messages(image, question, original, executors)
+
+    stream = engine.stream_chat(messages, max_tokens=max_tokens)
+    try:
+        async for delta in stream:
+            if context is not None:
+                context.check()
+            yield delta
+    finally:
+        # Drops the upstream connection when the caller stops early
+        await stream.aclose()
+
+    print("remote stream time %s --- " % (time.time() - start_time))
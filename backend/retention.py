@@ -0,0 +1,339 @@
+"""Upload storage retention and compaction.
+
+Removes uploads that no history row references, applies an optional age
+and total-size policy to the originals, and optionally recompresses old
+originals under the hash of their new content. Runs periodically inside
+the API (RETENTION_INTERVAL_S) or by hand:
+
+    python -m backend.retention --dry-run
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import re
+import shutil
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+
+from PIL import Image
+
+from backend.storage import TEMP_PREFIX, UPLOAD_DIR, Upload, write_atomic
+from backend.utils.consts import (
+    RETENTION_MAX_AGE_DAYS,
+    RETENTION_MAX_BYTES,
+    RETENTION_ORPHAN_GRACE_S,
+    RETENTION_RECOMPRESS_AFTER_DAYS,
+    RETENTION_RECOMPRESS_QUALITY,
+)
+from backend.utils.metrics import (
+    RETENTION_BYTES_RECLAIMED,
+    RETENTION_FILES_REMOVED,
+    STORAGE_BYTES,
+    STORAGE_FILES,
+)
+
+THUMBNAIL_NAME = re.compile(r"^(?P<stem>.+)_\d+\.jpg$")
+DAY = 86400
+RECOMPRESS_MIN_SAVING = 0.1  # Share of the original's size
+RECOMPRESS_EXTENSIONS = {"JPEG": "jpg", "PNG": "png"}
+
+
+@dataclass
+class RetentionPolicy:
+    # Unreferenced uploads younger than this may belong to a request that
+    # hasn't written its history row yet
+    orphan_grace_seconds: float = RETENTION_ORPHAN_GRACE_S
+    max_age_days: float = RETENTION_MAX_AGE_DAYS  # 0 keeps originals forever
+    max_total_bytes: int = RETENTION_MAX_BYTES  # 0 means no size budget
+    recompress_after_days: float = RETENTION_RECOMPRESS_AFTER_DAYS  # 0 is off
+    recompress_quality: int = RETENTION_RECOMPRESS_QUALITY
+
+
+@dataclass
+class StoredFile:
+    path: str
+    size: int
+    mtime: float
+
+
+@dataclass
+class StorageScan:
+    originals: dict[str, StoredFile] = field(default_factory=dict)
+    # Keyed by the original's path without its extension
+    thumbnails: dict[str, list[StoredFile]] = field(
+        default_factory=lambda: defaultdict(list)
+    )
+    temporary: list[StoredFile] = field(default_factory=list)
+
+    def thumbnails_of(self, original: StoredFile) -> list[StoredFile]:
+        return self.thumbnails.get(os.path.splitext(original.path)[0], [])
+
+
+@dataclass
+class RetentionReport:
+    removed: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    reclaimed_bytes: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    recompressed: int = 0
+    files: dict[str, int] = field(default_factory=dict)
+    bytes: dict[str, int] = field(default_factory=dict)
+
+
+def scan_storage(directory: str = UPLOAD_DIR) -> StorageScan:
+    scan = StorageScan()
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.normpath(os.path.join(root, name))
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stored = StoredFile(path, stat.st_size, stat.st_mtime)
+            match = THUMBNAIL_NAME.match(name)
+            if name.startswith(TEMP_PREFIX):
+                scan.temporary.append(stored)
+            elif match:
+                stem = os.path.normpath(os.path.join(root, match["stem"]))
+                scan.thumbnails[stem].append(stored)
+            else:
+                scan.originals[path] = stored
+    return scan
+
+
+def export_storage_metrics(scan: StorageScan, report: RetentionReport):
+    thumbnails = [t for group in scan.thumbnails.values() for t in group]
+    kinds = {"original": list(scan.originals.values()), "thumbnail": thumbnails}
+    for kind, files in kinds.items():
+        report.files[kind] = len(files)
+        report.bytes[kind] = sum(f.size for f in files)
+        STORAGE_FILES.labels(kind=kind).set(report.files[kind])
+        STORAGE_BYTES.labels(kind=kind).set(report.bytes[kind])
+
+
+def remove(
+    files: Iterable[StoredFile], reason: str, report: RetentionReport, dry_run: bool
+):
+    for stored in files:
+        report.removed[reason] += 1
+        report.reclaimed_bytes[reason] += stored.size
+        if dry_run:
+            continue
+        try:
+            os.remove(stored.path)
+        except FileNotFoundError:
+            continue
+        RETENTION_FILES_REMOVED.labels(reason=reason).inc()
+        RETENTION_BYTES_RECLAIMED.labels(reason=reason).inc(stored.size)
+
+
+def recompress(
+    stored: StoredFile,
+    quality: int,
+    directory: str,
+    thumbnails: Iterable[StoredFile] = (),
+) -> str | None:
+    """Re-encode an original under the name of its new content, if smaller.
+
+    Uploads are named by content hash and served as immutable, so the new
+    bytes can't replace the old ones under the same name. They are stored
+    next to it (with copies of its thumbnails) and the new path returned;
+    the old file stays until history points at the new one. Only JPEG
+    (lossy, at `quality`) and PNG (lossless optimize) are touched.
+    """
+    with Image.open(stored.path) as image:
+        image_format = image.format
+        if image_format == "JPEG":
+            kwargs = {"quality": quality, "optimize": True, "exif": image.getexif()}
+        elif image_format == "PNG":
+            kwargs = {"optimize": True}
+        else:
+            return None
+        buffered = io.BytesIO()
+        image.save(buffered, format=image_format, **kwargs)
+    data = buffered.getvalue()
+    # Re-encoding an already recompressed JPEG saves next to nothing; without
+    # a minimum every run would rename it again
+    if len(data) > stored.size * (1 - RECOMPRESS_MIN_SAVING):
+        return None
+
+    upload = Upload(
+        content=data,
+        digest=hashlib.sha256(data).hexdigest(),
+        extension=RECOMPRESS_EXTENSIONS[image_format],
+    )
+    path = os.path.normpath(os.path.join(directory, upload.relative_path))
+    if not os.path.exists(path):
+        write_atomic(path, data)
+        # Keep the age, so age eviction still sees the upload's real age
+        os.utime(path, (stored.mtime, stored.mtime))
+    old_stem, new_stem = os.path.splitext(stored.path)[0], os.path.splitext(path)[0]
+    for thumbnail in thumbnails:
+        copy = new_stem + thumbnail.path[len(old_stem) :]
+        if not os.path.exists(copy):
+            shutil.copy2(thumbnail.path, copy)
+    return path
+
+
+def run_retention(
+    referenced: Iterable[str],
+    directory: str = UPLOAD_DIR,
+    policy: RetentionPolicy | None = None,
+    now: float | None = None,
+    dry_run: bool = False,
+    relink: Callable[[str, str], bool] | None = None,
+    pinned: Iterable[str] = (),
+) -> RetentionReport:
+    """Apply the policy to the upload directory.
+
+    `referenced` are the history.image_url values. Age and size eviction
+    removes originals but keeps their thumbnails, so history still shows a
+    preview; orphans lose both.
+
+    Recompression needs `relink(old, new)`, which points history rows at a
+    recompressed file and returns False if it can't. `pinned` uploads (say,
+    ones archived rows reference) are never recompressed.
+    """
+    policy = policy or RetentionPolicy()
+    now = time.time() if now is None else now
+    # Normalised path -> the image_url history stores, which relink matches on
+    referenced = {os.path.normpath(url): url for url in referenced if url}
+    report = RetentionReport()
+    scan = scan_storage(directory)
+    grace_cutoff = now - policy.orphan_grace_seconds
+
+    # Leftovers of interrupted writes
+    remove(
+        [t for t in scan.temporary if t.mtime < grace_cutoff],
+        "temporary",
+        report,
+        dry_run,
+    )
+
+    kept = []
+    for path, stored in scan.originals.items():
+        if path not in referenced and stored.mtime < grace_cutoff:
+            remove([stored, *scan.thumbnails_of(stored)], "orphan", report, dry_run)
+        else:
+            kept.append(stored)
+
+    # Thumbnails whose original was never referenced and is already gone
+    originals = {os.path.splitext(p)[0] for p in scan.originals}
+    referenced_stems = {os.path.splitext(p)[0] for p in referenced}
+    for stem, thumbnails in scan.thumbnails.items():
+        if stem not in originals and stem not in referenced_stems:
+            remove(
+                [t for t in thumbnails if t.mtime < grace_cutoff],
+                "orphan",
+                report,
+                dry_run,
+            )
+
+    if policy.max_age_days > 0:
+        age_cutoff = now - policy.max_age_days * DAY
+        expired = [s for s in kept if s.mtime < age_cutoff]
+        remove(expired, "age", report, dry_run)
+        kept = [s for s in kept if s.mtime >= age_cutoff]
+
+    if policy.max_total_bytes > 0:
+        # Oldest originals go first until the rest fits the budget
+        kept.sort(key=lambda s: s.mtime)
+        total = sum(s.size for s in kept)
+        evicted = 0
+        while evicted < len(kept) and total > policy.max_total_bytes:
+            total -= kept[evicted].size
+            evicted += 1
+        remove(kept[:evicted], "size", report, dry_run)
+        kept = kept[evicted:]
+
+    if policy.recompress_after_days > 0 and relink is not None and not dry_run:
+        recompress_cutoff = now - policy.recompress_after_days * DAY
+        pinned = {os.path.normpath(url) for url in pinned if url}
+        for stored in kept:
+            if (
+                stored.mtime >= recompress_cutoff
+                or stored.path in pinned
+                or stored.path not in referenced
+            ):
+                continue
+            thumbnails = scan.thumbnails_of(stored)
+            try:
+                path = recompress(
+                    stored, policy.recompress_quality, directory, thumbnails
+                )
+                # If history can't be pointed at the new file, it is an
+                # orphan and goes with the next run
+                if path is None or not relink(referenced[stored.path], path):
+                    continue
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                print(f"Recompressing {stored.path} failed: {e}")
+                continue
+            report.recompressed += 1
+            # A request that uploaded the old bytes again meanwhile refreshed
+            # the file's age and still needs it
+            if os.path.getmtime(stored.path) != stored.mtime:
+                continue
+            for old in (stored, *thumbnails):
+                os.remove(old.path)
+            saved = stored.size - os.path.getsize(path)
+            report.reclaimed_bytes["recompress"] += saved
+            RETENTION_BYTES_RECLAIMED.labels(reason="recompress").inc(saved)
+
+    if not dry_run:
+        scan = scan_storage(directory)
+    export_storage_metrics(scan, report)
+    return report
+
+
+def main():
+    from backend.db.database import Database
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directory", default=UPLOAD_DIR)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--max-age-days", type=float, default=RETENTION_MAX_AGE_DAYS)
+    parser.add_argument("--max-bytes", type=int, default=RETENTION_MAX_BYTES)
+    parser.add_argument(
+        "--recompress-after-days", type=float, default=RETENTION_RECOMPRESS_AFTER_DAYS
+    )
+    args = parser.parse_args()
+
+    policy = RetentionPolicy(
+        max_age_days=args.max_age_days,
+        max_total_bytes=args.max_bytes,
+        recompress_after_days=args.recompress_after_days,
+    )
+    db = Database()
+    try:
+        # Builds the history_all view get_image_urls reads
+        db.initialize_db()
+        report = run_retention(
+            db.get_image_urls(),
+            args.directory,
+            policy,
+            dry_run=args.dry_run,
+            relink=db.replace_image_url,
+            pinned=db.get_archived_image_urls() if args.recompress_after_days else (),
+        )
+    finally:
+        db.close()
+
+    prefix = "Would remove" if args.dry_run else "Removed"
+    for reason, count in sorted(report.removed.items()):
+        print(
+            f"{prefix} {count} {reason} files "
+            f"({report.reclaimed_bytes[reason] / 1e6:.1f} MB)"
+        )
+    if report.recompressed:
+        print(
+            f"Recompressed {report.recompressed} originals "
+            f"({report.reclaimed_bytes['recompress'] / 1e6:.1f} MB saved)"
+        )
+    for kind in ("original", "thumbnail"):
+        print(f"{kind}s: {report.files[kind]} files, {report.bytes[kind] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,604 @@
+import asyncio
+import hmac
+import json
 from contextlib import asynccontextmanager
 import os
-import shutil
+import io
 import uuid
+import threading
 import time
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from datetime import datetime, timedelta
+import duckdb
+from fastapi import (
+    Depends,
+    FastAPI,
+    UploadFile,
+    File,
+    Form,
+    HTTPException,
+    Request,
+    Response,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.concurrency import run_in_threadpool
-from PIL import Image
+from fastapi.concurrency import iterate_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
 from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
-from backend.utils.consts import DEVICE, BASE_MODEL
-from backend.db.database import Database
-from backend.datamodels.datamodels import User as UserModel
-from backend.local_model import query_local
-from backend.remote_model import query_remote
-from huggingface_hub import InferenceClient
-from prometheus_fastapi_instrumentator import Instrumentator
-from prometheus_client import Counter, Histogram
-
-# Prometheus Metrics Definitions
-
-# Metric to track inference requests by mode and status
-INFERENCE_COUNTER = Counter(
-    "app_inference_requests_total",
-    "Total number of inference requests",
-    ["mode", "status"]
+from backend.utils.consts import (
+    DEVICE,
+    BASE_MODEL,
+    LOCAL_BATCH_MAX_SIZE,
+    LOCAL_BATCH_MAX_WAIT_MS,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_DB_PATH,
+    RESPONSE_CACHE_PERCEPTUAL,
+    VISION_CACHE_MAX_MB,
+    LOCAL_PREFIX_CACHE,
+    LOCAL_PRECISION,
+    LOCAL_POOL_SIZE,
+    LOCAL_POOL_THREADS,
+    LOCAL_PROMPT_LOOKUP_TOKENS,
+    LOCAL_PROMPT_LOOKUP_NGRAM,
+    INFERENCE_TIMEOUT_S,
+    INFERENCE_POLL_INTERVAL_S,
+    LOCAL_FALLBACK_TO_REMOTE,
+    REMOTE_BASE_URL,
+    REMOTE_MODEL,
+    REMOTE_MAX_CONCURRENCY,
+    REMOTE_TIMEOUT_S,
+    REMOTE_CONNECT_TIMEOUT_S,
+    REMOTE_MAX_RETRIES,
+    REMOTE_HEDGE_PERCENTILE,
+    AUTO_ROUTE_SLO_S,
+    AUTO_ROUTE_PERCENTILE,
+    AUTO_ROUTE_MAX_REMOTE_ERROR_RATE,
+    AUTO_ROUTE_WINDOW,
+    REMOTE_BREAKER_FAILURE_RATE,
+    REMOTE_BREAKER_SLOW_CALL_S,
+    REMOTE_BREAKER_WINDOW,
+    REMOTE_BREAKER_MIN_CALLS,
+    REMOTE_BREAKER_OPEN_S,
+    REMOTE_BREAKER_HALF_OPEN_CALLS,
+    REMOTE_FALLBACK_TO_LOCAL,
+    UPLOAD_MAX_BYTES,
+    EXECUTOR_DB_THREADS,
+    ANALYTICS_MAX_DAYS,
+    ANALYTICS_TOKEN,
+    HISTORY_BATCH_SIZE,
+    HISTORY_EXPORT_BATCH_SIZE,
+    HISTORY_FLUSH_INTERVAL_S,
+    HISTORY_MAX_PAGE_SIZE,
+    HISTORY_MAX_PENDING,
+    HISTORY_PAGE_SIZE,
+    EXECUTOR_IO_THREADS,
+    EXECUTOR_DECODE_THREADS,
+    LOOP_LAG_INTERVAL_S,
+    RETENTION_INTERVAL_S,
+    RETENTION_RECOMPRESS_AFTER_DAYS,
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_INTERVAL_S,
 )
-
-# Inference Latency
-INFERENCE_DURATION = Histogram(
-    "app_inference_duration_seconds",
-    "Time taken for the AI model to generate a response",
-    ["mode"] # Track local vs remote speed
-)
-
-# Image Upload Size
-UPLOAD_SIZE = Histogram(
-    "app_image_upload_bytes",
-    "Size of uploaded images in bytes",
-    # Buckets from 10KB up to 10MB to categorize sizes
-    buckets=(10240, 51200, 102400, 1048576, 5242880, 10485760) 
+from backend.utils.metrics import (
+    INFERENCE_COUNTER,
+    INFERENCE_DURATION,
+    INFERENCE_TTFT,
+    MODEL_READY,
+    MODEL_STARTUP_SECONDS,
+    UPLOAD_SIZE,
+    USER_ACTIVITY,
+    DB_ERRORS,
 )
-
-# User Activity
-USER_ACTIVITY = Counter(
-    "app_user_actions_total",
-    "Tracks distinct user actions",
-    ["action"]
+from backend.batching import LocalBatcher
+from backend.cancellation import RequestCancelled, RequestContext
+from backend.executors import Executors, LoopLagMonitor
+from backend.circuit_breaker import OPEN, CircuitBreaker, CircuitOpen
+from backend.preprocessing import preprocess_image
+from backend.retention import run_retention
+from backend.routing import AutoRouter
+from backend.snapshot import model_source
+from backend.storage import (
+    UploadTooLarge,
+    attach_thumbnails,
+    read_upload,
+    store_upload,
+    write_thumbnails,
 )
-
-# Internal Database Errors
-DB_ERRORS = Counter(
-    "app_db_errors_total",
-    "Tracks silent database failures",
-    ["operation"]
+from backend.worker_pool import LocalWorkerPool
+from backend.cache.response_cache import ResponseCache, make_cache_key
+from backend.cache.vision_cache import VisionFeatureCache
+from backend.db.database import Database, InvalidCursor, encode_cursor
+from backend.db.history_writer import HistoryWriter
+from backend.datamodels.datamodels import User as UserModel
+from backend.local_model import (
+    MAX_NEW_TOKENS,
+    SYSTEM_PROMPT,
+    apply_precision,
+    build_prefix_cache,
+    precision_dtype,
+    query_local,
+    query_local_batch,
+    stream_local,
+    warmup_local,
 )
+from backend.remote_engine import RemoteEngine
+from backend.remote_model import MAX_TOKENS, query_remote, stream_remote
+from prometheus_fastapi_instrumentator import Instrumentator
 
 # Local model setup
 model = None
 processor = None
 device = None
+precision = None
+local_batcher = None
+local_pool = None
+vision_cache = None
+prefix_cache = None
+
+# Background loading state reported by /ready:
+# loading -> warming_up -> ready, or failed
+model_loader = None
+model_status = "loading"
+model_error = None
+
+# Remote model setup; the engine's connection pool belongs to the running
+# event loop, so it is created in lifespan
+remote_model = REMOTE_MODEL
+remote_engine = None
+
+# Fails remote requests fast while the upstream is erroring or too slow
+remote_breaker = CircuitBreaker(
+    failure_rate=REMOTE_BREAKER_FAILURE_RATE,
+    slow_call_seconds=REMOTE_BREAKER_SLOW_CALL_S or None,
+    window=REMOTE_BREAKER_WINDOW,
+    min_calls=REMOTE_BREAKER_MIN_CALLS,
+    open_seconds=REMOTE_BREAKER_OPEN_S,
+    half_open_calls=REMOTE_BREAKER_HALF_OPEN_CALLS,
+)
 
-# Remote model setup
-remote_model="zai-org/GLM-4.5V"
-client = InferenceClient(model=remote_model, token=os.environ.get("HF_TOKEN"))
+# mode=auto routing, fed with every local and remote request's outcome
+auto_router = AutoRouter(
+    AUTO_ROUTE_SLO_S,
+    percentile=AUTO_ROUTE_PERCENTILE,
+    max_remote_error_rate=AUTO_ROUTE_MAX_REMOTE_ERROR_RATE,
+    window=AUTO_ROUTE_WINDOW,
+)
 
 # DB setup
 db = Database()
+# History inserts are queued and written in batches off the request path
+history_writer = None
+
+# Blocking DB, file and decode work runs on these instead of the event loop
+executors = None
+loop_lag_monitor = None
+# Fire-and-forget work (thumbnails); referenced here so it isn't collected
+background_tasks = set()
+retention_task = None
+archive_task = None
+
+# Response cache setup
+response_cache = None
+
+
+def response_cache_key(image, question, mode, max_new_tokens=None):
+    if mode == "local":
+        settings = {
+            "model": BASE_MODEL,
+            "prompt": SYSTEM_PROMPT,
+            "precision": precision,
+            "max_new_tokens": max_new_tokens or MAX_NEW_TOKENS,
+        }
+    else:
+        settings = {"model": remote_model, "max_tokens": max_new_tokens or MAX_TOKENS}
+    return make_cache_key(
+        image, question, mode, settings, perceptual=RESPONSE_CACHE_PERCEPTUAL
+    )
+
+
+async def lookup_cached_response(image, question, mode, max_new_tokens=None):
+    if response_cache is None or mode not in ("local", "remote"):
+        return None, None
+    try:
+        cache_key = await executors.run(
+            "decode", response_cache_key, image, question, mode, max_new_tokens
+        )
+        return cache_key, await executors.run("io", response_cache.get, cache_key)
+    except (duckdb.Error, OSError) as e:
+        print(f"Response cache lookup failed: {e}")
+        return None, None
+
+
+async def store_cached_response(cache_key, response_content):
+    if response_cache is None or cache_key is None:
+        return
+    try:
+        await executors.run("io", response_cache.put, cache_key, response_content)
+    except (duckdb.Error, OSError) as e:
+        print(f"Response cache store failed: {e}")
+
+
+async def save_history(user_uuid, question, response_content, file_path):
+    # Only queued here; failures are counted when the batch is written
+    await history_writer.submit(user_uuid, question, response_content, file_path)
+
+
+def request_context(mode, timeout=None, max_new_tokens=None) -> RequestContext:
+    # Callers may only tighten the server's deadline and token cap
+    if max_new_tokens is not None and max_new_tokens < 1:
+        raise HTTPException(status_code=400, detail="max_new_tokens must be positive")
+    if timeout is not None and timeout <= 0:
+        raise HTTPException(status_code=400, detail="timeout must be positive")
+
+    cap = MAX_NEW_TOKENS if mode == "local" else MAX_TOKENS
+    budget = min(max_new_tokens, cap) if max_new_tokens else None
+    limit = INFERENCE_TIMEOUT_S or None
+    if timeout is not None:
+        limit = min(timeout, limit) if limit else timeout
+    return RequestContext(timeout=limit, max_new_tokens=budget)
+
+
+async def wait_for_inference(
+    request: Request, context: RequestContext, awaitable, cancel: bool = False
+):
+    # Generation runs in a worker thread or process and can't be interrupted
+    # from here, so poll for a gone client or a passed deadline and flag the
+    # context; the worker stops at its next token and the caller stops waiting.
+    # With cancel=True the awaitable is a native coroutine (the remote engine)
+    # and is cancelled outright, which closes its HTTP request
+    task = asyncio.ensure_future(awaitable)
+    # The abandoned result (or error) is discarded
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=INFERENCE_POLL_INTERVAL_S)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            context.cancel("cancelled")
+        elif context.expired():
+            context.cancel("timeout")
+        if cancel and context.should_stop():
+            task.cancel()
+            await asyncio.wait({task})
+        context.check()
+
+
+def run_local_batch(images, questions, contexts=None):
+    if contexts is None:
+        contexts = [None] * len(images)
+    # A lone request skips padding and goes through the single-sequence path
+    if len(images) == 1:
+        return [
+            query_local(
+                model=model,
+                processor=processor,
+                device=device,
+                image=images[0],
+                question=questions[0],
+                vision_cache=vision_cache,
+                prefix_cache=prefix_cache,
+                prompt_lookup_tokens=LOCAL_PROMPT_LOOKUP_TOKENS,
+                prompt_lookup_ngram=LOCAL_PROMPT_LOOKUP_NGRAM,
+                context=contexts[0],
+            )
+        ]
+    return query_local_batch(
+        model, processor, device, images, questions, contexts=contexts
+    )
+
+
+def load_local_model():
+    global model, processor, local_batcher, vision_cache, prefix_cache
+    global local_pool, model_status, model_error
+    try:
+        if LOCAL_POOL_SIZE > 0:
+            # Model replicas live in worker processes; this one only
+            # dispatches. Each worker loads and warms up its own replica and
+            # reports the durations back to the pool
+            pool = LocalWorkerPool(
+                LOCAL_POOL_SIZE, threads_per_worker=LOCAL_POOL_THREADS
+            )
+            local_pool = pool
+            pool.start()
+            if not pool.wait_ready():
+                raise RuntimeError("All local workers failed to load the model")
+        else:
+            start_time = time.perf_counter()
+            source, source_kwargs = model_source(LOCAL_PRECISION)
+            loaded = Qwen2VLForConditionalGeneration.from_pretrained(
+                source, dtype=precision_dtype(LOCAL_PRECISION), **source_kwargs
+            )
+            loaded.to(DEVICE)
+            loaded = apply_precision(loaded, LOCAL_PRECISION, DEVICE)
+            loaded_processor = AutoProcessor.from_pretrained(source, **source_kwargs)
+            if VISION_CACHE_MAX_MB > 0:
+                vision_cache = VisionFeatureCache(
+                    max_bytes=VISION_CACHE_MAX_MB * 1024 * 1024
+                )
+            if LOCAL_PREFIX_CACHE:
+                try:
+                    prefix_cache = build_prefix_cache(loaded, loaded_processor, DEVICE)
+                except Exception as e:  # noqa: BLE001 - optional, serve without it
+                    print(f"Failed to build prompt prefix cache: {e}")
+            MODEL_STARTUP_SECONDS.labels(phase="load").set(
+                time.perf_counter() - start_time
+            )
+
+            model_status = "warming_up"
+            start_time = time.perf_counter()
+            try:
+                warmup_local(
+                    loaded,
+                    loaded_processor,
+                    DEVICE,
+                    prefix_cache=prefix_cache,
+                    prompt_lookup_tokens=LOCAL_PROMPT_LOOKUP_TOKENS,
+                    prompt_lookup_ngram=LOCAL_PROMPT_LOOKUP_NGRAM,
+                )
+            except Exception as e:  # noqa: BLE001 - optional, serve without it
+                print(f"Local model warmup failed: {e}")
+            MODEL_STARTUP_SECONDS.labels(phase="warmup").set(
+                time.perf_counter() - start_time
+            )
+
+            # Only publish the model once it is warm
+            model, processor = loaded, loaded_processor
+            local_batcher = LocalBatcher(
+                run_local_batch,
+                max_batch_size=LOCAL_BATCH_MAX_SIZE,
+                max_wait_ms=LOCAL_BATCH_MAX_WAIT_MS,
+            )
+            local_batcher.start()
+    except Exception as e:  # noqa: BLE001 - reported through /ready
+        model_status = "failed"
+        model_error = f"{type(e).__name__}: {e}"
+        print(f"Failed to load local model: {model_error}")
+        return
+
+    model_status = "ready"
+    MODEL_READY.set(1)
+
+
+async def retention_loop():
+    # Orphan cleanup and the optional age/size/recompression policies for
+    # uploads; the history lookup and the file work stay off the event loop
+    while True:
+        try:
+            referenced = await executors.run("db", db.get_image_urls)
+            pinned = ()
+            if RETENTION_RECOMPRESS_AFTER_DAYS > 0:
+                pinned = await executors.run("db", db.get_archived_image_urls)
+            # relink only runs for a recompressed upload, a quick UPDATE
+            await executors.run(
+                "io",
+                run_retention,
+                referenced,
+                relink=db.replace_image_url,
+                pinned=pinned,
+            )
+        except (duckdb.Error, OSError) as e:
+            DB_ERRORS.labels(operation="retention").inc()
+            print(f"Upload retention failed: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL_S)
+
+
+async def archive_loop():
+    # Moves old history to Parquet so the database stays small; reads see
+    # both through the history_all view
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_S)
+        try:
+            cutoff = datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+            await executors.run("db", db.archive_history, cutoff)
+        except (duckdb.Error, OSError) as e:
+            DB_ERRORS.labels(operation="archive").inc()
+            print(f"History archival failed: {e}")
+
+
+def local_model_ready() -> bool:
+    return model_status == "ready"
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global model, processor, device
+    global model, processor, device, local_batcher, response_cache, vision_cache
+    global prefix_cache, precision, local_pool, model_loader, model_status
+    global model_error, remote_engine, executors, loop_lag_monitor, retention_task
+    global history_writer, archive_task
     try:
         db.initialize_db()
     except Exception:
         DB_ERRORS.labels(operation="initialize").inc()
 
-    model = Qwen2VLForConditionalGeneration.from_pretrained(BASE_MODEL)
-    model.to(DEVICE)
-    processor = AutoProcessor.from_pretrained(BASE_MODEL)
+    response_cache = ResponseCache(
+        max_entries=RESPONSE_CACHE_SIZE, db_path=RESPONSE_CACHE_DB_PATH or None
+    )
+
     device = DEVICE 
+    precision = LOCAL_PRECISION
+
+    executors = Executors(
+        db_threads=EXECUTOR_DB_THREADS,
+        io_threads=EXECUTOR_IO_THREADS,
+        decode_threads=EXECUTOR_DECODE_THREADS,
+    )
+    loop_lag_monitor = LoopLagMonitor(LOOP_LAG_INTERVAL_S)
+    loop_lag_monitor.start()
+    history_writer = HistoryWriter(
+        db,
+        executors,
+        batch_size=HISTORY_BATCH_SIZE,
+        flush_interval=HISTORY_FLUSH_INTERVAL_S,
+        max_pending=HISTORY_MAX_PENDING,
+    )
+    history_writer.start()
+    if RETENTION_INTERVAL_S > 0:
+        retention_task = asyncio.ensure_future(retention_loop())
+    if ARCHIVE_INTERVAL_S > 0 and ARCHIVE_AFTER_DAYS > 0:
+        archive_task = asyncio.ensure_future(archive_loop())
+
+    remote_engine = RemoteEngine(
+        REMOTE_BASE_URL,
+        REMOTE_MODEL,
+        token=os.environ.get("HF_TOKEN"),
+        max_concurrency=REMOTE_MAX_CONCURRENCY,
+        timeout=REMOTE_TIMEOUT_S,
+        connect_timeout=REMOTE_CONNECT_TIMEOUT_S,
+        max_retries=REMOTE_MAX_RETRIES,
+        hedge_percentile=REMOTE_HEDGE_PERCENTILE,
+    )
+
+    # Load in the background so /users, /history and /metrics are served
+    # right away; /ready reports progress
+    model_status = "loading"
+    model_error = None
+    MODEL_READY.set(0)
+    model_loader = threading.Thread(
+        target=load_local_model, name="model-loader", daemon=True
+    )
+    model_loader.start()
 
     yield
 
+    # from_pretrained can't be interrupted; let it finish before tearing down
+    model_loader.join()
+    model_loader = None
+    MODEL_READY.set(0)
+    if local_pool is not None:
+        local_pool.stop()
+        local_pool = None
+    if local_batcher is not None:
+        local_batcher.stop()
+        local_batcher = None
+    vision_cache = None
+    prefix_cache = None
     model = None
     processor = None
     device = None
+    precision = None
+    await remote_engine.close()
+    remote_engine = None
+    if retention_task is not None:
+        retention_task.cancel()
+        try:
+            await retention_task
+        except asyncio.CancelledError:
+            pass
+        retention_task = None
+    if archive_task is not None:
+        archive_task.cancel()
+        try:
+            await archive_task
+        except asyncio.CancelledError:
+            pass
+        archive_task = None
+    # Write out queued history before the DB pool and connection go away
+    await history_writer.close()
+    history_writer = None
+    await loop_lag_monitor.stop()
+    loop_lag_monitor = None
+    executors.shutdown()
+    executors = None
+    response_cache.close()
+    response_cache = None
     db.close()
 
 app = FastAPI(lifespan=lifespan)
 Instrumentator().instrument(app).expose(app)
 
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
+)
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """Static files whose content never changes under the same name.
+
+    Uploads are named by content hash (older ones by UUID), so the file name
+    itself is a strong ETag and browsers may cache them for good.
+    """
+
+    cache_control = "public, max-age=31536000, immutable"
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        headers = {
+            "cache-control": self.cache_control,
+            "etag": f'"{os.path.basename(full_path)}"',
+        }
+        response = FileResponse(
+            full_path, status_code=status_code, stat_result=stat_result, headers=headers
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
 
 os.makedirs("uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.mount("/uploads", ImmutableStaticFiles(directory="uploads"), name="uploads")
 
 
 @app.get("/device")
 async def get_device():
-    return {"device": device}
+    return {"device": device, "precision": precision}
+
+
+@app.get("/ready")
+async def get_ready():
+    body = {"status": model_status}
+    if model_error:
+        body["error"] = model_error
+    if local_pool is not None:
+        body["workers_ready"] = len(local_pool.ready_workers)
+    return JSONResponse(body, status_code=200 if local_model_ready() else 503)
+
+
+def route_auto() -> str:
+    engine = local_pool if local_pool is not None else local_batcher
+    if engine is None:
+        queue_depth, capacity = 0, 1
+    else:
+        queue_depth, capacity = engine.queue_depth(), engine.capacity()
+    mode, _ = auto_router.choose(local_model_ready(), queue_depth, capacity)
+    return mode
+
+
+def circuit_open_error(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Remote model unavailable (circuit open)",
+        headers={"Retry-After": str(max(1, round(retry_after)))},
+    )
+
+
+def resolve_mode(mode: str) -> str:
+    requested = mode
+    if mode == "auto":
+        mode = route_auto()
+
+    # Remote requests fail fast (or go local) while the breaker is open;
+    # auto mode always takes the local model when it can
+    if mode == "remote" and remote_breaker.state == OPEN:
+        if (requested == "auto" or REMOTE_FALLBACK_TO_LOCAL) and local_model_ready():
+            return "local"
+        INFERENCE_COUNTER.labels(mode="remote", status="circuit_open").inc()
+        raise circuit_open_error(remote_breaker.retry_after())
+
+    # Local requests fail fast (or go remote) until the model is warm
+    if mode != "local" or local_model_ready():
+        return mode
+    if LOCAL_FALLBACK_TO_REMOTE:
+        return "remote"
+    INFERENCE_COUNTER.labels(mode=mode, status="error").inc()
+    raise HTTPException(
+        status_code=503,
+        detail=f"Local model not ready ({model_status})",
+        headers={"Retry-After": "5"},
+    )
 
 
 @app.post("/users")
@@ -109,7 +608,7 @@ async def create_user(email: str = Form(...)):
     user = UserModel(uuid=new_uuid, email=email)
     
     try:
-        success = db.add_user(user)
+        success = await executors.run("db", db.add_user, user)
     except Exception:
         DB_ERRORS.labels(operation="add_user").inc()
         success = False
@@ -117,72 +616,245 @@ async def create_user(email: str = Form(...)):
     if success:
         return {"uuid": user.uuid, "email": user.email}
     else:
-        existing_user = db.con.execute(
-            "SELECT uuid, email FROM users WHERE email = ?", (email,)
-        ).fetchone()
+        existing_user = await executors.run("db", db.get_user_by_email, email)
         if existing_user:
-            return {"uuid": existing_user[0], "email": existing_user[1]}
+            return {"uuid": existing_user.uuid, "email": existing_user.email}
         return {"error": "User with this email may already exist", "uuid": new_uuid}
 
 
 @app.get("/history/{user_uuid}")
-async def get_history(user_uuid: str):
+async def get_history(
+    user_uuid: str,
+    response: Response,
+    before: str | None = None,
+    limit: int = HISTORY_PAGE_SIZE,
+):
+    # Newest first. While older entries remain, the X-Next-Cursor header
+    # carries the `before` value for the next page
     USER_ACTIVITY.labels(action="view_history").inc()
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    limit = min(limit, HISTORY_MAX_PAGE_SIZE)
     try:
-        return db.get_user_history(user_uuid)
+        # Queued entries first, so users always see their latest question
+        await history_writer.flush()
+        # One extra row tells whether there is another page
+        history = await executors.run(
+            "db", db.get_user_history, user_uuid, limit + 1, before
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception:
         DB_ERRORS.labels(operation="get_history").inc()
         return []
+    if len(history) > limit:
+        history = history[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(history[-1])
+    return await executors.run("io", attach_thumbnails, history)
 
 
-@app.post("/inference")
-async def inference(
-    question: str = Form(...), user_uuid: str = Form(...), file: UploadFile = File(...), mode: str = Form(...)
-):
-    # Track Upload Size
-    file_content = await file.read()
-    UPLOAD_SIZE.observe(len(file_content))
-    await file.seek(0) # Reset pointer so we can save it below
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "json": "application/json"}
 
-    file_ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-    file_name = f"{uuid.uuid4()}.{file_ext}"
-    file_path = os.path.join("uploads", file_name)
 
+async def history_export_stream(first_batch, batches, format):
+    # Batches arrive as ready-made JSON objects; only joined here
+    separator = "\n" if format == "ndjson" else ","
+    batch = first_batch
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
+        if format == "json":
+            yield "["
+        while batch is not None:
+            chunk = separator.join(batch)
+            if format == "ndjson":
+                yield chunk + "\n"
+            else:
+                yield chunk if batch is first_batch else "," + chunk
+            batch = await executors.run("db", next, batches, None)
+        if format == "json":
+            yield "]"
+    except Exception:
+        DB_ERRORS.labels(operation="export_history").inc()
+        raise
+    finally:
+        await executors.run("db", batches.close)
+
+
+@app.get("/history/{user_uuid}/export")
+async def export_history(user_uuid: str, format: str = "ndjson"):
+    # The whole history, newest first, streamed without building a Python
+    # object per entry
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be ndjson or json")
+    USER_ACTIVITY.labels(action="export_history").inc()
+    await history_writer.flush()
+    batches = db.iter_user_history_json(user_uuid, HISTORY_EXPORT_BATCH_SIZE)
+    try:
+        # Fetched up front so a failing query is still a proper error response
+        first_batch = await executors.run("db", next, batches, None)
+    except duckdb.Error:
+        DB_ERRORS.labels(operation="export_history").inc()
+        raise HTTPException(status_code=500, detail="Failed to export history")
+    return StreamingResponse(
+        history_export_stream(first_batch, batches, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+    )
+
+
+def require_analytics_token(request: Request):
+    # User uuids double as the only credential for /history, so the analytics
+    # that list them are for operators holding ANALYTICS_TOKEN
+    if not ANALYTICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Analytics are disabled")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode(), ANALYTICS_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid analytics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+analytics_auth = [Depends(require_analytics_token)]
+
+
+async def read_analytics(fn, *args):
+    # Served from the summary tables, so this is cheap while under load
+    try:
+        return await executors.run("db", fn, *args)
+    except duckdb.Error:
+        DB_ERRORS.labels(operation="analytics").inc()
+        raise HTTPException(status_code=500, detail="Failed to read analytics")
+
+
+@app.get("/analytics/requests", dependencies=analytics_auth)
+async def analytics_requests(days: int = 30):
+    if not 1 <= days <= ANALYTICS_MAX_DAYS:
+        raise HTTPException(
+            status_code=400, detail=f"days must be between 1 and {ANALYTICS_MAX_DAYS}"
+        )
+    return await read_analytics(db.get_requests_per_day, days)
+
+
+@app.get("/analytics/users", dependencies=analytics_auth)
+async def analytics_users(limit: int = 50):
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    return await read_analytics(db.get_user_activity, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+
+@app.get("/analytics/users/{user_uuid}", dependencies=analytics_auth)
+async def analytics_user(user_uuid: str):
+    activity = await read_analytics(db.get_user_activity, 1, user_uuid)
+    if not activity:
+        raise HTTPException(status_code=404, detail="No activity for this user")
+    return activity[0]
+
+
+@app.get("/analytics/lengths", dependencies=analytics_auth)
+async def analytics_lengths():
+    return await read_analytics(db.get_length_distributions)
+
+
+@app.get("/analytics/images", dependencies=analytics_auth)
+async def analytics_images():
+    return await read_analytics(db.get_image_reuse)
+
+
+async def save_upload(file: UploadFile, mode: str):
+    # One pass over the upload: read in chunks with an early size limit and
+    # hash while reading, then decode from memory and store by content hash
+    try:
+        upload = await read_upload(file, UPLOAD_MAX_BYTES)
+    except UploadTooLarge as e:
         INFERENCE_COUNTER.labels(mode=mode, status="error").inc()
-        raise HTTPException(status_code=500, detail=f"Failed to save image: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    UPLOAD_SIZE.observe(upload.size)
 
     try:
-        img = Image.open(file_path)
+        img = await executors.run(
+            "decode", preprocess_image, io.BytesIO(upload.content)
+        )
     except Exception as e:
         INFERENCE_COUNTER.labels(mode=mode, status="error").inc()
         raise HTTPException(status_code=400, detail=f"Invalid image file: {e}")
 
+    try:
+        file_path = await executors.run("io", store_upload, upload)
+    except Exception as e:
+        INFERENCE_COUNTER.labels(mode=mode, status="error").inc()
+        raise HTTPException(status_code=500, detail=f"Failed to save image: {e}")
+
+    schedule_thumbnails(img, file_path)
+
+    # The original bytes let the remote path skip re-encoding the image
+    return file_path, img, upload.content
+
+
+def schedule_thumbnails(img, file_path):
+    # The preprocessed image is already decoded, upright and bounded in
+    # size, so thumbnails come from it instead of the original file
+    task = asyncio.ensure_future(
+        executors.run("decode", write_thumbnails, img, file_path)
+    )
+    background_tasks.add(task)
+
+    def done(task):
+        background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Thumbnail generation failed for {file_path}: {task.exception()}")
+
+    task.add_done_callback(done)
+
+
+@app.post("/inference")
+async def inference(
+    request: Request,
+    question: str = Form(...), user_uuid: str = Form(...), file: UploadFile = File(...), mode: str = Form(...),
+    max_new_tokens: int | None = Form(None), timeout: float | None = Form(None),
+):
+    mode = resolve_mode(mode)
+    context = request_context(mode, timeout, max_new_tokens)
+    file_path, img, file_content = await save_upload(file, mode)
+
+    cache_key, response_content = await lookup_cached_response(
+        img, question, mode, context.max_new_tokens
+    )
+    if response_content is not None:
+        INFERENCE_COUNTER.labels(mode=mode, status="cached").inc()
+
+        await save_history(user_uuid, question, response_content, file_path)
+
+        return {"response": response_content}
+
     try:
         # Start timing the inference
         start_time = time.perf_counter()
         
         if mode == "local":
-            if processor is not None and model is not None:
-                response_content = await run_in_threadpool(
-                    query_local,
-                    model=model,
-                    processor=processor,
-                    device=device,
-                    image=img,
-                    question=question,
-                )
+            if local_pool is not None:
+                pending = local_pool.submit(img, question, context)
             else:
-                raise Exception("Local model not initialized")
+                pending = local_batcher.submit(img, question, context)
+            response_content = await wait_for_inference(
+                request, context, asyncio.wrap_future(pending)
+            )
         elif mode == "remote":
-            response_content = await run_in_threadpool(
-                query_remote,
-                image=img,
-                question=question,
-                client=client
+            response_content = await wait_for_inference(
+                request,
+                context,
+                remote_breaker.call(
+                    query_remote(
+                        image=img,
+                        question=question,
+                        engine=remote_engine,
+                        max_tokens=context.max_new_tokens or MAX_TOKENS,
+                        original=file_content,
+                        executors=executors,
+                    )
+                ),
+                cancel=True,
             )
         else: 
             INFERENCE_COUNTER.labels(mode="unknown", status="error").inc()
@@ -192,15 +864,139 @@ async def inference(
         duration = time.perf_counter() - start_time
         INFERENCE_DURATION.labels(mode=mode).observe(duration)
         INFERENCE_COUNTER.labels(mode=mode, status="success").inc()
+        auto_router.record(mode, duration)
 
-        try:
-            db.add_history_entry(user_uuid, question, response_content, file_path)
-        except Exception as db_e:
-            DB_ERRORS.labels(operation="save_history").inc()
-            print(f"Failed to save history: {db_e}")
+        await store_cached_response(cache_key, response_content)
+
+        await save_history(user_uuid, question, response_content, file_path)
 
         return {"response": response_content}
-    
+
+    except CircuitOpen as e:
+        # Another request's probe holds the half-open slots
+        INFERENCE_COUNTER.labels(mode=mode, status="circuit_open").inc()
+        raise circuit_open_error(e.retry_after)
+    except RequestCancelled as e:
+        INFERENCE_COUNTER.labels(mode=mode, status=e.reason).inc()
+        if e.reason == "timeout":
+            auto_router.record(mode, ok=False)
+            raise HTTPException(status_code=504, detail="Inference timed out")
+        # Nobody is listening; 499 is the conventional "client closed" code
+        raise HTTPException(status_code=499, detail="Client closed request")
     except Exception as e:
         INFERENCE_COUNTER.labels(mode=mode, status="error").inc()
-        raise HTTPException(status_code=500, detail=f"Inference error: {e}")
\ No newline at end of file
+        auto_router.record(mode, ok=False)
+        raise HTTPException(status_code=500, detail=f"Inference error: {e}")
+
+
+def sse_event(data: dict, event: str | None = None) -> str:
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
+
+
+@app.post("/inference/stream")
+async def inference_stream(
+    question: str = Form(...), user_uuid: str = Form(...), file: UploadFile = File(...), mode: str = Form(...),
+    max_new_tokens: int | None = Form(None), timeout: float | None = Form(None),
+):
+    mode = resolve_mode(mode)
+    if mode not in ("local", "remote"):
+        INFERENCE_COUNTER.labels(mode="unknown", status="error").inc()
+        raise HTTPException(status_code=400, detail="Invalid mode.")
+
+    context = request_context(mode, timeout, max_new_tokens)
+    file_path, img, file_content = await save_upload(file, mode)
+
+    cache_key, cached_response = await lookup_cached_response(
+        img, question, mode, context.max_new_tokens
+    )
+
+    if cached_response is not None:
+        INFERENCE_COUNTER.labels(mode=mode, status="cached").inc()
+
+        await save_history(user_uuid, question, cached_response, file_path)
+
+        # Replay the whole answer as a single token so clients need no special case
+        async def cached_stream():
+            yield sse_event({"token": cached_response})
+            yield sse_event({"response": cached_response}, event="done")
+
+        return StreamingResponse(cached_stream(), media_type="text/event-stream")
+
+    # Local generators block, so they are drained from the threadpool
+    if mode == "local" and local_pool is not None:
+        tokens = iterate_in_threadpool(
+            local_pool.submit_stream(img, question, context)
+        )
+    elif mode == "local":
+        local_tokens = stream_local(
+            model=model,
+            processor=processor,
+            device=device,
+            image=img,
+            question=question,
+            vision_cache=vision_cache,
+            prefix_cache=prefix_cache,
+            prompt_lookup_tokens=LOCAL_PROMPT_LOOKUP_TOKENS,
+            prompt_lookup_ngram=LOCAL_PROMPT_LOOKUP_NGRAM,
+            context=context,
+        )
+        tokens = iterate_in_threadpool(local_tokens)
+    else:
+        tokens = remote_breaker.stream(
+            stream_remote(
+                image=img,
+                question=question,
+                engine=remote_engine,
+                max_tokens=context.max_new_tokens or MAX_TOKENS,
+                context=context,
+                original=file_content,
+                executors=executors,
+            )
+        )
+
+    async def event_stream():
+        start_time = time.perf_counter()
+        chunks = []
+        try:
+            async for token in tokens:
+                if not chunks:
+                    INFERENCE_TTFT.labels(mode=mode).observe(
+                        time.perf_counter() - start_time
+                    )
+                chunks.append(token)
+                yield sse_event({"token": token})
+        except RequestCancelled as e:
+            INFERENCE_COUNTER.labels(mode=mode, status=e.reason).inc()
+            if e.reason == "timeout":
+                auto_router.record(mode, ok=False)
+            yield sse_event({"detail": str(e)}, event="error")
+            return
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client disconnected; stop generation at the next token
+            context.cancel("cancelled")
+            INFERENCE_COUNTER.labels(mode=mode, status="cancelled").inc()
+            raise
+        except Exception as e:  # noqa: BLE001 - sent to the client as an error event
+            INFERENCE_COUNTER.labels(mode=mode, status="error").inc()
+            auto_router.record(mode, ok=False)
+            yield sse_event({"detail": f"Inference error: {e}"}, event="error")
+            return
+        finally:
+            # Closes the upstream remote stream right away
+            await tokens.aclose()
+
+        duration = time.perf_counter() - start_time
+        INFERENCE_DURATION.labels(mode=mode).observe(duration)
+        INFERENCE_COUNTER.labels(mode=mode, status="success").inc()
+        auto_router.record(mode, duration)
+
+        response_content = "".join(chunks)
+        await store_cached_response(cache_key, response_content)
+        await save_history(user_uuid, question, response_content, file_path)
+
+        yield sse_event({"response": response_content}, event="done")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
\ No newline at end of file
@@ -0,0 +1,91 @@
+import threading
+from collections import deque
+
+from backend.utils.metrics import ROUTING_DECISIONS
+
+MODES = ("local", "remote")
+
+
+class AutoRouter:
+    """Picks the local or remote engine for `mode=auto` requests.
+
+    Local inference is preferred while its expected latency (recent latency
+    percentile scaled by how many batches are queued ahead) stays within the
+    SLO. Past that, requests overflow to the remote model unless it is
+    failing too often or is currently even slower.
+    """
+
+    def __init__(
+        self,
+        slo_seconds: float,
+        percentile: float = 95,
+        max_remote_error_rate: float = 0.2,
+        window: int = 200,
+        min_samples: int = 5,
+    ):
+        self.slo_seconds = slo_seconds
+        self.percentile = percentile
+        self.max_remote_error_rate = max_remote_error_rate
+        self.min_samples = max(1, min_samples)
+        self._latencies = {mode: deque(maxlen=window) for mode in MODES}
+        self._outcomes = {mode: deque(maxlen=window) for mode in MODES}
+        self._lock = threading.Lock()
+
+    def record(self, mode: str, duration: float | None = None, ok: bool = True):
+        # Fed next to INFERENCE_DURATION; failures carry no duration
+        if mode not in MODES:
+            return
+        with self._lock:
+            self._outcomes[mode].append(ok)
+            if ok and duration is not None:
+                self._latencies[mode].append(duration)
+
+    def latency(self, mode: str) -> float | None:
+        with self._lock:
+            samples = sorted(self._latencies[mode])
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return samples[index]
+
+    def error_rate(self, mode: str) -> float:
+        with self._lock:
+            outcomes = list(self._outcomes[mode])
+        if len(outcomes) < self.min_samples:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    def expected_local_latency(self, queue_depth: int, capacity: int) -> float | None:
+        latency = self.latency("local")
+        if latency is None:
+            return None
+        # Every full batch queued ahead costs roughly one more service time
+        return latency * (1 + queue_depth / max(1, capacity))
+
+    def choose(
+        self, local_ready: bool, queue_depth: int, capacity: int
+    ) -> tuple[str, str]:
+        mode, reason = self._choose(local_ready, queue_depth, capacity)
+        ROUTING_DECISIONS.labels(mode=mode, reason=reason).inc()
+        return mode, reason
+
+    def _choose(
+        self, local_ready: bool, queue_depth: int, capacity: int
+    ) -> tuple[str, str]:
+        if not local_ready:
+            return "remote", "local_unavailable"
+
+        expected = self.expected_local_latency(queue_depth, capacity)
+        if expected is None:
+            # No latency history yet: go by the queue alone
+            if queue_depth < max(1, capacity):
+                return "local", "local_idle"
+        elif expected <= self.slo_seconds:
+            return "local", "within_slo"
+
+        if self.error_rate("remote") > self.max_remote_error_rate:
+            return "local", "remote_unhealthy"
+        remote = self.latency("remote")
+        if expected is not None and remote is not None and remote >= expected:
+            return "local", "remote_slower"
+        return "remote", "local_overloaded"
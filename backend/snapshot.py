@@ -0,0 +1,101 @@
+"""Pre-converted local model snapshots.
+
+Writes the model, already cast to the serving dtype, plus its processor to a
+local directory so startup skips the hub cache and dtype conversion:
+
+    python -m backend.snapshot --output /models/qwen2-vl-bf16 --precision bf16
+
+Then start the backend with LOCAL_MODEL_SNAPSHOT=/models/qwen2-vl-bf16.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from backend.utils.consts import BASE_MODEL, LOCAL_MODEL_SNAPSHOT
+
+SNAPSHOT_INFO_FILE = "snapshot.json"
+
+
+def read_snapshot_info(path: str) -> dict:
+    info_path = os.path.join(path, SNAPSHOT_INFO_FILE)
+    if not os.path.isfile(info_path):
+        raise FileNotFoundError(
+            f"{path} is not a model snapshot (missing {SNAPSHOT_INFO_FILE})"
+        )
+    with open(info_path) as f:
+        return json.load(f)
+
+
+def model_source(
+    precision: str, snapshot: str = LOCAL_MODEL_SNAPSHOT
+) -> tuple[str, dict]:
+    """Where to load the local model from and the extra from_pretrained kwargs."""
+    if not snapshot:
+        return BASE_MODEL, {}
+
+    info = read_snapshot_info(snapshot)
+    if info["precision"] != precision:
+        raise ValueError(
+            f"Snapshot {snapshot} was written for precision {info['precision']!r}, "
+            f"but the local model is configured for {precision!r}"
+        )
+    # Weights stored in the serving dtype are memory-mapped as-is instead of
+    # copied, so replicas on one host share the page cache; local_files_only
+    # keeps from_pretrained off the network
+    return snapshot, {"local_files_only": True}
+
+
+def write_snapshot(
+    output_dir: str, precision: str, base_model: str = BASE_MODEL
+) -> dict:
+    # Imported here so reading snapshot info doesn't pull in transformers
+    from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+
+    from backend.local_model import precision_dtype
+
+    start = time.perf_counter()
+    model = Qwen2VLForConditionalGeneration.from_pretrained(
+        base_model, dtype=precision_dtype(precision)
+    )
+    processor = AutoProcessor.from_pretrained(base_model)
+
+    os.makedirs(output_dir, exist_ok=True)
+    # int8 is quantized at load time, so its snapshot holds the fp32 weights
+    model.save_pretrained(output_dir)
+    processor.save_pretrained(output_dir)
+
+    info = {
+        "base_model": base_model,
+        "precision": precision,
+        "dtype": str(precision_dtype(precision)).replace("torch.", ""),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(os.path.join(output_dir, SNAPSHOT_INFO_FILE), "w") as f:
+        json.dump(info, f, indent=2)
+
+    print(
+        f"Wrote {precision} snapshot of {base_model} to {output_dir} "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+    return info
+
+
+def main():
+    from backend.local_model import PRECISION_DTYPES
+    from backend.utils.consts import LOCAL_PRECISION
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", required=True, help="Snapshot directory")
+    parser.add_argument(
+        "--precision", default=LOCAL_PRECISION, choices=list(PRECISION_DTYPES)
+    )
+    parser.add_argument("--base-model", default=BASE_MODEL)
+    args = parser.parse_args()
+
+    write_snapshot(args.output, args.precision, args.base_model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import threading
+from contextlib import contextmanager
+
+from backend.utils.metrics import SPECULATIVE_ACCEPTANCE, SPECULATIVE_DRAFT_TOKENS
+
+# Prompt-lookup decoding: instead of running a draft model, candidate tokens
+# are copied from the first earlier n-gram (prompt or generated text) that
+# matches the tail of the sequence, and the model verifies all of them in a
+# single forward pass. Greedy output is identical to plain decoding.
+
+_active = threading.local()
+_install_lock = threading.Lock()
+
+
+def prompt_lookup_kwargs(num_tokens: int, max_ngram: int) -> dict:
+    if num_tokens <= 0:
+        return {}
+    return {
+        "prompt_lookup_num_tokens": num_tokens,
+        "max_matching_ngram_size": max_ngram,
+    }
+
+
+class DraftStats:
+    """Forward passes and drafted tokens seen during one generate() call."""
+
+    def __init__(self):
+        self.forward_calls = 0
+        self.drafted = 0
+
+    def accepted(self, new_tokens: int) -> int:
+        # Prefill yields the first token and every verification pass yields
+        # its accepted drafts plus one token of its own
+        return max(0, min(self.drafted, new_tokens - self.forward_calls))
+
+
+def _count_forward(module, args, kwargs):
+    stats = getattr(_active, "stats", None)
+    if stats is None:
+        return
+    tokens = kwargs.get("input_ids")
+    if tokens is None:
+        tokens = kwargs.get("inputs_embeds")
+    if stats.forward_calls > 0 and tokens is not None:
+        # Verification passes feed the last accepted token plus the drafts
+        stats.drafted += tokens.shape[1] - 1
+    stats.forward_calls += 1
+
+
+def _install_hook(model):
+    # One permanent hook per model; registering and removing hooks per
+    # request would race with forward passes running on other threads
+    with _install_lock:
+        if not getattr(model, "_draft_hook_installed", False):
+            model.register_forward_pre_hook(_count_forward, with_kwargs=True)
+            model._draft_hook_installed = True
+
+
+@contextmanager
+def track_draft_acceptance(model, enabled: bool = True):
+    # Counts only the forward passes made by the current thread
+    if not enabled:
+        yield None
+        return
+    _install_hook(model)
+    stats = DraftStats()
+    _active.stats = stats
+    try:
+        yield stats
+    finally:
+        _active.stats = None
+
+
+def record_acceptance(stats: DraftStats | None, new_tokens: int):
+    if stats is None or stats.drafted == 0:
+        return
+    accepted = stats.accepted(new_tokens)
+    SPECULATIVE_DRAFT_TOKENS.labels(outcome="accepted").inc(accepted)
+    SPECULATIVE_DRAFT_TOKENS.labels(outcome="rejected").inc(stats.drafted - accepted)
+    SPECULATIVE_ACCEPTANCE.observe(accepted / stats.drafted)
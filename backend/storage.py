@@ -0,0 +1,191 @@
+import hashlib
+import io
+import os
+import tempfile
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from PIL import Image
+
+from backend.utils.consts import THUMBNAIL_SIZES
+from backend.utils.metrics import THUMBNAILS_WRITTEN, UPLOAD_STORE_EVENTS
+
+UPLOAD_DIR = "uploads"
+CHUNK_SIZE = 64 * 1024
+THUMBNAIL_QUALITY = 80
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+TEMP_PREFIX = ".upload-"
+
+# Sniffed from the first bytes so identical content always gets one name,
+# whatever the client called the file
+MAGIC_EXTENSIONS = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+
+
+class UploadTooLarge(Exception):
+    """The upload went past the configured size limit while streaming."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upload exceeds {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+@dataclass
+class Upload:
+    content: bytes
+    digest: str  # sha256 of content
+    extension: str
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+    @property
+    def file_name(self) -> str:
+        return f"{self.digest}.{self.extension}"
+
+    @property
+    def relative_path(self) -> str:
+        return os.path.join(*shard_dirs(self.digest), self.file_name)
+
+
+def shard_dirs(digest: str) -> list[str]:
+    # Two levels of two hex characters: 65536 directories, so even millions
+    # of uploads keep every directory small
+    return [
+        digest[i : i + SHARD_WIDTH]
+        for i in range(0, SHARD_DEPTH * SHARD_WIDTH, SHARD_WIDTH)
+    ]
+
+
+def sniff_extension(head: bytes, filename: str = "") -> str:
+    for magic, extension in MAGIC_EXTENSIONS:
+        if head.startswith(magic):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    return extension if extension.isalnum() and len(extension) <= 5 else "bin"
+
+
+async def read_upload(file, max_bytes: int, chunk_size: int = CHUNK_SIZE) -> Upload:
+    """Read an UploadFile in chunks, hashing as it goes.
+
+    Stops as soon as the size limit is passed instead of buffering the whole
+    oversized body first.
+    """
+    declared = getattr(file, "size", None)
+    if declared is not None and declared > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    digest = hashlib.sha256()
+    buffer = io.BytesIO()
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        if buffer.tell() + len(chunk) > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        digest.update(chunk)
+        buffer.write(chunk)
+
+    # BytesIO hands over its internal bytes object here instead of copying
+    # it, so the upload is held in memory once
+    content = buffer.getvalue()
+    return Upload(
+        content=content,
+        digest=digest.hexdigest(),
+        extension=sniff_extension(content[:16], getattr(file, "filename", "") or ""),
+    )
+
+
+def write_atomic(path: str, data: bytes):
+    # Readers see either nothing or the whole file, never a partial one
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp creates the file owner-only; uploads are served statically
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_upload(upload: Upload, directory: str = UPLOAD_DIR) -> str:
+    """Write the upload under its content hash; returns the stored path.
+
+    Files are sharded into hash-prefix subdirectories, e.g.
+    uploads/3f/a2/3fa2....jpg. Identical content is stored once. Writes go
+    through a temporary file and an atomic rename, so a concurrent duplicate
+    never sees a partial file.
+    """
+    path = os.path.join(directory, upload.relative_path)
+    if os.path.exists(path):
+        # Refresh the age so the retention job doesn't take the file for an
+        # orphan before this upload's history row is written
+        os.utime(path)
+        UPLOAD_STORE_EVENTS.labels(result="deduplicated").inc()
+        return path
+
+    write_atomic(path, upload.content)
+    UPLOAD_STORE_EVENTS.labels(result="stored").inc()
+    return path
+
+
+def thumbnail_path(image_path: str, size: int) -> str:
+    # Stored next to the original, so it shares its (immutable) name
+    stem, _ = os.path.splitext(image_path)
+    return f"{stem}_{size}.jpg"
+
+
+def write_thumbnails(
+    image: Image.Image, image_path: str, sizes: Iterable[int] = THUMBNAIL_SIZES
+) -> list[str]:
+    """JPEG thumbnails bounded to each size; existing ones are kept."""
+    written = []
+    for size in sizes:
+        path = thumbnail_path(image_path, size)
+        if os.path.exists(path):
+            continue
+        thumbnail = image.copy()
+        if thumbnail.mode != "RGB":
+            thumbnail = thumbnail.convert("RGB")
+        thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffered = io.BytesIO()
+        thumbnail.save(buffered, format="JPEG", quality=THUMBNAIL_QUALITY)
+        write_atomic(path, buffered.getvalue())
+        THUMBNAILS_WRITTEN.inc()
+        written.append(path)
+    return written
+
+
+def thumbnail_urls(
+    image_url: str | None, sizes: Iterable[int] = THUMBNAIL_SIZES
+) -> dict[str, str]:
+    # Only thumbnails that exist: older uploads never got any, and new ones
+    # are written in the background right after the upload
+    if not image_url:
+        return {}
+    urls = {}
+    for size in sizes:
+        path = thumbnail_path(image_url, size)
+        if os.path.exists(path):
+            urls[str(size)] = path
+    return urls
+
+
+def attach_thumbnails(history: list[dict], sizes: Iterable[int] = THUMBNAIL_SIZES):
+    for entry in history:
+        entry["thumbnails"] = thumbnail_urls(entry.get("image_url"), sizes)
+    return history
@@ -0,0 +1,157 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import duckdb
+import pytest
+
+from backend.datamodels.datamodels import User
+from backend.db import analytics
+from backend.db.database import Database
+
+
+@pytest.fixture
+def test_db():
+    test_db_path = f"test_{uuid.uuid4()}.duckdb"
+    db = Database(db_path=test_db_path)
+    db.initialize_db()
+
+    yield db
+
+    db.close()
+    if os.path.exists(test_db_path):
+        os.remove(test_db_path)
+
+
+def add_users(db, count):
+    users = [
+        User(uuid=str(uuid.uuid4()), email=f"u{i}@example.com") for i in range(count)
+    ]
+    for user in users:
+        db.add_user(user)
+    return users
+
+
+def row(user_uuid, question="Q", response="A", image_url=None, timestamp=None):
+    return (
+        uuid.uuid4(),
+        user_uuid,
+        question,
+        image_url,
+        response,
+        timestamp or datetime.now(),
+    )
+
+
+def snapshot(db):
+    return (
+        db.get_requests_per_day(days=30),
+        db.get_user_activity(),
+        db.get_length_distributions(),
+        db.get_image_reuse(),
+    )
+
+
+class TestSummarize:
+    def test_length_bucket(self):
+        assert [analytics.length_bucket(n) for n in (0, 1, 2, 3, 5, 8, 9)] == [
+            0,
+            1,
+            2,
+            4,
+            8,
+            8,
+            16,
+        ]
+
+    def test_collapses_rows_per_key(self):
+        day = datetime(2024, 5, 1, 12)
+        summary = analytics.summarize(
+            [
+                row("a", "abc", timestamp=day, image_url="x.jpg"),
+                row("a", "abcd", timestamp=day + timedelta(hours=1), image_url="x.jpg"),
+                row("b", "", timestamp=day + timedelta(days=1)),
+            ]
+        )
+
+        assert sorted(summary["daily"]) == [
+            (day.date(), 2),
+            (day.date() + timedelta(days=1), 1),
+        ]
+        assert ("a", 2, 2, day, day + timedelta(hours=1)) in summary["users"]
+        assert ("question", 4, 2, 7) in summary["lengths"]
+        assert summary["images"] == [("x.jpg", 2)]
+
+
+class TestAnalytics:
+    def test_updated_on_every_write(self, test_db):
+        alice, bob = add_users(test_db, 2)
+        yesterday = datetime.now() - timedelta(days=1)
+        test_db.add_history_entries(
+            [
+                row(alice.uuid, timestamp=yesterday, image_url="uploads/a.jpg"),
+                row(alice.uuid, image_url="uploads/a.jpg"),
+                row(bob.uuid, image_url="uploads/b.jpg"),
+            ]
+        )
+        test_db.add_history_entry(bob.uuid, "Q", "A")
+
+        days = test_db.get_requests_per_day(days=2)
+        assert [(d["requests"], d["active_users"]) for d in days] == [(1, 1), (3, 2)]
+
+        activity = test_db.get_user_activity()
+        assert [
+            (a["user_uuid"], a["requests"], a["image_requests"]) for a in activity
+        ] == sorted([(alice.uuid, 2, 2), (bob.uuid, 2, 1)], key=lambda a: a[0])
+
+        reuse = test_db.get_image_reuse()
+        assert reuse == {"image_requests": 3, "distinct_images": 2, "reuse_rate": 1 / 3}
+
+    def test_length_distributions(self, test_db):
+        (user,) = add_users(test_db, 1)
+        test_db.add_history_entries(
+            [row(user.uuid, "a" * 3, "b" * 10), row(user.uuid, "a" * 4, "b" * 20)]
+        )
+
+        lengths = test_db.get_length_distributions()
+
+        assert lengths["question"] == {
+            "entries": 2,
+            "mean": 3.5,
+            "buckets": [{"le": 4, "entries": 2}],
+        }
+        assert lengths["response"]["buckets"] == [
+            {"le": 16, "entries": 1},
+            {"le": 32, "entries": 1},
+        ]
+
+    def test_failed_batch_leaves_summaries_untouched(self, test_db):
+        (user,) = add_users(test_db, 1)
+        before = snapshot(test_db)
+
+        with pytest.raises(duckdb.ConstraintException):
+            test_db.add_history_entries([row(user.uuid), row("unknown-user")])
+
+        assert snapshot(test_db) == before
+
+    def test_rebuild_matches_incremental(self, test_db):
+        users = add_users(test_db, 3)
+        for i in range(20):
+            test_db.add_history_entry(
+                users[i % 3].uuid, "Q" * i, "A" * (i * 7), f"uploads/{i % 4}.jpg"
+            )
+        incremental = snapshot(test_db)
+
+        test_db.rebuild_analytics()
+
+        assert snapshot(test_db) == incremental
+
+    def test_backfilled_on_initialize(self, test_db):
+        (user,) = add_users(test_db, 1)
+        test_db.add_history_entry(user.uuid, "Q", "A")
+        # As if the history was written before the summary tables existed
+        test_db.cursor().execute("DELETE FROM analytics_daily")
+
+        test_db.initialize_db()
+
+        assert test_db.get_requests_per_day()[0]["requests"] == 1
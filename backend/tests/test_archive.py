@@ -0,0 +1,214 @@
+import glob
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.datamodels.datamodels import User
+from backend.db import archive
+from backend.db.database import Database, encode_cursor
+
+NOW = datetime.now()
+CUTOFF = NOW - timedelta(days=30)
+
+
+@pytest.fixture
+def test_db(tmp_path):
+    db = Database(db_path=str(tmp_path / "app.duckdb"))
+    db.initialize_db()
+
+    yield db
+
+    db.close()
+
+
+@pytest.fixture
+def user(test_db):
+    user = User(uuid=str(uuid.uuid4()), email="test@example.com")
+    test_db.add_user(user)
+    return user
+
+
+def add_rows(db, user_uuid, days_ago, image_url=None):
+    # One entry per day, oldest first; returns their ids newest first
+    rows = [
+        (
+            uuid.uuid4(),
+            user_uuid,
+            f"Q{days}",
+            image_url,
+            f"A{days}",
+            NOW - timedelta(days=days),
+        )
+        for days in sorted(days_ago, reverse=True)
+    ]
+    db.add_history_entries(rows)
+    return [str(row[0]) for row in rows[::-1]]
+
+
+def count(db, table):
+    return db.cursor().execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+
+class TestArchiveHistory:
+    def test_moves_old_rows_to_partitioned_parquet(self, test_db, user):
+        add_rows(test_db, user.uuid, [1, 2, 40, 41])
+
+        assert test_db.archive_history(CUTOFF) == 2
+
+        assert count(test_db, "history") == 2
+        assert count(test_db, "history_archive") == 2
+        assert count(test_db, "history_all") == 4
+        days = {
+            os.path.basename(os.path.dirname(path))
+            for path in glob.glob(archive.history_glob(test_db.archive_dir))
+        }
+        assert days == {
+            f"day={(NOW - timedelta(days=d)).date().isoformat()}" for d in (40, 41)
+        }
+
+    def test_nothing_to_archive(self, test_db, user):
+        add_rows(test_db, user.uuid, [1])
+
+        assert test_db.archive_history(CUTOFF) == 0
+        assert not os.path.exists(test_db.archive_dir)
+
+    def test_later_batches_append(self, test_db, user):
+        add_rows(test_db, user.uuid, [40])
+        test_db.archive_history(CUTOFF)
+        add_rows(test_db, user.uuid, [50])
+        test_db.archive_history(CUTOFF)
+
+        assert count(test_db, "history_archive") == 2
+        assert count(test_db, "history_archive_batches") == 2
+
+    def test_history_pages_span_hot_and_archived(self, test_db, user):
+        ids = add_rows(test_db, user.uuid, range(0, 80, 10))
+        test_db.archive_history(CUTOFF)
+
+        assert [e["id"] for e in test_db.get_user_history(user.uuid)] == ids
+
+        pages, cursor = [], None
+        while True:
+            page = test_db.get_user_history(user.uuid, limit=3, before=cursor)
+            pages.append([e["id"] for e in page])
+            if len(page) < 3:
+                break
+            cursor = encode_cursor(page[-1])
+        assert pages == [ids[:3], ids[3:6], ids[6:]]
+
+    def test_imported_old_rows_are_merged(self, test_db, user):
+        archived = add_rows(test_db, user.uuid, [40, 60])
+        test_db.archive_history(CUTOFF)
+        # Older than some archived rows but back in the hot table
+        hot = add_rows(test_db, user.uuid, [50])
+
+        history = test_db.get_user_history(user.uuid)
+
+        assert [e["id"] for e in history] == [archived[0], hot[0], archived[1]]
+
+    def test_export_and_image_urls_include_archive(self, test_db, user):
+        add_rows(test_db, user.uuid, [1], "new.jpg")
+        add_rows(test_db, user.uuid, [40], "old.jpg")
+        test_db.archive_history(CUTOFF)
+
+        batches = list(test_db.iter_user_history_json(user.uuid))
+        entries = [json.loads(entry) for batch in batches for entry in batch]
+
+        assert entries == test_db.get_user_history(user.uuid)
+        assert [e["image_url"] for e in entries] == ["new.jpg", "old.jpg"]
+        assert test_db.get_image_urls() == {"new.jpg", "old.jpg"}
+
+    def test_replace_image_url_only_in_hot_rows(self, test_db, user):
+        add_rows(test_db, user.uuid, [1, 2], "hot.jpg")
+        add_rows(test_db, user.uuid, [40], "old.jpg")
+        add_rows(test_db, user.uuid, [1], "both.jpg")
+        add_rows(test_db, user.uuid, [40], "both.jpg")
+        test_db.archive_history(CUTOFF)
+
+        assert test_db.get_archived_image_urls() == {"old.jpg", "both.jpg"}
+        assert test_db.replace_image_url("hot.jpg", "small.jpg") is True
+        # Archived Parquet can't be rewritten, so their uploads stay as they are
+        assert test_db.replace_image_url("both.jpg", "other.jpg") is False
+        assert test_db.get_image_urls() == {"small.jpg", "old.jpg", "both.jpg"}
+
+    def test_analytics_unchanged(self, test_db, user):
+        add_rows(test_db, user.uuid, [1, 40, 41], "img.jpg")
+        before = (test_db.get_user_activity(), test_db.get_length_distributions())
+
+        test_db.archive_history(CUTOFF)
+        assert (
+            test_db.get_user_activity(),
+            test_db.get_length_distributions(),
+        ) == before
+        test_db.rebuild_analytics()
+        assert (
+            test_db.get_user_activity(),
+            test_db.get_length_distributions(),
+        ) == before
+
+    def test_survives_reconnect(self, test_db, user):
+        ids = add_rows(test_db, user.uuid, [1, 40])
+        test_db.archive_history(CUTOFF)
+        test_db.close()
+
+        db = Database(db_path=test_db.db_path)
+        db.initialize_db()
+        try:
+            assert [e["id"] for e in db.get_user_history(user.uuid)] == ids
+        finally:
+            db.close()
+
+    def test_uncommitted_batch_files_removed(self, test_db, user):
+        add_rows(test_db, user.uuid, [40])
+        test_db.archive_history(CUTOFF)
+        # What a run that failed after writing its files leaves behind
+        day_dir = os.path.dirname(
+            glob.glob(archive.history_glob(test_db.archive_dir))[0]
+        )
+        orphan = os.path.join(day_dir, f"batch-{uuid.uuid4().hex}-x.parquet")
+        with open(orphan, "wb") as f:
+            f.write(b"not parquet")
+
+        test_db.initialize_db()
+
+        assert not os.path.exists(orphan)
+        assert count(test_db, "history_all") == 1
+
+
+class TestExportImport:
+    def test_round_trip(self, test_db, user, tmp_path):
+        ids = add_rows(test_db, user.uuid, [1, 40], "img.jpg")
+        test_db.archive_history(CUTOFF)
+        activity = test_db.get_user_activity()
+
+        assert test_db.export_data(str(tmp_path / "export")) == (1, 2)
+
+        db = Database(db_path=str(tmp_path / "fresh.duckdb"))
+        db.initialize_db()
+        try:
+            assert db.import_data(str(tmp_path / "export")) == (1, 2)
+            assert db.get_user(user.uuid).email == user.email
+            assert [e["id"] for e in db.get_user_history(user.uuid)] == ids
+            assert db.get_user_activity() == activity
+            # Importing the same export again adds nothing
+            assert db.import_data(str(tmp_path / "export")) == (0, 0)
+        finally:
+            db.close()
+
+    def test_import_skips_existing_rows(self, test_db, user, tmp_path):
+        add_rows(test_db, user.uuid, [1, 40])
+        test_db.export_data(str(tmp_path / "export"))
+        test_db.archive_history(CUTOFF)
+
+        assert test_db.import_data(str(tmp_path / "export")) == (0, 0)
+        assert count(test_db, "history_all") == 2
+
+    def test_export_refuses_non_empty_directory(self, test_db, tmp_path):
+        (tmp_path / "export").mkdir()
+        (tmp_path / "export" / "file").write_text("x")
+
+        with pytest.raises(FileExistsError):
+            test_db.export_data(str(tmp_path / "export"))
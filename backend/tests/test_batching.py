@@ -0,0 +1,189 @@
+import threading
+import time
+
+import pytest
+from batching import LocalBatcher
+from PIL import Image
+
+from backend.cancellation import RequestCancelled, RequestContext
+
+
+@pytest.fixture
+def sample_image():
+    return Image.new("RGB", (10, 10), color="green")
+
+
+def echo_batch(calls):
+    def run_batch(images, questions, contexts):
+        calls.append(list(questions))
+        return [f"answer to {q}" for q in questions]
+
+    return run_batch
+
+
+class TestLocalBatcher:
+    def test_single_request(self, sample_image):
+        calls = []
+        batcher = LocalBatcher(echo_batch(calls), max_batch_size=4, max_wait_ms=10)
+        batcher.start()
+        try:
+            result = batcher.submit(sample_image, "Q1").result(timeout=5)
+        finally:
+            batcher.stop()
+
+        assert result == "answer to Q1"
+        assert calls == [["Q1"]]
+
+    def test_concurrent_requests_are_batched(self, sample_image):
+        calls = []
+        batcher = LocalBatcher(echo_batch(calls), max_batch_size=4, max_wait_ms=500)
+        batcher.start()
+        try:
+            futures = [batcher.submit(sample_image, f"Q{i}") for i in range(4)]
+            results = [f.result(timeout=5) for f in futures]
+        finally:
+            batcher.stop()
+
+        assert results == [f"answer to Q{i}" for i in range(4)]
+        assert calls == [["Q0", "Q1", "Q2", "Q3"]]
+
+    def test_max_batch_size_respected(self, sample_image):
+        calls = []
+        batcher = LocalBatcher(echo_batch(calls), max_batch_size=2, max_wait_ms=200)
+        batcher.start()
+        try:
+            futures = [batcher.submit(sample_image, f"Q{i}") for i in range(5)]
+            for f in futures:
+                f.result(timeout=5)
+        finally:
+            batcher.stop()
+
+        assert all(len(batch) <= 2 for batch in calls)
+        assert sum(len(batch) for batch in calls) == 5
+
+    def test_batch_error_propagates_to_every_caller(self, sample_image):
+        gate = threading.Event()
+
+        def failing_batch(images, questions, contexts):
+            gate.wait(timeout=5)
+            raise RuntimeError("generate failed")
+
+        batcher = LocalBatcher(failing_batch, max_batch_size=4, max_wait_ms=200)
+        batcher.start()
+        try:
+            futures = [batcher.submit(sample_image, f"Q{i}") for i in range(2)]
+            gate.set()
+            for f in futures:
+                with pytest.raises(RuntimeError, match="generate failed"):
+                    f.result(timeout=5)
+        finally:
+            batcher.stop()
+
+    def test_output_count_mismatch(self, sample_image):
+        batcher = LocalBatcher(lambda images, questions, contexts: [], max_wait_ms=10)
+        batcher.start()
+        try:
+            with pytest.raises(RuntimeError, match="outputs"):
+                batcher.submit(sample_image, "Q").result(timeout=5)
+        finally:
+            batcher.stop()
+
+    def test_queue_depth(self, sample_image):
+        release = threading.Event()
+
+        def blocking_batch(images, questions, contexts):
+            release.wait(5)
+            return questions
+
+        batcher = LocalBatcher(blocking_batch, max_batch_size=1, max_wait_ms=0)
+        batcher.start()
+        try:
+            futures = [batcher.submit(sample_image, f"Q{i}") for i in range(3)]
+            # The first request is taken into a batch; the rest wait
+            for _ in range(100):
+                if batcher.queue_depth() == 2:
+                    break
+                time.sleep(0.01)
+            assert batcher.queue_depth() == 2
+            assert batcher.capacity() == 1
+            release.set()
+            for f in futures:
+                f.result(timeout=5)
+        finally:
+            release.set()
+            batcher.stop()
+
+        assert batcher.queue_depth() == 0
+
+    def test_submit_requires_start(self, sample_image):
+        batcher = LocalBatcher(echo_batch([]))
+        with pytest.raises(RuntimeError, match="not running"):
+            batcher.submit(sample_image, "Q")
+
+    def test_stop_is_idempotent(self):
+        batcher = LocalBatcher(echo_batch([]), max_wait_ms=10)
+        batcher.start()
+        time.sleep(0.01)
+        batcher.stop()
+        batcher.stop()
+
+
+class TestLocalBatcherCancellation:
+    def test_cancelled_requests_are_dropped(self, sample_image):
+        calls = []
+        gate = threading.Event()
+
+        def gated_batch(images, questions, contexts):
+            gate.wait(timeout=5)
+            calls.append(list(questions))
+            return [f"answer to {q}" for q in questions]
+
+        batcher = LocalBatcher(gated_batch, max_batch_size=1, max_wait_ms=0)
+        batcher.start()
+        try:
+            first = batcher.submit(sample_image, "Q0")
+            context = RequestContext()
+            dropped = batcher.submit(sample_image, "Q1", context)
+            context.cancel()
+            gate.set()
+
+            assert first.result(timeout=5) == "answer to Q0"
+            with pytest.raises(RequestCancelled):
+                dropped.result(timeout=5)
+            assert calls == [["Q0"]]
+        finally:
+            batcher.stop()
+
+    def test_exception_output_fails_only_that_caller(self, sample_image):
+        def partial_batch(images, questions, contexts):
+            return ["ok", RequestCancelled("timeout")]
+
+        batcher = LocalBatcher(partial_batch, max_batch_size=2, max_wait_ms=200)
+        batcher.start()
+        try:
+            futures = [batcher.submit(sample_image, f"Q{i}") for i in range(2)]
+            assert futures[0].result(timeout=5) == "ok"
+            with pytest.raises(RequestCancelled):
+                futures[1].result(timeout=5)
+        finally:
+            batcher.stop()
+
+    def test_cancelled_future_does_not_stop_worker(self, sample_image):
+        gate = threading.Event()
+
+        def gated_batch(images, questions, contexts):
+            gate.wait(timeout=5)
+            return [f"answer to {q}" for q in questions]
+
+        batcher = LocalBatcher(gated_batch, max_batch_size=1, max_wait_ms=0)
+        batcher.start()
+        try:
+            abandoned = batcher.submit(sample_image, "Q0")
+            assert abandoned.cancel()
+            gate.set()
+
+            assert batcher.submit(sample_image, "Q1").result(timeout=5) == (
+                "answer to Q1"
+            )
+        finally:
+            batcher.stop()
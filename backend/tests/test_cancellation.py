@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from backend.cancellation import RequestCancelled, RequestContext
+
+
+class TestRequestContext:
+    def test_no_deadline(self):
+        context = RequestContext()
+        assert context.remaining() is None
+        assert not context.should_stop()
+        context.check()
+
+    def test_deadline_expires(self):
+        context = RequestContext(timeout=0.05)
+        assert not context.should_stop()
+        time.sleep(0.06)
+        assert context.reason == "timeout"
+        with pytest.raises(RequestCancelled) as error:
+            context.check()
+        assert error.value.reason == "timeout"
+        assert str(error.value) == "Inference timed out"
+
+    def test_cancel_runs_callbacks_once(self):
+        context = RequestContext(timeout=60)
+        reasons = []
+        context.on_cancel(reasons.append)
+
+        context.cancel()
+        context.cancel("timeout")
+
+        assert reasons == ["cancelled"]
+        assert context.reason == "cancelled"
+
+    def test_on_cancel_after_cancel_runs_immediately(self):
+        context = RequestContext()
+        context.cancel()
+        reasons = []
+        context.on_cancel(reasons.append)
+        assert reasons == ["cancelled"]
+
+    def test_cancel_check(self):
+        flag = {"stop": False}
+        context = RequestContext(cancel_check=lambda: flag["stop"])
+        assert not context.should_stop()
+        flag["stop"] = True
+        assert context.reason == "cancelled"
+
+    def test_explicit_deadline(self):
+        context = RequestContext(deadline=time.time() - 1, max_new_tokens=8)
+        assert context.max_new_tokens == 8
+        assert context.remaining() == 0.0
+        assert context.should_stop()
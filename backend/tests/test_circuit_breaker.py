@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from backend.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpen,
+)
+from backend.utils.metrics import REMOTE_CIRCUIT_STATE
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(**kwargs):
+    clock = FakeClock()
+    kwargs.setdefault("min_calls", 4)
+    kwargs.setdefault("window", 4)
+    kwargs.setdefault("open_seconds", 10)
+    kwargs.setdefault("half_open_calls", 1)
+    return CircuitBreaker(clock=clock, **kwargs), clock
+
+
+def trip(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.acquire()
+        breaker.release(False)
+
+
+async def succeed():
+    return "ok"
+
+
+async def fail():
+    raise RuntimeError("upstream down")
+
+
+class TestCircuitBreakerStates:
+    def test_opens_at_failure_rate(self):
+        breaker, _ = make_breaker(failure_rate=0.5)
+        for ok in (True, False, True):
+            breaker.acquire()
+            breaker.release(ok)
+        assert breaker.state == CLOSED
+
+        breaker.acquire()
+        breaker.release(False)
+
+        assert breaker.state == OPEN
+        assert REMOTE_CIRCUIT_STATE._value.get() == 1
+
+    def test_slow_calls_count_as_failures(self):
+        breaker, _ = make_breaker(failure_rate=1.0, slow_call_seconds=1.0)
+        for _ in range(4):
+            breaker.acquire()
+            breaker.release(True, duration=5.0)
+
+        assert breaker.state == OPEN
+
+    def test_open_fails_fast_with_retry_after(self):
+        breaker, clock = make_breaker()
+        trip(breaker)
+        clock.now = 4
+
+        with pytest.raises(CircuitOpen) as excinfo:
+            breaker.acquire()
+        assert excinfo.value.retry_after == 6
+
+    def test_half_open_probe_closes(self):
+        breaker, clock = make_breaker()
+        trip(breaker)
+        clock.now = 10
+
+        assert breaker.state == HALF_OPEN
+        breaker.acquire()
+        # Only one probe at a time
+        with pytest.raises(CircuitOpen):
+            breaker.acquire()
+        breaker.release(True)
+
+        assert breaker.state == CLOSED
+        assert REMOTE_CIRCUIT_STATE._value.get() == 0
+
+    def test_failed_probe_reopens(self):
+        breaker, clock = make_breaker()
+        trip(breaker)
+        clock.now = 10
+        breaker.acquire()
+        breaker.release(False)
+
+        assert breaker.state == OPEN
+        assert breaker.retry_after() == 10
+
+    def test_unfinished_probe_frees_its_slot(self):
+        breaker, clock = make_breaker()
+        trip(breaker)
+        clock.now = 10
+        breaker.acquire()
+        breaker.release(None)
+
+        breaker.acquire()
+        assert breaker.state == HALF_OPEN
+
+
+class TestCircuitBreakerCalls:
+    @pytest.mark.asyncio
+    async def test_call_records_outcomes(self):
+        breaker, _ = make_breaker(failure_rate=0.5, min_calls=2, window=2)
+
+        assert await breaker.call(succeed()) == "ok"
+        with pytest.raises(RuntimeError):
+            await breaker.call(fail())
+
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpen):
+            await breaker.call(succeed())
+
+    @pytest.mark.asyncio
+    async def test_cancelled_call_is_not_a_failure(self):
+        breaker, _ = make_breaker(failure_rate=0.1, min_calls=1, window=1)
+
+        task = asyncio.ensure_future(breaker.call(asyncio.sleep(5)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert breaker.state == CLOSED
+
+    @pytest.mark.asyncio
+    async def test_stream_failure_before_first_token(self):
+        breaker, _ = make_breaker(failure_rate=0.5, min_calls=1, window=1)
+
+        async def broken():
+            raise RuntimeError("upstream down")
+            yield
+
+        with pytest.raises(RuntimeError):
+            async for _ in breaker.stream(broken()):
+                pass
+
+        assert breaker.state == OPEN
+
+    @pytest.mark.asyncio
+    async def test_stream_passes_tokens_through(self):
+        breaker, _ = make_breaker(min_calls=1, window=1)
+
+        async def tokens():
+            yield "a"
+            yield "b"
+
+        assert [t async for t in breaker.stream(tokens())] == ["a", "b"]
+        assert breaker.state == CLOSED
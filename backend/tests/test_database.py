@@ -1,9 +1,14 @@
-import pytest
+import json
 import os
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from db.database import Database
+
+import duckdb
+import pytest
 from datamodels.datamodels import User
+from db.database import Database, InvalidCursor, encode_cursor, history_row
 
 
 @pytest.fixture
@@ -61,6 +66,14 @@ class TestDatabase:
         result = test_db.get_user("nonexistent-uuid")
         assert result is None
 
+    def test_get_user_by_email(self, test_db, sample_user):
+        test_db.add_user(sample_user)
+
+        result = test_db.get_user_by_email(sample_user.email)
+
+        assert result.uuid == sample_user.uuid
+        assert test_db.get_user_by_email("nobody@example.com") is None
+
     def test_add_history_entry(self, test_db, sample_user):
         test_db.add_user(sample_user)
 
@@ -114,6 +127,38 @@ class TestDatabase:
         assert history[1]["question"] == "Question 2"
         assert history[2]["question"] == "Question 1"
 
+    def test_get_image_urls(self, test_db, sample_user):
+        test_db.add_user(sample_user)
+
+        for image_url in ("img1.jpg", "img1.jpg", "img2.jpg", None):
+            test_db.add_history_entry(sample_user.uuid, "Q", "A", image_url)
+
+        assert test_db.get_image_urls() == {"img1.jpg", "img2.jpg"}
+
+    def test_add_history_entries(self, test_db, sample_user):
+        test_db.add_user(sample_user)
+        rows = [history_row(sample_user.uuid, f"Q{i}", f"A{i}") for i in range(3)]
+
+        test_db.add_history_entries(rows)
+
+        history = test_db.get_user_history(sample_user.uuid)
+        assert [entry["id"] for entry in history] == [str(r[0]) for r in rows[::-1]]
+
+    def test_add_history_entries_all_or_nothing(self, test_db, sample_user):
+        test_db.add_user(sample_user)
+        rows = [
+            history_row(sample_user.uuid, "Q", "A"),
+            history_row(str(uuid.uuid4()), "Q", "A"),  # unknown user
+        ]
+
+        with pytest.raises(duckdb.ConstraintException):
+            test_db.add_history_entries(rows)
+
+        assert test_db.get_user_history(sample_user.uuid) == []
+        # The cursor is usable again after the rollback
+        test_db.add_history_entries(rows[:1])
+        assert len(test_db.get_user_history(sample_user.uuid)) == 1
+
     def test_get_user_history_limit(self, test_db, sample_user):
         test_db.add_user(sample_user)
 
@@ -123,6 +168,53 @@ class TestDatabase:
         history = test_db.get_user_history(sample_user.uuid, limit=5)
         assert len(history) == 5
 
+    def test_get_user_history_before_cursor(self, test_db, sample_user):
+        test_db.add_user(sample_user)
+        rows = [history_row(sample_user.uuid, f"Q{i}", "A") for i in range(5)]
+        # Same timestamp everywhere: the id breaks the tie
+        rows = [(r[0], r[1], r[2], r[3], r[4], rows[0][5]) for r in rows]
+        test_db.add_history_entries(rows)
+
+        first = test_db.get_user_history(sample_user.uuid, limit=3)
+        rest = test_db.get_user_history(
+            sample_user.uuid, limit=3, before=encode_cursor(first[-1])
+        )
+
+        ids = [entry["id"] for entry in first + rest]
+        assert len(rest) == 2
+        assert sorted(ids) == sorted(str(r[0]) for r in rows)
+
+    def test_get_user_history_large_limit(self, test_db, sample_user):
+        test_db.add_user(sample_user)
+        rows = [history_row(sample_user.uuid, f"Q{i}", "A") for i in range(250)]
+        test_db.add_history_entries(rows)
+
+        history = test_db.get_user_history(sample_user.uuid, limit=1000)
+
+        assert [entry["id"] for entry in history] == [str(r[0]) for r in rows[::-1]]
+
+    def test_iter_user_history_json_matches_dicts(self, test_db, sample_user):
+        test_db.add_user(sample_user)
+        test_db.add_history_entry(sample_user.uuid, 'Say "hi"\né', "A", "img.jpg")
+        for i in range(4):
+            test_db.add_history_entry(sample_user.uuid, f"Q{i}", "A")
+
+        batches = list(test_db.iter_user_history_json(sample_user.uuid, 2))
+
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        entries = [json.loads(entry) for batch in batches for entry in batch]
+        assert entries == test_db.get_user_history(sample_user.uuid)
+
+    def test_get_user_history_invalid_cursor(self, test_db, sample_user):
+        with pytest.raises(InvalidCursor):
+            test_db.get_user_history(sample_user.uuid, before="not-a-cursor")
+
+    def test_history_index_created(self, test_db):
+        indexes = test_db.con.execute(
+            "SELECT index_name FROM duckdb_indexes() WHERE table_name = 'history'"
+        ).fetchall()
+        assert ("history_user",) in indexes
+
     def test_get_user_history_empty(self, test_db, sample_user):
         test_db.add_user(sample_user)
 
@@ -153,3 +245,35 @@ class TestDatabase:
 
         timestamp_str = history[0]["timestamp"]
         datetime.fromisoformat(timestamp_str)
+
+
+class TestDatabaseThreads:
+    def test_cursor_per_thread(self, test_db):
+        cursors = []
+        thread = threading.Thread(target=lambda: cursors.append(test_db.cursor()))
+        thread.start()
+        thread.join()
+
+        assert test_db.cursor() is test_db.cursor()
+        assert cursors[0] is not test_db.cursor()
+
+    def test_concurrent_writes_and_reads(self, test_db, sample_user):
+        test_db.add_user(sample_user)
+
+        def work(i):
+            for j in range(20):
+                test_db.add_history_entry(sample_user.uuid, f"Q{i}-{j}", "A")
+                test_db.get_user_history(sample_user.uuid, limit=5)
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            # result() re-raises anything a thread hit
+            for future in [pool.submit(work, i) for i in range(4)]:
+                future.result()
+
+        assert len(test_db.get_user_history(sample_user.uuid, limit=100)) == 80
+
+    def test_reconnect_after_close(self, test_db, sample_user):
+        test_db.add_user(sample_user)
+        test_db.close()
+
+        assert test_db.get_user(sample_user.uuid).email == sample_user.email
@@ -0,0 +1,98 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import pytest
+
+from backend.executors import Executors, LoopLagMonitor
+from backend.utils.metrics import EVENT_LOOP_LAG, EXECUTOR_QUEUE_SECONDS
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def histogram_count(histogram):
+    return next(
+        sample.value
+        for metric in histogram.collect()
+        for sample in metric.samples
+        if sample.name.endswith("_count")
+    )
+
+
+class TestExecutors:
+    @pytest.mark.asyncio
+    async def test_runs_off_the_event_loop(self):
+        executors = Executors()
+        try:
+            thread = await executors.run("db", lambda: threading.current_thread().name)
+        finally:
+            executors.shutdown()
+
+        assert thread.startswith("db")
+
+    @pytest.mark.asyncio
+    async def test_passes_arguments_and_contextvars(self):
+        executors = Executors()
+        request_id.set("abc")
+        try:
+            result = await executors.run(
+                "io", lambda a, b=0: (a + b, request_id.get()), 1, b=2
+            )
+        finally:
+            executors.shutdown()
+
+        assert result == (3, "abc")
+
+    @pytest.mark.asyncio
+    async def test_pools_are_isolated(self):
+        executors = Executors(db_threads=1)
+        release = threading.Event()
+        try:
+            blocked = asyncio.ensure_future(executors.run("db", release.wait, 5))
+            # A saturated DB pool doesn't hold up decoding
+            assert (
+                await asyncio.wait_for(executors.run("decode", lambda: "ok"), 1) == "ok"
+            )
+            assert not blocked.done()
+            release.set()
+            assert await blocked is True
+        finally:
+            release.set()
+            executors.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_records_queue_wait(self):
+        queue_wait = EXECUTOR_QUEUE_SECONDS.labels(pool="io")
+        before = queue_wait._sum.get()
+        executors = Executors(io_threads=1)
+        try:
+            await asyncio.gather(
+                executors.run("io", time.sleep, 0.1), executors.run("io", time.sleep, 0)
+            )
+        finally:
+            executors.shutdown()
+
+        # The second call waited for the first one's thread
+        assert queue_wait._sum.get() - before >= 0.05
+
+
+class TestLoopLagMonitor:
+    @pytest.mark.asyncio
+    async def test_records_blocked_loop(self):
+        before = histogram_count(EVENT_LOOP_LAG)
+        lag_before = EVENT_LOOP_LAG._sum.get()
+        monitor = LoopLagMonitor(interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        # A callback that blocks the loop, as a stray sync call in a handler would
+        asyncio.get_running_loop().call_soon(time.sleep, 0.1)
+        await asyncio.sleep(0.15)
+        await monitor.stop()
+
+        assert histogram_count(EVENT_LOOP_LAG) > before
+        assert EVENT_LOOP_LAG._sum.get() - lag_before >= 0.05
+
+    @pytest.mark.asyncio
+    async def test_stop_without_start(self):
+        await LoopLagMonitor().stop()
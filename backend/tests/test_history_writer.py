@@ -0,0 +1,149 @@
+import asyncio
+import os
+import threading
+import uuid
+
+import pytest
+
+from backend.datamodels.datamodels import User
+from backend.db.database import Database
+from backend.db.history_writer import HistoryWriter
+from backend.executors import Executors
+from backend.utils.metrics import DB_ERRORS
+
+
+@pytest.fixture
+def test_db():
+    test_db_path = f"test_{uuid.uuid4()}.duckdb"
+    db = Database(db_path=test_db_path)
+    db.initialize_db()
+
+    yield db
+
+    db.close()
+    if os.path.exists(test_db_path):
+        os.remove(test_db_path)
+
+
+@pytest.fixture
+def user(test_db):
+    user = User(uuid=str(uuid.uuid4()), email="writer@example.com")
+    test_db.add_user(user)
+    return user
+
+
+class CountingExecutors(Executors):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    async def run(self, pool, fn, rows):
+        self.batches.append(len(rows))
+        return await super().run(pool, fn, rows)
+
+
+@pytest.fixture
+def executors():
+    executors = CountingExecutors()
+
+    yield executors
+
+    executors.shutdown()
+
+
+class TestHistoryWriter:
+    @pytest.mark.asyncio
+    async def test_submit_does_not_touch_the_database(self, test_db, user, executors):
+        writer = HistoryWriter(test_db, executors, flush_interval=60)
+        writer.start()
+
+        await writer.submit(user.uuid, "Q", "A")
+
+        assert writer.pending() == 1
+        assert executors.batches == []
+        await writer.close()
+
+    @pytest.mark.asyncio
+    async def test_flushes_full_batch(self, test_db, user, executors):
+        writer = HistoryWriter(test_db, executors, batch_size=3, flush_interval=60)
+        writer.start()
+
+        for i in range(3):
+            await writer.submit(user.uuid, f"Q{i}", "A")
+        for _ in range(100):
+            if writer.pending() == 0 and executors.batches:
+                break
+            await asyncio.sleep(0.01)
+
+        assert executors.batches == [3]
+        await writer.close()
+
+    @pytest.mark.asyncio
+    async def test_writes_on_the_db_pool(self, test_db, user, executors):
+        threads = []
+        add_history_entries = test_db.add_history_entries
+
+        def record_thread(rows):
+            threads.append(threading.current_thread().name)
+            add_history_entries(rows)
+
+        test_db.add_history_entries = record_thread
+        writer = HistoryWriter(test_db, executors, flush_interval=60)
+
+        await writer.submit(user.uuid, "Q", "A")
+        await writer.flush()
+
+        assert len(threads) == 1 and threads[0].startswith("db")
+
+    @pytest.mark.asyncio
+    async def test_flushes_partial_batch_after_interval(self, test_db, user, executors):
+        writer = HistoryWriter(test_db, executors, batch_size=100, flush_interval=0.05)
+        writer.start()
+
+        await writer.submit(user.uuid, "Q", "A")
+        await asyncio.sleep(0.3)
+
+        assert len(test_db.get_user_history(user.uuid)) == 1
+        await writer.close()
+
+    @pytest.mark.asyncio
+    async def test_close_writes_everything_queued(self, test_db, user, executors):
+        writer = HistoryWriter(test_db, executors, batch_size=2, flush_interval=60)
+        writer.start()
+        for i in range(5):
+            await writer.submit(user.uuid, f"Q{i}", "A")
+
+        await writer.close()
+
+        history = test_db.get_user_history(user.uuid)
+        # Timestamps are taken at submit time, so the order is preserved
+        assert [entry["question"] for entry in history] == [
+            f"Q{i}" for i in reversed(range(5))
+        ]
+
+    @pytest.mark.asyncio
+    async def test_bad_row_does_not_lose_the_batch(self, test_db, user, executors):
+        writer = HistoryWriter(test_db, executors, flush_interval=60)
+        errors = DB_ERRORS.labels(operation="save_history")
+        before = errors._value.get()
+
+        await writer.submit(user.uuid, "Q1", "A")
+        await writer.submit(str(uuid.uuid4()), "Q2", "A")  # unknown user
+        await writer.submit(user.uuid, "Q3", "A")
+        await writer.flush()
+
+        questions = {e["question"] for e in test_db.get_user_history(user.uuid)}
+        assert questions == {"Q1", "Q3"}
+        assert errors._value.get() == before + 1
+
+    @pytest.mark.asyncio
+    async def test_backlog_makes_submit_flush(self, test_db, user, executors):
+        writer = HistoryWriter(
+            test_db, executors, batch_size=2, flush_interval=60, max_pending=2
+        )
+
+        for i in range(3):
+            await writer.submit(user.uuid, f"Q{i}", "A")
+
+        assert executors.batches == [2]
+        assert writer.pending() == 1
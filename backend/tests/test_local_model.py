@@ -1,7 +1,26 @@
-import pytest
+import threading
+import time
 from unittest.mock import MagicMock, patch
+
+import pytest
+import torch
+from cache.vision_cache import VisionFeatureCache
+from local_model import (
+    GENERATE_LOCK,
+    CancellationCriteria,
+    apply_precision,
+    generation_limits,
+    precision_dtype,
+    prefix_cache_kwargs,
+    prompt_prefix,
+    query_local,
+    query_local_batch,
+    stream_local,
+    warmup_local,
+)
 from PIL import Image
-from local_model import query_local
+
+from backend.cancellation import RequestCancelled, RequestContext
 
 
 @pytest.fixture
@@ -73,13 +92,15 @@ class TestQueryLocal:
         )
         call_args = mock_processor.apply_chat_template.call_args
         messages = call_args[0][0]
-        assert len(messages) == 1
-        assert messages[0]["role"] == "user"
-        assert "type" in messages[0]["content"][1]
-        assert "text" in messages[0]["content"][1]
+        assert len(messages) == 2
+        assert messages[0]["role"] == "system"
+        assert "math tutor" in messages[0]["content"].lower()
+
+        assert messages[1]["role"] == "user"
+        assert "type" in messages[1]["content"][1]
+        assert "text" in messages[1]["content"][1]
 
-        text_content = messages[0]["content"][1]["text"]
-        assert "math tutor" in text_content.lower()
+        text_content = messages[1]["content"][1]["text"]
         assert "Solve this equation" in text_content
 
     @patch("local_model.process_vision_info")
@@ -179,3 +200,574 @@ class TestQueryLocal:
         call_kwargs = mock_processor.batch_decode.call_args[1]
         assert call_kwargs.get("skip_special_tokens") is True
         assert call_kwargs.get("clean_up_tokenization_spaces") is False
+
+
+class TestQueryLocalBatch:
+    @patch("local_model.process_vision_info")
+    def test_query_local_batch_success(
+        self, mock_vision_info, mock_model, mock_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image, sample_image], None)
+        mock_processor.batch_decode.return_value = ["Answer A", "Answer B"]
+
+        result = query_local_batch(
+            model=mock_model,
+            processor=mock_processor,
+            device="cpu",
+            images=[sample_image, sample_image],
+            questions=["Question A", "Question B"],
+        )
+
+        assert result == ["Answer A", "Answer B"]
+        assert mock_processor.apply_chat_template.call_count == 2
+        assert mock_model.generate.call_count == 1
+
+    @patch("local_model.process_vision_info")
+    def test_query_local_batch_left_padding(
+        self, mock_vision_info, mock_model, mock_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image, sample_image], None)
+
+        query_local_batch(
+            model=mock_model,
+            processor=mock_processor,
+            device="cpu",
+            images=[sample_image, sample_image],
+            questions=["Question A", "Question B"],
+        )
+
+        call_kwargs = mock_processor.call_args[1]
+        assert call_kwargs["text"] == ["formatted_text", "formatted_text"]
+        assert call_kwargs.get("padding_side") == "left"
+
+    def test_query_local_batch_length_mismatch(
+        self, mock_model, mock_processor, sample_image
+    ):
+        with pytest.raises(ValueError, match="same length"):
+            query_local_batch(
+                model=mock_model,
+                processor=mock_processor,
+                device="cpu",
+                images=[sample_image],
+                questions=["Question A", "Question B"],
+            )
+
+    def test_query_local_batch_missing_image(
+        self, mock_model, mock_processor, sample_image
+    ):
+        with pytest.raises(ValueError, match="Missing image"):
+            query_local_batch(
+                model=mock_model,
+                processor=mock_processor,
+                device="cpu",
+                images=[sample_image, None],
+                questions=["Question A", "Question B"],
+            )
+
+
+class TestStreamLocal:
+    @patch("local_model.TextIteratorStreamer")
+    @patch("local_model.process_vision_info")
+    def test_stream_local_yields_tokens(
+        self,
+        mock_vision_info,
+        mock_streamer_cls,
+        mock_model,
+        mock_processor,
+        sample_image,
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        mock_streamer_cls.return_value = iter(["The ", "", "answer"])
+
+        tokens = list(
+            stream_local(
+                model=mock_model,
+                processor=mock_processor,
+                device="cpu",
+                image=sample_image,
+                question="Test",
+            )
+        )
+
+        assert tokens == ["The ", "answer"]
+        call_kwargs = mock_model.generate.call_args[1]
+        assert call_kwargs["streamer"] is mock_streamer_cls.return_value
+        assert call_kwargs["max_new_tokens"] == 512
+
+    @patch("local_model.TextIteratorStreamer")
+    @patch("local_model.process_vision_info")
+    def test_stream_local_generate_error(
+        self,
+        mock_vision_info,
+        mock_streamer_cls,
+        mock_model,
+        mock_processor,
+        sample_image,
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        streamer = MagicMock()
+        streamer.__iter__.return_value = iter([])
+        mock_streamer_cls.return_value = streamer
+        mock_model.generate.side_effect = RuntimeError("out of memory")
+
+        with pytest.raises(RuntimeError, match="out of memory"):
+            list(
+                stream_local(
+                    model=mock_model,
+                    processor=mock_processor,
+                    device="cpu",
+                    image=sample_image,
+                    question="Test",
+                )
+            )
+        assert streamer.end.called
+
+    @patch("local_model.TextIteratorStreamer")
+    @patch("local_model.process_vision_info")
+    def test_closing_early_does_not_wait_for_generate(
+        self,
+        mock_vision_info,
+        mock_streamer_cls,
+        mock_model,
+        mock_processor,
+        sample_image,
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        mock_streamer_cls.return_value = iter(["The ", "answer"])
+        release = threading.Event()
+        mock_model.generate.side_effect = lambda **kwargs: release.wait(5)
+
+        tokens = stream_local(
+            model=mock_model,
+            processor=mock_processor,
+            device="cpu",
+            image=sample_image,
+            question="Test",
+        )
+        try:
+            assert next(tokens) == "The "
+            start = time.perf_counter()
+            tokens.close()
+
+            assert time.perf_counter() - start < 1
+        finally:
+            release.set()
+
+    def test_stream_local_missing_image(self, mock_model, mock_processor):
+        with pytest.raises(ValueError, match="Missing image"):
+            list(
+                stream_local(
+                    model=mock_model,
+                    processor=mock_processor,
+                    device="cpu",
+                    image=None,
+                    question="Test",
+                )
+            )
+
+
+@pytest.fixture
+def vision_model(mock_model):
+    vision_output = MagicMock()
+    vision_output.pooler_output = (torch.zeros(4, 8),)
+    mock_model.get_image_features = MagicMock(return_value=vision_output)
+    return mock_model
+
+
+@pytest.fixture
+def vision_processor(mock_processor):
+    def process(**kwargs):
+        inputs = MagicMock()
+        data = {"input_ids": [[1, 2, 3]], "image_grid_thw": torch.tensor([[1, 4, 4]])}
+        if "images" in kwargs:
+            data["pixel_values"] = torch.zeros(16, 8)
+        inputs.to.return_value = inputs
+        inputs.input_ids = data["input_ids"]
+        inputs.pop.side_effect = data.pop
+        inputs.__getitem__.side_effect = data.__getitem__
+        inputs.__setitem__.side_effect = data.__setitem__
+        inputs.keys.side_effect = data.keys
+        return inputs
+
+    mock_processor.side_effect = process
+    mock_processor.image_token = "<|image_pad|>"
+    mock_processor.replace_image_token = MagicMock(return_value="<|image_pad|>" * 4)
+    mock_processor.apply_chat_template.return_value = (
+        "<|vision_start|><|image_pad|><|vision_end|>Q"
+    )
+    return mock_processor
+
+
+class TestVisionCacheQueryLocal:
+    @patch("local_model.process_vision_info")
+    def test_follow_up_question_reuses_vision_features(
+        self, mock_vision_info, vision_model, vision_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        cache = VisionFeatureCache(max_bytes=1024 * 1024)
+
+        for question in ["First question", "Follow-up question"]:
+            query_local(
+                model=vision_model,
+                processor=vision_processor,
+                device="cpu",
+                image=sample_image,
+                question=question,
+                vision_cache=cache,
+            )
+
+        assert len(cache) == 1
+        assert mock_vision_info.call_count == 1
+        assert vision_model.get_image_features.call_count == 1
+
+        # The cache hit only tokenizes the expanded text
+        second_call = vision_processor.call_args_list[1][1]
+        assert "images" not in second_call
+        assert second_call["text"].count("<|image_pad|>") == 4
+
+        for call in vision_model.generate.call_args_list:
+            mm_outputs = call[1]["mm_encoder_outputs"]["image"]
+            assert mm_outputs.pooler_output[0].shape == (4, 8)
+
+    @patch("local_model.process_vision_info")
+    def test_different_images_are_encoded_separately(
+        self, mock_vision_info, vision_model, vision_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        cache = VisionFeatureCache(max_bytes=1024 * 1024)
+        other_image = Image.new("RGB", (10, 10), color="red")
+
+        for image in [sample_image, other_image]:
+            query_local(
+                model=vision_model,
+                processor=vision_processor,
+                device="cpu",
+                image=image,
+                question="Q",
+                vision_cache=cache,
+            )
+
+        assert len(cache) == 2
+        assert vision_model.get_image_features.call_count == 2
+
+
+class TestPrefixCacheQueryLocal:
+    def test_prompt_prefix_stops_before_image(self, mock_processor):
+        mock_processor.image_token = "<|image_pad|>"
+        mock_processor.apply_chat_template.return_value = (
+            "<|im_start|>system\nTutor<|im_end|>\n<|im_start|>user\n"
+            "<|vision_start|><|image_pad|><|vision_end|>Question: <|im_end|>"
+        )
+
+        prefix = prompt_prefix(mock_processor)
+
+        assert prefix.endswith("<|vision_start|>")
+        assert "<|image_pad|>" not in prefix
+
+    @patch("local_model.process_vision_info")
+    def test_generate_starts_from_prefix_cache(
+        self, mock_vision_info, mock_model, mock_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        inputs = MagicMock()
+        inputs.__getitem__.return_value = torch.tensor([[1, 2, 3, 4]])
+        mock_processor.return_value.to.return_value = inputs
+
+        prefix_cache = MagicMock()
+        prefix_cache.is_valid_for.return_value = True
+        prefix_cache.fresh_cache.return_value = "prefix-kv"
+
+        query_local(
+            model=mock_model,
+            processor=mock_processor,
+            device="cpu",
+            image=sample_image,
+            question="Test",
+            prefix_cache=prefix_cache,
+        )
+
+        call_kwargs = mock_model.generate.call_args[1]
+        assert call_kwargs["past_key_values"] == "prefix-kv"
+        assert mock_model.model.rope_deltas is None
+
+    def test_prefix_kwargs_leave_model_state_alone(self, mock_model):
+        mock_model.model.rope_deltas = "running"
+        prefix_cache = MagicMock()
+        prefix_cache.is_valid_for.return_value = True
+
+        kwargs = prefix_cache_kwargs(mock_model, {"input_ids": None}, prefix_cache)
+
+        assert "past_key_values" in kwargs
+        # Another thread's generation may still be using these
+        assert mock_model.model.rope_deltas == "running"
+
+    @patch("local_model.process_vision_info")
+    def test_rope_deltas_reset_under_generate_lock(
+        self, mock_vision_info, mock_model, mock_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        mock_model.model.rope_deltas = "stale"
+        prefix_cache = MagicMock()
+        prefix_cache.is_valid_for.return_value = True
+        seen = []
+        mock_model.generate.side_effect = lambda **kwargs: (
+            seen.append((GENERATE_LOCK.locked(), mock_model.model.rope_deltas))
+            or [[1, 2, 3, 4, 5]]
+        )
+
+        query_local(
+            model=mock_model,
+            processor=mock_processor,
+            device="cpu",
+            image=sample_image,
+            question="Test",
+            prefix_cache=prefix_cache,
+        )
+
+        assert seen == [(True, None)]
+
+    @patch("local_model.process_vision_info")
+    def test_mismatched_prefix_falls_back(
+        self, mock_vision_info, mock_model, mock_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        prefix_cache = MagicMock()
+        prefix_cache.is_valid_for.return_value = False
+
+        query_local(
+            model=mock_model,
+            processor=mock_processor,
+            device="cpu",
+            image=sample_image,
+            question="Test",
+            prefix_cache=prefix_cache,
+        )
+
+        assert "past_key_values" not in mock_model.generate.call_args[1]
+        assert not prefix_cache.fresh_cache.called
+
+
+class TestPromptLookupQueryLocal:
+    @patch("local_model.process_vision_info")
+    def test_disabled_by_default(
+        self, mock_vision_info, mock_model, mock_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+
+        query_local(
+            model=mock_model,
+            processor=mock_processor,
+            device="cpu",
+            image=sample_image,
+            question="Test",
+        )
+
+        assert "prompt_lookup_num_tokens" not in mock_model.generate.call_args[1]
+
+    @patch("local_model.process_vision_info")
+    def test_enabled_skips_prefix_cache(
+        self, mock_vision_info, mock_model, mock_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        prefix_cache = MagicMock()
+        prefix_cache.is_valid_for.return_value = True
+
+        query_local(
+            model=mock_model,
+            processor=mock_processor,
+            device="cpu",
+            image=sample_image,
+            question="Test",
+            prefix_cache=prefix_cache,
+            prompt_lookup_tokens=10,
+            prompt_lookup_ngram=2,
+        )
+
+        call_kwargs = mock_model.generate.call_args[1]
+        assert call_kwargs["prompt_lookup_num_tokens"] == 10
+        assert call_kwargs["max_matching_ngram_size"] == 2
+        assert "past_key_values" not in call_kwargs
+        assert not prefix_cache.fresh_cache.called
+
+
+class TestCancellation:
+    def test_no_context_keeps_default_limits(self):
+        assert generation_limits([None], 10) == {"max_new_tokens": 512}
+
+    def test_budget_is_capped(self):
+        limits = generation_limits([RequestContext(max_new_tokens=4096)], 10)
+        assert limits["max_new_tokens"] == 512
+
+    def test_largest_budget_drives_generate(self):
+        contexts = [RequestContext(max_new_tokens=8), None]
+        limits = generation_limits(contexts, 10)
+        assert limits["max_new_tokens"] == 512
+        assert len(limits["stopping_criteria"]) == 1
+
+    def test_criteria_stops_rows_independently(self):
+        cancelled = RequestContext()
+        contexts = [RequestContext(max_new_tokens=3), cancelled, None]
+        criteria = CancellationCriteria(contexts, prompt_length=4)
+
+        done = criteria(torch.zeros(3, 6, dtype=torch.long), None)
+        assert done.tolist() == [False, False, False]
+
+        cancelled.cancel()
+        done = criteria(torch.zeros(3, 7, dtype=torch.long), None)
+        assert done.tolist() == [True, True, False]
+
+    @patch("local_model.process_vision_info")
+    def test_query_local_passes_budget_and_criteria(
+        self, mock_vision_info, mock_model, mock_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+
+        query_local(
+            model=mock_model,
+            processor=mock_processor,
+            device="cpu",
+            image=sample_image,
+            question="Test",
+            context=RequestContext(max_new_tokens=64),
+        )
+
+        call_kwargs = mock_model.generate.call_args[1]
+        assert call_kwargs["max_new_tokens"] == 64
+        assert isinstance(call_kwargs["stopping_criteria"][0], CancellationCriteria)
+
+    @patch("local_model.process_vision_info")
+    def test_query_local_raises_when_cancelled(
+        self, mock_vision_info, mock_model, mock_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        context = RequestContext()
+        mock_model.generate.side_effect = lambda **kwargs: (
+            context.cancel() or [[1, 2, 3, 4]]
+        )
+
+        with pytest.raises(RequestCancelled):
+            query_local(
+                model=mock_model,
+                processor=mock_processor,
+                device="cpu",
+                image=sample_image,
+                question="Test",
+                context=context,
+            )
+
+    @patch("local_model.process_vision_info")
+    def test_batch_replaces_cancelled_rows(
+        self, mock_vision_info, mock_model, mock_processor, sample_image
+    ):
+        mock_vision_info.return_value = ([sample_image, sample_image], None)
+        mock_processor.batch_decode.return_value = ["Answer A", "partial"]
+        cancelled = RequestContext()
+        cancelled.cancel()
+
+        result = query_local_batch(
+            model=mock_model,
+            processor=mock_processor,
+            device="cpu",
+            images=[sample_image, sample_image],
+            questions=["A", "B"],
+            contexts=[None, cancelled],
+        )
+
+        assert result[0] == "Answer A"
+        assert isinstance(result[1], RequestCancelled)
+
+
+class TestGenerateLock:
+    @patch("local_model.TextIteratorStreamer")
+    @patch("local_model.process_vision_info")
+    def test_stream_and_batch_never_generate_at_once(
+        self,
+        mock_vision_info,
+        mock_streamer_cls,
+        mock_model,
+        mock_processor,
+        sample_image,
+    ):
+        mock_vision_info.return_value = ([sample_image], None)
+        mock_streamer_cls.return_value = iter(["token"])
+        active, overlaps = [], []
+
+        def generate(**kwargs):
+            active.append(1)
+            overlaps.append(len(active) > 1)
+            time.sleep(0.05)
+            active.pop()
+            return [[1, 2, 3, 4, 5]]
+
+        mock_model.generate.side_effect = generate
+
+        def stream():
+            list(
+                stream_local(
+                    model=mock_model,
+                    processor=mock_processor,
+                    device="cpu",
+                    image=sample_image,
+                    question="Test",
+                )
+            )
+
+        threads = [threading.Thread(target=stream) for _ in range(2)] + [
+            threading.Thread(
+                target=query_local_batch,
+                args=(mock_model, mock_processor, "cpu", [sample_image], ["Q"]),
+            )
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert overlaps == [False, False, False]
+
+
+class TestWarmup:
+    @patch("local_model.process_vision_info")
+    def test_warmup_runs_short_generation(
+        self, mock_vision_info, mock_model, mock_processor
+    ):
+        mock_vision_info.side_effect = lambda messages: (
+            [messages[1]["content"][0]["image"]],
+            None,
+        )
+
+        warmup_local(mock_model, mock_processor, "cpu")
+
+        assert mock_model.generate.call_args[1]["max_new_tokens"] == 8
+        image = mock_vision_info.call_args[0][0][1]["content"][0]["image"]
+        assert image.size == (112, 112)
+
+
+class TestPrecision:
+    def test_precision_dtypes(self):
+        assert precision_dtype("fp32") == torch.float32
+        assert precision_dtype("bf16") == torch.bfloat16
+        assert precision_dtype("int8") == torch.float32
+
+    def test_unknown_precision(self):
+        with pytest.raises(ValueError, match="Unknown precision"):
+            precision_dtype("fp8")
+
+    def test_int8_quantizes_linear_layers(self):
+        model = torch.nn.Sequential(torch.nn.Linear(8, 8), torch.nn.ReLU())
+
+        quantized = apply_precision(model, "int8", "cpu")
+
+        assert type(quantized[0]).__module__.startswith("torch.ao.nn.quantized")
+        assert quantized(torch.randn(2, 8)).shape == (2, 8)
+
+    def test_int8_requires_cpu(self):
+        model = torch.nn.Sequential(torch.nn.Linear(8, 8))
+        with pytest.raises(ValueError, match="CPU"):
+            apply_precision(model, "int8", "cuda")
+
+    def test_fp32_leaves_layers_untouched(self):
+        model = torch.nn.Sequential(torch.nn.Linear(8, 8))
+        result = apply_precision(model, "fp32", "cpu")
+        assert isinstance(result[0], torch.nn.Linear)
+        assert not result.training
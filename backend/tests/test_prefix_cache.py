@@ -0,0 +1,60 @@
+from unittest.mock import MagicMock
+
+import torch
+from cache.prefix_cache import PrefixKVCache
+
+
+def make_prefix_cache(model, prefix_ids):
+    return PrefixKVCache(model, torch.tensor([prefix_ids]), {"layers": [[1, 2]]})
+
+
+class TestPrefixKVCache:
+    def test_build_runs_prefix_once(self):
+        model = MagicMock()
+        model.return_value.past_key_values = "past"
+        processor = MagicMock()
+        processor.tokenizer.return_value.input_ids.to.return_value = torch.tensor(
+            [[1, 2, 3]]
+        )
+
+        cache = PrefixKVCache.build(model, processor, "cpu", "<|im_start|>system")
+
+        assert len(cache) == 3
+        assert cache.past_key_values == "past"
+        assert model.model.rope_deltas is None
+        assert model.call_args[1]["use_cache"] is True
+        tokenizer_kwargs = processor.tokenizer.call_args[1]
+        assert tokenizer_kwargs["add_special_tokens"] is False
+
+    def test_valid_for_matching_prefix(self):
+        model = MagicMock()
+        cache = make_prefix_cache(model, [1, 2, 3])
+        assert cache.is_valid_for(model, torch.tensor([[1, 2, 3, 4, 5]]))
+
+    def test_invalid_for_different_prompt(self):
+        model = MagicMock()
+        cache = make_prefix_cache(model, [1, 2, 3])
+        assert not cache.is_valid_for(model, torch.tensor([[1, 2, 9, 4, 5]]))
+
+    def test_invalid_when_prompt_not_longer_than_prefix(self):
+        model = MagicMock()
+        cache = make_prefix_cache(model, [1, 2, 3])
+        assert not cache.is_valid_for(model, torch.tensor([[1, 2, 3]]))
+
+    def test_invalid_for_batches(self):
+        model = MagicMock()
+        cache = make_prefix_cache(model, [1, 2, 3])
+        assert not cache.is_valid_for(model, torch.tensor([[1, 2, 3, 4], [1, 2, 3, 5]]))
+
+    def test_invalid_for_other_model(self):
+        cache = make_prefix_cache(MagicMock(), [1, 2, 3])
+        assert not cache.is_valid_for(MagicMock(), torch.tensor([[1, 2, 3, 4]]))
+
+    def test_fresh_cache_is_a_copy(self):
+        model = MagicMock()
+        cache = make_prefix_cache(model, [1, 2, 3])
+
+        copy = cache.fresh_cache()
+        copy["layers"][0].append(3)
+
+        assert cache.past_key_values == {"layers": [[1, 2]]}
@@ -0,0 +1,89 @@
+import io
+
+import pytest
+from PIL import Image, UnidentifiedImageError
+from preprocessing import (
+    TOKEN_CELL,
+    fit_to_vision_budget,
+    preprocess_image,
+    vision_token_count,
+)
+
+
+def jpeg_bytes(image, exif=None):
+    buffer = io.BytesIO()
+    if exif is not None:
+        image.save(buffer, format="JPEG", exif=exif)
+    else:
+        image.save(buffer, format="JPEG")
+    buffer.seek(0)
+    return buffer
+
+
+class TestFitToVisionBudget:
+    def test_snaps_to_token_grid(self):
+        width, height = fit_to_vision_budget(300, 200, max_tokens=1024)
+        assert width % TOKEN_CELL == 0
+        assert height % TOKEN_CELL == 0
+
+    def test_large_image_fits_budget(self):
+        width, height = fit_to_vision_budget(4032, 3024, max_tokens=1024)
+        assert vision_token_count(width, height) <= 1024
+        # Aspect ratio is kept within one grid cell
+        assert abs(width / height - 4032 / 3024) < 0.05
+
+    def test_small_image_scaled_up_to_minimum(self):
+        width, height = fit_to_vision_budget(10, 10, max_tokens=1024, min_tokens=4)
+        assert vision_token_count(width, height) >= 4
+
+    def test_budget_within_limits_unchanged(self):
+        assert fit_to_vision_budget(560, 280, max_tokens=1024) == (560, 280)
+
+
+class TestPreprocessImage:
+    def test_downsizes_large_jpeg(self):
+        source = jpeg_bytes(Image.new("RGB", (4000, 3000), color="white"))
+
+        image = preprocess_image(source, max_tokens=256)
+
+        assert vision_token_count(*image.size) <= 256
+        assert image.size[0] % TOKEN_CELL == 0
+        assert image.mode == "RGB"
+
+    def test_uses_jpeg_draft_mode(self):
+        original = Image.open(jpeg_bytes(Image.new("RGB", (4000, 3000))))
+        requested = []
+        draft = original.draft
+
+        def spy(mode, size):
+            requested.append(size)
+            return draft(mode, size)
+
+        original.draft = spy
+        preprocess_image(original, max_tokens=256)
+
+        assert len(requested) == 1
+        assert requested[0][0] < 4000
+
+    def test_applies_exif_orientation(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees clockwise
+        source = jpeg_bytes(Image.new("RGB", (560, 280)), exif=exif)
+
+        image = preprocess_image(source, max_tokens=1024)
+
+        assert image.size == (280, 560)
+
+    def test_converts_to_rgb(self):
+        buffer = io.BytesIO()
+        Image.new("RGBA", (56, 56)).save(buffer, format="PNG")
+        buffer.seek(0)
+
+        image = preprocess_image(buffer)
+
+        assert image.mode == "RGB"
+        assert image.size == (56, 56)
+
+    def test_invalid_image(self):
+        with pytest.raises(UnidentifiedImageError):
+            preprocess_image(io.BytesIO(b"not an image"))
@@ -0,0 +1,234 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from backend.remote_engine import RemoteEngine, RemoteError, retry_after_seconds
+
+MESSAGES = [{"role": "user", "content": "Q"}]
+
+
+class MockServer:
+    """A local OpenAI-style chat server; each call pops the next scripted reply."""
+
+    def __init__(self, replies=None):
+        self.replies = list(replies or [])
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.chat)
+
+    async def chat(self, request: Request):
+        payload = await request.json()
+        self.calls.append(payload)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            reply = self.replies.pop(0) if self.replies else {}
+            await asyncio.sleep(reply.get("delay", 0))
+            status = reply.get("status", 200)
+            if status != 200:
+                return JSONResponse(
+                    {"error": "nope"}, status_code=status, headers=reply.get("headers")
+                )
+            content = reply.get("content", "ok")
+            if payload.get("stream"):
+                return StreamingResponse(sse(content), media_type="text/event-stream")
+            return {"choices": [{"message": {"content": content}}]}
+        finally:
+            self.active -= 1
+
+    def engine(self, **kwargs):
+        kwargs.setdefault("backoff_base", 0.001)
+        return RemoteEngine(
+            "http://mock/v1",
+            "test-model",
+            transport=httpx.ASGITransport(app=self.app),
+            **kwargs,
+        )
+
+
+async def sse(content):
+    for token in content.split(" "):
+        chunk = {"choices": [{"delta": {"content": token + " "}}]}
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield 'data: {"choices": []}\n\n'
+    yield "data: [DONE]\n\n"
+
+
+class TestRemoteEngineChat:
+    @pytest.mark.asyncio
+    async def test_success(self):
+        server = MockServer([{"content": "The answer is 4."}])
+        engine = server.engine()
+
+        result = await engine.chat(MESSAGES, max_tokens=32)
+        await engine.close()
+
+        assert result == "The answer is 4."
+        assert server.calls[0]["model"] == "test-model"
+        assert server.calls[0]["max_tokens"] == 32
+
+    @pytest.mark.asyncio
+    async def test_counts_bytes_sent_per_attempt(self):
+        from backend.utils.metrics import REMOTE_BYTES_SENT
+
+        server = MockServer([{"status": 503}, {"content": "ok"}])
+        engine = server.engine()
+        before = REMOTE_BYTES_SENT._value.get()
+
+        await engine.chat(MESSAGES, max_tokens=8)
+        await engine.close()
+
+        body = engine._payload(MESSAGES, 8, stream=False)
+        assert REMOTE_BYTES_SENT._value.get() - before == 2 * len(body)
+
+    @pytest.mark.asyncio
+    async def test_retries_rate_limit_and_server_errors(self):
+        server = MockServer(
+            [
+                {"status": 429, "headers": {"Retry-After": "0"}},
+                {"status": 503},
+                {"content": "finally"},
+            ]
+        )
+        engine = server.engine()
+
+        result = await engine.chat(MESSAGES, max_tokens=8)
+        await engine.close()
+
+        assert result == "finally"
+        assert len(server.calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_client_error_not_retried(self):
+        server = MockServer([{"status": 400}, {"content": "unused"}])
+        engine = server.engine()
+
+        with pytest.raises(RemoteError) as excinfo:
+            await engine.chat(MESSAGES, max_tokens=8)
+        await engine.close()
+
+        assert excinfo.value.status == 400
+        assert len(server.calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_retries(self):
+        server = MockServer([{"status": 502}] * 3)
+        engine = server.engine(max_retries=2)
+
+        with pytest.raises(RemoteError) as excinfo:
+            await engine.chat(MESSAGES, max_tokens=8)
+        await engine.close()
+
+        assert excinfo.value.status == 502
+        assert len(server.calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_timeout_retried(self):
+        server = MockServer([{"delay": 1}, {"content": "fast"}])
+        engine = server.engine(timeout=0.1)
+
+        result = await engine.chat(MESSAGES, max_tokens=8)
+        await engine.close()
+
+        assert result == "fast"
+        assert len(server.calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_concurrency_cap(self):
+        server = MockServer([{"delay": 0.05}] * 6)
+        engine = server.engine(max_concurrency=2)
+
+        results = await asyncio.gather(
+            *(engine.chat(MESSAGES, max_tokens=8) for _ in range(6))
+        )
+        await engine.close()
+
+        assert results == ["ok"] * 6
+        assert server.max_active == 2
+
+
+class TestRemoteEngineHedging:
+    def test_hedge_delay_needs_samples(self):
+        engine = RemoteEngine("http://mock/v1", "m", hedge_percentile=90)
+        assert engine.hedge_delay() is None
+
+        engine._latencies.extend([0.1] * 18 + [1.0, 2.0])
+        assert engine.hedge_delay() == 1.0
+
+    def test_hedging_off_by_default(self):
+        engine = RemoteEngine("http://mock/v1", "m")
+        engine._latencies.extend([0.1] * 50)
+        assert engine.hedge_delay() is None
+
+    @pytest.mark.asyncio
+    async def test_hedge_wins_over_slow_primary(self):
+        server = MockServer(
+            [{"delay": 2, "content": "slow"}, {"delay": 0, "content": "hedged"}]
+        )
+        engine = server.engine(hedge_percentile=50, hedge_min_samples=1)
+        engine._latencies.append(0.05)
+
+        result = await asyncio.wait_for(engine.chat(MESSAGES, max_tokens=8), 1)
+        await engine.close()
+
+        assert result == "hedged"
+        assert len(server.calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_fast_primary_is_not_hedged(self):
+        server = MockServer([{"content": "primary"}])
+        engine = server.engine(hedge_percentile=50, hedge_min_samples=1)
+        engine._latencies.append(1.0)
+
+        result = await engine.chat(MESSAGES, max_tokens=8)
+        await engine.close()
+
+        assert result == "primary"
+        assert len(server.calls) == 1
+
+
+class TestRemoteEngineStreaming:
+    @pytest.mark.asyncio
+    async def test_stream_chat_parses_sse(self):
+        server = MockServer([{"content": "The answer"}])
+        engine = server.engine()
+
+        tokens = [t async for t in engine.stream_chat(MESSAGES, max_tokens=8)]
+        await engine.close()
+
+        assert tokens == ["The ", "answer "]
+        assert server.calls[0]["stream"] is True
+
+    @pytest.mark.asyncio
+    async def test_stream_retried_before_first_token(self):
+        server = MockServer([{"status": 503}, {"content": "ok"}])
+        engine = server.engine()
+
+        tokens = [t async for t in engine.stream_chat(MESSAGES, max_tokens=8)]
+        await engine.close()
+
+        assert tokens == ["ok "]
+        assert len(server.calls) == 2
+
+
+class TestRetryAfter:
+    def test_parses_seconds(self):
+        response = httpx.Response(429, headers={"Retry-After": "3"})
+        assert retry_after_seconds(response) == 3.0
+
+    def test_missing_or_invalid(self):
+        assert retry_after_seconds(httpx.Response(429)) is None
+        response = httpx.Response(429, headers={"Retry-After": "soon"})
+        assert retry_after_seconds(response) is None
+
+    def test_backoff_honours_retry_after_up_to_max(self):
+        engine = RemoteEngine("http://mock/v1", "m", backoff_max=2)
+        assert engine.backoff(0, retry_after=1) == 1
+        assert engine.backoff(0, retry_after=30) == 2
+        assert 0 <= engine.backoff(5) <= 2
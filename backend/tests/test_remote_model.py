@@ -0,0 +1,192 @@
+import base64
+import io
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from PIL import Image
+from remote_model import (
+    build_remote_messages,
+    encode_remote_image,
+    passthrough_mime,
+    query_remote,
+    stream_remote,
+)
+
+from backend.cancellation import RequestCancelled, RequestContext
+from backend.executors import Executors
+
+
+@pytest.fixture
+def sample_image():
+    return Image.new("RGB", (10, 10), color="yellow")
+
+
+def image_bytes(format, size=(10, 10), mode="RGB", exif=None):
+    buffered = io.BytesIO()
+    kwargs = {"exif": exif} if exif is not None else {}
+    Image.new(mode, size).save(buffered, format=format, **kwargs)
+    return buffered.getvalue()
+
+
+class FakeStream:
+    def __init__(self, deltas):
+        self.deltas = list(deltas)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.deltas:
+            raise StopAsyncIteration
+        return self.deltas.pop(0)
+
+    async def aclose(self):
+        self.closed = True
+
+
+def make_engine(content="", deltas=()):
+    engine = MagicMock()
+    engine.chat = AsyncMock(return_value=content)
+    engine.stream_chat.return_value = FakeStream(deltas)
+    return engine
+
+
+class TestBuildRemoteMessages:
+    def test_jpeg_data_url(self, sample_image):
+        messages = build_remote_messages(sample_image, "What is this?")
+        content = messages[0]["content"]
+        assert content[0]["image_url"]["url"].startswith("data:image/jpeg;base64,")
+        assert content[1]["text"] == "What is this?"
+
+    def test_converts_non_rgb(self):
+        image = Image.new("RGBA", (10, 10))
+        messages = build_remote_messages(image, "Q")
+        assert messages[0]["content"][0]["type"] == "image_url"
+
+
+class TestRemotePayload:
+    def test_small_jpeg_and_png_pass_through(self, sample_image):
+        for format, mime in (("JPEG", "image/jpeg"), ("PNG", "image/png")):
+            original = image_bytes(format)
+            assert encode_remote_image(sample_image, original) == (mime, original)
+
+    def test_passthrough_limits(self):
+        assert passthrough_mime(None) is None
+        assert passthrough_mime(image_bytes("JPEG"), max_bytes=10) is None
+        assert (
+            passthrough_mime(image_bytes("JPEG", size=(300, 20)), max_side=200) is None
+        )
+        assert passthrough_mime(image_bytes("GIF")) is None
+        assert passthrough_mime(image_bytes("JPEG", mode="CMYK")) is None
+        assert passthrough_mime(b"\xff\xd8\xff truncated") is None
+
+    def test_rotated_jpeg_is_reencoded(self, sample_image):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        original = image_bytes("JPEG", exif=exif)
+
+        mime, data = encode_remote_image(sample_image, original)
+
+        assert mime == "image/jpeg"
+        assert data != original
+
+    def test_reencode_caps_longest_side(self):
+        image = Image.new("RGBA", (400, 100))
+
+        mime, data = encode_remote_image(image, max_side=200)
+
+        assert mime == "image/jpeg"
+        assert Image.open(io.BytesIO(data)).size == (200, 50)
+
+    def test_messages_embed_original_bytes(self, sample_image):
+        original = image_bytes("PNG")
+
+        messages = build_remote_messages(sample_image, "Q", original)
+
+        url = messages[0]["content"][0]["image_url"]["url"]
+        assert url == "data:image/png;base64," + base64.b64encode(original).decode()
+
+
+class TestQueryRemote:
+    @pytest.mark.asyncio
+    async def test_query_remote_success(self, sample_image):
+        engine = make_engine("The answer is 4.")
+
+        result = await query_remote(sample_image, "What is 2+2?", engine)
+
+        assert result == "The answer is 4."
+        assert engine.chat.call_args[1]["max_tokens"] == 256
+
+    @pytest.mark.asyncio
+    async def test_query_remote_sends_original(self, sample_image):
+        engine = make_engine("ok")
+        original = image_bytes("JPEG")
+
+        await query_remote(sample_image, "Q", engine, original=original)
+
+        messages = engine.chat.call_args[0][0]
+        url = messages[0]["content"][0]["image_url"]["url"]
+        assert url.endswith(base64.b64encode(original).decode())
+
+    @pytest.mark.asyncio
+    async def test_query_remote_token_budget(self, sample_image):
+        engine = make_engine()
+
+        await query_remote(sample_image, "Q", engine, max_tokens=32)
+
+        assert engine.chat.call_args[1]["max_tokens"] == 32
+
+    @pytest.mark.asyncio
+    async def test_query_remote_encodes_on_decode_pool(self, sample_image):
+        engine = make_engine("ok")
+        executors = Executors(db_threads=1, io_threads=1, decode_threads=1)
+        threads = []
+
+        def build(*args):
+            threads.append(threading.current_thread().name)
+            return build_remote_messages(*args)
+
+        try:
+            with patch("remote_model.build_remote_messages", build):
+                await query_remote(sample_image, "Q", engine, executors=executors)
+        finally:
+            executors.shutdown()
+
+        assert threads[0].startswith("decode")
+        assert engine.chat.called
+
+    @pytest.mark.asyncio
+    async def test_query_remote_missing_image(self):
+        with pytest.raises(ValueError, match="Missing image"):
+            await query_remote(None, "What?", make_engine())
+
+
+class TestStreamRemote:
+    @pytest.mark.asyncio
+    async def test_stream_remote_yields_deltas(self, sample_image):
+        engine = make_engine(deltas=["The ", "answer"])
+
+        tokens = [token async for token in stream_remote(sample_image, "Q", engine)]
+
+        assert tokens == ["The ", "answer"]
+        assert engine.stream_chat.return_value.closed
+
+    @pytest.mark.asyncio
+    async def test_stream_remote_missing_image(self):
+        with pytest.raises(ValueError, match="Missing image"):
+            async for _ in stream_remote(None, "Q", make_engine()):
+                pass
+
+    @pytest.mark.asyncio
+    async def test_stream_remote_stops_when_cancelled(self, sample_image):
+        engine = make_engine(deltas=["a", "b"])
+        context = RequestContext()
+
+        tokens = stream_remote(sample_image, "Q", engine, context=context)
+        assert await tokens.__anext__() == "a"
+        context.cancel()
+        with pytest.raises(RequestCancelled):
+            await tokens.__anext__()
+        assert engine.stream_chat.return_value.closed
@@ -0,0 +1,115 @@
+import os
+import uuid
+
+import pytest
+from cache.response_cache import (
+    ResponseCache,
+    image_content_hash,
+    make_cache_key,
+    normalize_question,
+    perceptual_hash,
+)
+from PIL import Image
+
+
+@pytest.fixture
+def sample_image():
+    image = Image.new("RGB", (64, 64), color="white")
+    for x in range(32):
+        for y in range(64):
+            image.putpixel((x, y), (0, 0, 0))
+    return image
+
+
+@pytest.fixture
+def cache_db_path():
+    path = f"test_cache_{uuid.uuid4()}.duckdb"
+    yield path
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class TestCacheKeys:
+    def test_content_hash_stable(self, sample_image):
+        assert image_content_hash(sample_image) == image_content_hash(
+            sample_image.copy()
+        )
+
+    def test_content_hash_differs(self, sample_image):
+        other = Image.new("RGB", (64, 64), color="red")
+        assert image_content_hash(sample_image) != image_content_hash(other)
+
+    def test_perceptual_hash_survives_resize(self, sample_image):
+        resized = sample_image.resize((128, 128))
+        assert perceptual_hash(sample_image) == perceptual_hash(resized)
+        assert image_content_hash(sample_image) != image_content_hash(resized)
+
+    def test_normalize_question(self):
+        assert normalize_question("  What IS\n2+2? ") == "what is 2+2?"
+
+    def test_key_depends_on_mode_and_settings(self, sample_image):
+        local = make_cache_key(sample_image, "Q", "local", {"max_new_tokens": 512})
+        remote = make_cache_key(sample_image, "Q", "remote", {"max_new_tokens": 512})
+        shorter = make_cache_key(sample_image, "Q", "local", {"max_new_tokens": 64})
+        assert len({local, remote, shorter}) == 3
+
+    def test_key_normalizes_question(self, sample_image):
+        assert make_cache_key(sample_image, "Solve  X", "local", {}) == make_cache_key(
+            sample_image, "solve x", "local", {}
+        )
+
+
+class TestResponseCache:
+    def test_miss_then_hit(self):
+        cache = ResponseCache(max_entries=2)
+        assert cache.get("a") is None
+        cache.put("a", "answer")
+        assert cache.get("a") == "answer"
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        cache.get("a")  # "b" is now least recently used
+        cache.put("c", "3")
+
+        assert len(cache) == 2
+        assert cache.get("b") is None
+        assert cache.get("a") == "1"
+        assert cache.get("c") == "3"
+
+    def test_disabled_memory_tier(self):
+        cache = ResponseCache(max_entries=0)
+        cache.put("a", "1")
+        assert cache.get("a") is None
+
+    def test_disk_tier_survives_restart(self, cache_db_path):
+        cache = ResponseCache(max_entries=2, db_path=cache_db_path)
+        cache.put("a", "persisted")
+        cache.close()
+
+        reopened = ResponseCache(max_entries=2, db_path=cache_db_path)
+        try:
+            assert len(reopened) == 0
+            assert reopened.get("a") == "persisted"
+            assert len(reopened) == 1
+        finally:
+            reopened.close()
+
+    def test_disk_tier_backs_evicted_entries(self, cache_db_path):
+        cache = ResponseCache(max_entries=1, db_path=cache_db_path)
+        try:
+            cache.put("a", "1")
+            cache.put("b", "2")
+            assert cache.get("a") == "1"
+        finally:
+            cache.close()
+
+    def test_clear(self, cache_db_path):
+        cache = ResponseCache(max_entries=2, db_path=cache_db_path)
+        try:
+            cache.put("a", "1")
+            cache.clear()
+            assert cache.get("a") is None
+        finally:
+            cache.close()
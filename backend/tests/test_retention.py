@@ -0,0 +1,216 @@
+import hashlib
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from backend.retention import RetentionPolicy, run_retention, scan_storage
+from backend.storage import Upload, store_upload, write_thumbnails
+
+NOW = 1_000_000_000.0
+DAY = 86400
+
+
+def noisy_jpeg(quality=100):
+    # Random-ish pixels so recompressing at a lower quality really shrinks it
+    image = Image.effect_noise((64, 64), 64).convert("RGB")
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+
+def add_upload(directory, digest, age_days, content=None):
+    content = content or noisy_jpeg()
+    path = store_upload(Upload(content, digest, "jpg"), str(directory))
+    write_thumbnails(Image.open(path), path, sizes=[32])
+    mtime = NOW - age_days * DAY
+    for file_path in (path, path[: -len(".jpg")] + "_32.jpg"):
+        os.utime(file_path, (mtime, mtime))
+    return path
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return tmp_path / "uploads"
+
+
+def policy(**kwargs):
+    defaults = {
+        "orphan_grace_seconds": 3600,
+        "max_age_days": 0,
+        "max_total_bytes": 0,
+        "recompress_after_days": 0,
+    }
+    defaults.update(kwargs)
+    return RetentionPolicy(**defaults)
+
+
+class TestRetention:
+    def test_orphans_removed_with_thumbnails(self, uploads):
+        kept = add_upload(uploads, "aa11", age_days=10)
+        orphan = add_upload(uploads, "bb22", age_days=10)
+        fresh = add_upload(uploads, "cc33", age_days=0)
+
+        report = run_retention([kept], str(uploads), policy(), now=NOW)
+
+        assert report.removed["orphan"] == 2
+        assert not os.path.exists(orphan)
+        assert os.path.exists(kept)
+        # Inside the grace period: its history row may not be written yet
+        assert os.path.exists(fresh)
+        assert report.files == {"original": 2, "thumbnail": 2}
+
+    def test_dry_run_removes_nothing(self, uploads):
+        orphan = add_upload(uploads, "bb22", age_days=10)
+
+        report = run_retention([], str(uploads), policy(), now=NOW, dry_run=True)
+
+        assert report.removed["orphan"] == 2
+        assert os.path.exists(orphan)
+
+    def test_age_policy_keeps_thumbnails(self, uploads):
+        old = add_upload(uploads, "aa11", age_days=40)
+        new = add_upload(uploads, "bb22", age_days=1)
+
+        report = run_retention(
+            [old, new], str(uploads), policy(max_age_days=30), now=NOW
+        )
+
+        assert report.removed["age"] == 1
+        assert not os.path.exists(old)
+        assert os.path.exists(old[: -len(".jpg")] + "_32.jpg")
+        assert os.path.exists(new)
+
+    def test_size_policy_evicts_oldest_first(self, uploads):
+        paths = [add_upload(uploads, f"{i}{i}00", age_days=10 - i) for i in range(3)]
+        budget = os.path.getsize(paths[2]) + os.path.getsize(paths[1])
+
+        report = run_retention(
+            paths, str(uploads), policy(max_total_bytes=budget), now=NOW
+        )
+
+        assert report.removed["size"] == 1
+        assert not os.path.exists(paths[0])
+        assert os.path.exists(paths[1]) and os.path.exists(paths[2])
+
+    def test_recompresses_old_originals_under_new_hash(self, uploads):
+        path = add_upload(uploads, "aa11", age_days=10)
+        size = os.path.getsize(path)
+        relinked = []
+
+        report = run_retention(
+            [path],
+            str(uploads),
+            policy(recompress_after_days=5),
+            now=NOW,
+            relink=lambda old, new: relinked.append((old, new)) or True,
+        )
+
+        assert report.recompressed == 1
+        ((old, new),) = relinked
+        assert old == os.path.normpath(path)
+        assert not os.path.exists(path)
+        assert not os.path.exists(path[: -len(".jpg")] + "_32.jpg")
+        with open(new, "rb") as f:
+            content = f.read()
+        # Named by the new content, so dedup and immutable caching still hold
+        assert os.path.basename(new) == hashlib.sha256(content).hexdigest() + ".jpg"
+        assert len(content) < size
+        assert report.reclaimed_bytes["recompress"] == size - len(content)
+        assert os.path.exists(new[: -len(".jpg")] + "_32.jpg")
+        # Keeps its age for the age policy
+        assert os.path.getmtime(new) == NOW - 10 * DAY
+
+    def test_recompressed_file_is_not_recompressed_again(self, uploads):
+        path = add_upload(uploads, "aa11", age_days=10)
+        relinked = []
+
+        def relink(old, new):
+            relinked.append(new)
+            return True
+
+        run_retention(
+            [path],
+            str(uploads),
+            policy(recompress_after_days=5),
+            now=NOW,
+            relink=relink,
+        )
+        report = run_retention(
+            relinked,
+            str(uploads),
+            policy(recompress_after_days=5),
+            now=NOW,
+            relink=relink,
+        )
+
+        assert report.recompressed == 0
+        assert len(relinked) == 1
+
+    def test_no_recompression_without_relink(self, uploads):
+        path = add_upload(uploads, "aa11", age_days=10)
+
+        report = run_retention(
+            [path], str(uploads), policy(recompress_after_days=5), now=NOW
+        )
+
+        assert report.recompressed == 0
+        assert report.files["original"] == 1
+
+    def test_pinned_and_unrelinked_originals_stay(self, uploads):
+        pinned = add_upload(uploads, "aa11", age_days=10)
+        refused = add_upload(uploads, "bb22", age_days=10)
+        relinked = []
+
+        def relink(old, new):
+            relinked.append(old)
+            return False
+
+        report = run_retention(
+            [pinned, refused],
+            str(uploads),
+            policy(recompress_after_days=5),
+            now=NOW,
+            relink=relink,
+            pinned=[pinned],
+        )
+
+        assert report.recompressed == 0
+        assert relinked == [os.path.normpath(refused)]
+        assert os.path.exists(pinned) and os.path.exists(refused)
+
+    def test_undecodable_original_is_skipped(self, uploads):
+        broken = store_upload(Upload(b"not an image", "dd44", "jpg"), str(uploads))
+        os.utime(broken, (NOW - 10 * DAY, NOW - 10 * DAY))
+        path = add_upload(uploads, "aa11", age_days=10)
+
+        report = run_retention(
+            [broken, path],
+            str(uploads),
+            policy(recompress_after_days=5),
+            now=NOW,
+            relink=lambda old, new: True,
+        )
+
+        assert report.recompressed == 1
+        assert os.path.exists(broken)
+
+    def test_stale_temporary_files_removed(self, uploads):
+        add_upload(uploads, "aa11", age_days=0)
+        leftover = uploads / "aa" / ".upload-xyz"
+        leftover.write_bytes(b"partial")
+        os.utime(leftover, (NOW - DAY, NOW - DAY))
+
+        report = run_retention([], str(uploads), policy(), now=NOW)
+
+        assert report.removed["temporary"] == 1
+        assert not leftover.exists()
+
+    def test_scan_classifies_files(self, uploads):
+        path = add_upload(uploads, "aa11", age_days=0)
+
+        scan = scan_storage(str(uploads))
+
+        assert list(scan.originals) == [os.path.normpath(path)]
+        assert len(scan.thumbnails_of(scan.originals[os.path.normpath(path)])) == 1
@@ -1,10 +1,14 @@
+import asyncio
 import pytest
+import time
 import uuid
 import io
 from unittest.mock import MagicMock, patch
 from fastapi.testclient import TestClient
 from PIL import Image
 
+from backend.cache.response_cache import ResponseCache
+
 
 @pytest.fixture(scope="module")
 def client():
@@ -18,6 +22,11 @@ def client():
         from routes import app
 
         with TestClient(app) as test_client:
+            # The model loads in the background; wait for the warmup to finish
+            for _ in range(100):
+                if test_client.get("/ready").status_code == 200:
+                    break
+                time.sleep(0.05)
             yield test_client
 
 
@@ -42,6 +51,54 @@ class TestDeviceEndpoint:
         data = response.json()
         assert "device" in data
         assert data["device"] in ["cuda", "cpu", None]
+        assert data["precision"] in ["fp32", "bf16", "int8"]
+
+
+class TestReadyEndpoint:
+    def test_ready_after_load(self, client):
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+
+    def test_local_rejected_while_loading(self, client, mock_image_file):
+        import routes
+
+        with patch.object(routes, "model_status", "loading"):
+            ready = client.get("/ready")
+            response = client.post(
+                "/inference",
+                data={"question": "Q", "user_uuid": str(uuid.uuid4()), "mode": "local"},
+                files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+            )
+
+        assert ready.status_code == 503
+        assert ready.json()["status"] == "loading"
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "5"
+
+    @patch("routes.query_remote")
+    def test_local_falls_back_to_remote_while_loading(
+        self, mock_query_remote, client, mock_image_file
+    ):
+        import routes
+
+        mock_query_remote.return_value = "Remote answer"
+        with (
+            patch.object(routes, "model_status", "warming_up"),
+            patch.object(routes, "LOCAL_FALLBACK_TO_REMOTE", True),
+        ):
+            response = client.post(
+                "/inference",
+                data={
+                    "question": "Fallback question",
+                    "user_uuid": str(uuid.uuid4()),
+                    "mode": "local",
+                },
+                files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+            )
+
+        assert response.status_code == 200
+        assert response.json()["response"] == "Remote answer"
 
 
 class TestUserEndpoints:
@@ -88,6 +145,125 @@ class TestHistoryEndpoints:
         assert isinstance(data, list)
         assert len(data) == 0
 
+    def test_get_history_pages(self, client):
+        import routes
+
+        user_uuid = client.post(
+            "/users", data={"email": f"{uuid.uuid4()}@example.com"}
+        ).json()["uuid"]
+        for i in range(5):
+            routes.db.add_history_entry(user_uuid, f"Question {i}", "Answer")
+
+        questions, cursor, pages = [], None, 0
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["before"] = cursor
+            response = client.get(f"/history/{user_uuid}", params=params)
+            assert response.status_code == 200
+            questions += [entry["question"] for entry in response.json()]
+            pages += 1
+            cursor = response.headers.get("x-next-cursor")
+            if cursor is None:
+                break
+
+        assert pages == 3
+        assert questions == [f"Question {i}" for i in reversed(range(5))]
+
+    def test_export_history(self, client):
+        import json
+
+        import routes
+
+        user_uuid = client.post("/users", data={"email": "export@example.com"}).json()[
+            "uuid"
+        ]
+        for i in range(3):
+            routes.db.add_history_entry(user_uuid, f"Question {i}", "Answer")
+        expected = client.get(f"/history/{user_uuid}").json()
+        for entry in expected:
+            del entry["thumbnails"]
+
+        ndjson = client.get(f"/history/{user_uuid}/export")
+        as_json = client.get(f"/history/{user_uuid}/export?format=json")
+
+        assert ndjson.headers["content-type"] == "application/x-ndjson"
+        assert [json.loads(line) for line in ndjson.text.splitlines()] == expected
+        assert as_json.json() == expected
+
+    def test_export_history_empty_and_bad_format(self, client):
+        user_uuid = str(uuid.uuid4())
+
+        assert client.get(f"/history/{user_uuid}/export").text == ""
+        assert client.get(f"/history/{user_uuid}/export?format=json").json() == []
+        assert client.get(f"/history/{user_uuid}/export?format=csv").status_code == 400
+
+    def test_get_history_rejects_bad_paging(self, client):
+        user_uuid = str(uuid.uuid4())
+
+        assert client.get(f"/history/{user_uuid}?before=nope").status_code == 400
+        assert client.get(f"/history/{user_uuid}?limit=0").status_code == 400
+
+
+ANALYTICS_HEADERS = {"Authorization": "Bearer analytics-secret"}
+
+
+@patch("routes.ANALYTICS_TOKEN", "analytics-secret")
+class TestAnalyticsEndpoints:
+    def test_analytics_follow_history(self, client):
+        import routes
+
+        user_uuid = client.post(
+            "/users", data={"email": f"{uuid.uuid4()}@example.com"}
+        ).json()["uuid"]
+        routes.db.add_history_entry(user_uuid, "Question", "Answer", "uploads/x.jpg")
+        routes.db.add_history_entry(user_uuid, "Question", "Answer", "uploads/x.jpg")
+
+        def get(url):
+            return client.get(url, headers=ANALYTICS_HEADERS).json()
+
+        days = get("/analytics/requests?days=1")
+        user = get(f"/analytics/users/{user_uuid}")
+        lengths = get("/analytics/lengths")
+        images = get("/analytics/images")
+
+        assert days[-1]["requests"] >= 2
+        assert user["requests"] == 2 and user["image_requests"] == 2
+        assert user_uuid in {u["user_uuid"] for u in get("/analytics/users")}
+        assert lengths["question"]["entries"] >= 2
+        assert images["image_requests"] - images["distinct_images"] >= 1
+
+    def test_analytics_validation(self, client):
+        def status(url):
+            return client.get(url, headers=ANALYTICS_HEADERS).status_code
+
+        assert status("/analytics/requests?days=0") == 400
+        assert status("/analytics/users?limit=0") == 400
+        assert status(f"/analytics/users/{uuid.uuid4()}") == 404
+
+    @pytest.mark.parametrize(
+        "url",
+        [
+            "/analytics/requests",
+            "/analytics/users",
+            "/analytics/users/x",
+            "/analytics/lengths",
+            "/analytics/images",
+        ],
+    )
+    def test_analytics_need_the_token(self, client, url):
+        wrong = {"Authorization": "Bearer nope"}
+
+        assert client.get(url).status_code == 401
+        assert client.get(url, headers=wrong).status_code == 401
+        assert client.get(url).headers["WWW-Authenticate"] == "Bearer"
+
+    def test_analytics_off_without_a_token(self, client):
+        with patch("routes.ANALYTICS_TOKEN", ""):
+            response = client.get("/analytics/users", headers=ANALYTICS_HEADERS)
+
+        assert response.status_code == 403
+
 
 class TestInferenceEndpoint:
     @patch("routes.query_local")
@@ -169,6 +345,344 @@ class TestInferenceEndpoint:
         assert response.status_code == 500
 
 
+class TestInferenceStreamEndpoint:
+    @patch("routes.stream_local")
+    def test_stream_local_success(self, mock_stream_local, client, mock_image_file):
+        user_response = client.post("/users", data={"email": f"{uuid.uuid4()}@example.com"})
+        user_uuid = user_response.json()["uuid"]
+        mock_stream_local.return_value = (t for t in ["The answer ", "is 4."])
+
+        response = client.post(
+            "/inference/stream",
+            data={"question": "What is 1+3?", "user_uuid": user_uuid, "mode": "local"},
+            files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert 'data: {"token": "The answer "}' in response.text
+        assert "event: done" in response.text
+        assert '"response": "The answer is 4."' in response.text
+
+        history = client.get(f"/history/{user_uuid}").json()
+        assert len(history) == 1
+        assert history[0]["response"] == "The answer is 4."
+
+    @patch("routes.stream_remote")
+    def test_stream_remote_error(self, mock_stream_remote, client, mock_image_file):
+        async def failing_stream():
+            yield "partial"
+            raise ConnectionError("upstream closed")
+
+        mock_stream_remote.return_value = failing_stream()
+
+        response = client.post(
+            "/inference/stream",
+            data={"question": "What?", "user_uuid": str(uuid.uuid4()), "mode": "remote"},
+            files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+        )
+
+        assert response.status_code == 200
+        assert "event: error" in response.text
+        assert "upstream closed" in response.text
+        assert "event: done" not in response.text
+
+    def test_stream_invalid_mode(self, client, mock_image_file):
+        response = client.post(
+            "/inference/stream",
+            data={"question": "What?", "user_uuid": str(uuid.uuid4()), "mode": "bogus"},
+            files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+        )
+
+        assert response.status_code == 400
+
+
+class TestResponseCache:
+    @patch("routes.query_remote")
+    def test_repeat_question_served_from_cache(
+        self, mock_query_remote, client, mock_image_file
+    ):
+        import routes
+
+        user_response = client.post(
+            "/users", data={"email": f"{uuid.uuid4()}@example.com"}
+        )
+        user_uuid = user_response.json()["uuid"]
+        mock_query_remote.return_value = "Cached answer"
+
+        # An empty memory-only cache, so the first request is really a miss
+        with patch.object(routes, "response_cache", ResponseCache()):
+            for question in ["Cache me: what is 5*5?", "  cache ME: what is 5*5?"]:
+                mock_image_file.seek(0)
+                response = client.post(
+                    "/inference",
+                    data={
+                        "question": question,
+                        "user_uuid": user_uuid,
+                        "mode": "remote",
+                    },
+                    files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+                )
+                assert response.status_code == 200
+                assert response.json()["response"] == "Cached answer"
+
+        assert mock_query_remote.call_count == 1
+        history = client.get(f"/history/{user_uuid}").json()
+        assert len(history) == 2
+
+    @patch("routes.stream_remote")
+    @patch("routes.query_remote")
+    def test_stream_uses_cache(
+        self, mock_query_remote, mock_stream_remote, client, mock_image_file
+    ):
+        mock_query_remote.return_value = "Shared answer"
+        data = {
+            "question": "Cache me too",
+            "user_uuid": str(uuid.uuid4()),
+            "mode": "remote",
+        }
+
+        client.post(
+            "/inference",
+            data=data,
+            files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+        )
+        mock_image_file.seek(0)
+        response = client.post(
+            "/inference/stream",
+            data=data,
+            files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+        )
+
+        assert '"response": "Shared answer"' in response.text
+        assert not mock_stream_remote.called
+
+
+class TestAutoMode:
+    @patch("routes.query_local")
+    def test_auto_prefers_idle_local(self, mock_query_local, client, mock_image_file):
+        import routes
+
+        mock_query_local.return_value = "Local answer"
+        with patch.object(routes, "auto_router", routes.AutoRouter(10)):
+            response = client.post(
+                "/inference",
+                data={
+                    "question": "Auto question",
+                    "user_uuid": str(uuid.uuid4()),
+                    "mode": "auto",
+                },
+                files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+            )
+
+        assert response.status_code == 200
+        assert response.json()["response"] == "Local answer"
+
+    @patch("routes.query_remote")
+    def test_auto_overflows_to_remote(
+        self, mock_query_remote, client, mock_image_file
+    ):
+        import routes
+
+        mock_query_remote.return_value = "Remote answer"
+        router = routes.AutoRouter(1.0, min_samples=1)
+        router.record("local", 5.0)
+        with patch.object(routes, "auto_router", router):
+            response = client.post(
+                "/inference",
+                data={
+                    "question": "Overflow question",
+                    "user_uuid": str(uuid.uuid4()),
+                    "mode": "auto",
+                },
+                files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+            )
+
+        assert response.status_code == 200
+        assert response.json()["response"] == "Remote answer"
+        assert router.latency("remote") is not None
+
+
+class TestRemoteCircuitBreaker:
+    def open_breaker(self):
+        import routes
+
+        breaker = routes.CircuitBreaker(min_calls=1, window=1, open_seconds=60)
+        breaker.acquire()
+        breaker.release(False)
+        return patch.object(routes, "remote_breaker", breaker)
+
+    @patch("routes.query_remote")
+    def test_open_circuit_fails_fast(self, mock_query_remote, client, mock_image_file):
+        with self.open_breaker():
+            response = client.post(
+                "/inference",
+                data={"question": "Q", "user_uuid": str(uuid.uuid4()), "mode": "remote"},
+                files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+            )
+
+        assert response.status_code == 503
+        assert int(response.headers["retry-after"]) > 0
+        assert not mock_query_remote.called
+
+    @patch("routes.query_local")
+    def test_open_circuit_falls_back_to_local(
+        self, mock_query_local, client, mock_image_file
+    ):
+        import routes
+
+        mock_query_local.return_value = "Local answer"
+        with self.open_breaker(), patch.object(routes, "REMOTE_FALLBACK_TO_LOCAL", True):
+            response = client.post(
+                "/inference",
+                data={
+                    "question": "Fallback to local",
+                    "user_uuid": str(uuid.uuid4()),
+                    "mode": "remote",
+                },
+                files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+            )
+
+        assert response.status_code == 200
+        assert response.json()["response"] == "Local answer"
+
+
+class TestUploadIngestion:
+    @patch("routes.query_remote")
+    def test_duplicate_uploads_share_storage(
+        self, mock_query_remote, client, mock_image_file
+    ):
+        user_response = client.post(
+            "/users", data={"email": f"{uuid.uuid4()}@example.com"}
+        )
+        user_uuid = user_response.json()["uuid"]
+        mock_query_remote.return_value = "Stored answer"
+
+        for question in ("Dedup question one", "Dedup question two"):
+            mock_image_file.seek(0)
+            response = client.post(
+                "/inference",
+                data={"question": question, "user_uuid": user_uuid, "mode": "remote"},
+                files={"file": ("upload.jpg", mock_image_file, "image/jpeg")},
+            )
+            assert response.status_code == 200
+
+        history = client.get(f"/history/{user_uuid}").json()
+        paths = {entry["image_url"] for entry in history}
+        assert len(history) == 2
+        assert len(paths) == 1
+
+    @patch("routes.query_remote")
+    def test_history_thumbnails_served_with_cache_headers(
+        self, mock_query_remote, client, mock_image_file
+    ):
+        user_response = client.post("/users", data={"email": "thumbs@example.com"})
+        user_uuid = user_response.json()["uuid"]
+        mock_query_remote.return_value = "Thumbnail answer"
+
+        client.post(
+            "/inference",
+            data={"question": "Thumbnail question", "user_uuid": user_uuid, "mode": "remote"},
+            files={"file": ("upload.jpg", mock_image_file, "image/jpeg")},
+        )
+        # Thumbnails are written in the background
+        for _ in range(100):
+            thumbnails = client.get(f"/history/{user_uuid}").json()[0]["thumbnails"]
+            if len(thumbnails) == 2:
+                break
+            time.sleep(0.02)
+        assert set(thumbnails) == {"128", "512"}
+
+        response = client.get("/" + thumbnails["128"])
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/jpeg"
+        assert "immutable" in response.headers["cache-control"]
+        etag = response.headers["etag"]
+
+        cached = client.get("/" + thumbnails["128"], headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+
+    def test_oversized_upload_rejected(self, client):
+        import routes
+
+        with patch.object(routes, "UPLOAD_MAX_BYTES", 100):
+            response = client.post(
+                "/inference",
+                data={"question": "Q", "user_uuid": str(uuid.uuid4()), "mode": "remote"},
+                files={"file": ("big.jpg", io.BytesIO(b"x" * 1000), "image/jpeg")},
+            )
+
+        assert response.status_code == 413
+
+
+class TestDeadlinesAndBudgets:
+    @patch("routes.query_remote")
+    def test_token_budget_forwarded(self, mock_query_remote, client, mock_image_file):
+        mock_query_remote.return_value = "Short answer"
+
+        response = client.post(
+            "/inference",
+            data={
+                "question": "Budgeted question",
+                "user_uuid": str(uuid.uuid4()),
+                "mode": "remote",
+                "max_new_tokens": "16",
+            },
+            files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+        )
+
+        assert response.status_code == 200
+        assert mock_query_remote.call_args[1]["max_tokens"] == 16
+
+    def test_invalid_budget_rejected(self, client, mock_image_file):
+        response = client.post(
+            "/inference",
+            data={
+                "question": "Q",
+                "user_uuid": str(uuid.uuid4()),
+                "mode": "remote",
+                "max_new_tokens": "0",
+            },
+            files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+        )
+
+        assert response.status_code == 400
+
+    @patch("routes.query_remote")
+    def test_deadline_returns_504(self, mock_query_remote, client, mock_image_file):
+        from backend.utils.metrics import INFERENCE_COUNTER
+
+        timeouts = INFERENCE_COUNTER.labels(mode="remote", status="timeout")
+        before = timeouts._value.get()
+        cancelled = []
+
+        async def slow_remote(**kwargs):
+            try:
+                await asyncio.sleep(2)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "late"
+
+        mock_query_remote.side_effect = slow_remote
+
+        response = client.post(
+            "/inference",
+            data={
+                "question": "Slow question",
+                "user_uuid": str(uuid.uuid4()),
+                "mode": "remote",
+                "timeout": "0.1",
+            },
+            files={"file": ("test.jpg", mock_image_file, "image/jpeg")},
+        )
+
+        assert response.status_code == 504
+        assert timeouts._value.get() == before + 1
+        # The remote call itself is cancelled, not just abandoned
+        assert cancelled == [True]
+
+
 class TestIntegration:
 
     @patch("routes.query_local")
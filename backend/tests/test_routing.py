@@ -0,0 +1,89 @@
+from routing import AutoRouter
+
+from backend.utils.metrics import ROUTING_DECISIONS
+
+
+def make_router(**kwargs):
+    kwargs.setdefault("min_samples", 2)
+    return AutoRouter(slo_seconds=2.0, **kwargs)
+
+
+class TestAutoRouterSignals:
+    def test_latency_needs_min_samples(self):
+        router = make_router(percentile=50)
+        router.record("local", 1.0)
+        assert router.latency("local") is None
+
+        router.record("local", 3.0)
+        assert router.latency("local") == 3.0
+
+    def test_failures_count_towards_error_rate_only(self):
+        router = make_router()
+        router.record("remote", 1.0)
+        router.record("remote", ok=False)
+
+        assert router.error_rate("remote") == 0.5
+        assert router.latency("remote") is None
+
+    def test_unknown_mode_ignored(self):
+        router = make_router()
+        router.record("unknown", 1.0)
+        assert router.error_rate("local") == 0.0
+
+    def test_expected_latency_scales_with_queue(self):
+        router = make_router(percentile=50)
+        router.record("local", 1.0)
+        router.record("local", 1.0)
+
+        assert router.expected_local_latency(0, 4) == 1.0
+        assert router.expected_local_latency(8, 4) == 3.0
+
+
+class TestAutoRouterChoose:
+    def test_remote_while_local_unavailable(self):
+        assert make_router().choose(False, 0, 1) == ("remote", "local_unavailable")
+
+    def test_idle_local_without_history(self):
+        assert make_router().choose(True, 0, 4) == ("local", "local_idle")
+
+    def test_local_within_slo(self):
+        router = make_router()
+        router.record("local", 0.5)
+        router.record("local", 0.5)
+
+        assert router.choose(True, 2, 1) == ("local", "within_slo")
+
+    def test_overflow_to_remote(self):
+        router = make_router()
+        for _ in range(2):
+            router.record("local", 1.5)
+            router.record("remote", 1.0)
+
+        assert router.choose(True, 4, 2) == ("remote", "local_overloaded")
+
+    def test_overflow_without_history(self):
+        assert make_router().choose(True, 4, 4) == ("remote", "local_overloaded")
+
+    def test_stays_local_when_remote_failing(self):
+        router = make_router()
+        for _ in range(2):
+            router.record("local", 1.5)
+            router.record("remote", ok=False)
+
+        assert router.choose(True, 4, 2) == ("local", "remote_unhealthy")
+
+    def test_stays_local_when_remote_slower(self):
+        router = make_router()
+        for _ in range(2):
+            router.record("local", 1.5)
+            router.record("remote", 10.0)
+
+        assert router.choose(True, 4, 2) == ("local", "remote_slower")
+
+    def test_decisions_are_counted(self):
+        counter = ROUTING_DECISIONS.labels(mode="remote", reason="local_unavailable")
+        before = counter._value.get()
+
+        make_router().choose(False, 0, 1)
+
+        assert counter._value.get() == before + 1
@@ -0,0 +1,61 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+from snapshot import (
+    SNAPSHOT_INFO_FILE,
+    model_source,
+    read_snapshot_info,
+    write_snapshot,
+)
+
+
+def make_snapshot(path, precision="bf16"):
+    (path / SNAPSHOT_INFO_FILE).write_text(json.dumps({"precision": precision}))
+    return str(path)
+
+
+class TestModelSource:
+    def test_defaults_to_hub(self):
+        source, kwargs = model_source("fp32", snapshot="")
+        assert source == "Qwen/Qwen2-VL-2B-Instruct"
+        assert kwargs == {}
+
+    def test_snapshot_loads_locally(self, tmp_path):
+        snapshot = make_snapshot(tmp_path)
+
+        source, kwargs = model_source("bf16", snapshot=snapshot)
+
+        assert source == snapshot
+        assert kwargs == {"local_files_only": True}
+
+    def test_precision_mismatch(self, tmp_path):
+        snapshot = make_snapshot(tmp_path, precision="bf16")
+        with pytest.raises(ValueError, match="precision"):
+            model_source("fp32", snapshot=snapshot)
+
+    def test_missing_snapshot_info(self, tmp_path):
+        with pytest.raises(FileNotFoundError, match="not a model snapshot"):
+            read_snapshot_info(str(tmp_path))
+
+
+class TestWriteSnapshot:
+    @patch("transformers.AutoProcessor.from_pretrained")
+    @patch("transformers.Qwen2VLForConditionalGeneration.from_pretrained")
+    def test_writes_model_processor_and_info(
+        self, mock_model_load, mock_processor_load, tmp_path
+    ):
+        import torch
+
+        model, processor = MagicMock(), MagicMock()
+        mock_model_load.return_value = model
+        mock_processor_load.return_value = processor
+        output = str(tmp_path / "snapshot")
+
+        info = write_snapshot(output, "bf16", base_model="some/model")
+
+        assert mock_model_load.call_args[1]["dtype"] == torch.bfloat16
+        model.save_pretrained.assert_called_once_with(output)
+        processor.save_pretrained.assert_called_once_with(output)
+        assert info["dtype"] == "bfloat16"
+        assert read_snapshot_info(output)["base_model"] == "some/model"
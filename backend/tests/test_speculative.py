@@ -0,0 +1,82 @@
+import threading
+
+import torch
+from speculative import (
+    DraftStats,
+    prompt_lookup_kwargs,
+    record_acceptance,
+    track_draft_acceptance,
+)
+
+from backend.utils.metrics import SPECULATIVE_DRAFT_TOKENS
+
+
+class EchoModel(torch.nn.Module):
+    def forward(self, input_ids=None, inputs_embeds=None):
+        return input_ids
+
+
+def accepted_total():
+    return SPECULATIVE_DRAFT_TOKENS.labels(outcome="accepted")._value.get()
+
+
+class TestPromptLookupKwargs:
+    def test_disabled(self):
+        assert prompt_lookup_kwargs(0, 3) == {}
+
+    def test_enabled(self):
+        assert prompt_lookup_kwargs(8, 2) == {
+            "prompt_lookup_num_tokens": 8,
+            "max_matching_ngram_size": 2,
+        }
+
+
+class TestDraftAcceptance:
+    def test_counts_drafts_after_prefill(self):
+        model = EchoModel()
+        with track_draft_acceptance(model) as stats:
+            model(input_ids=torch.zeros(1, 16))  # Prefill
+            model(input_ids=torch.zeros(1, 6))  # Last token + 5 drafts
+            model(input_ids=torch.zeros(1, 1))  # No match, plain decode
+
+        assert stats.forward_calls == 3
+        assert stats.drafted == 5
+
+    def test_accepted_tokens(self):
+        stats = DraftStats()
+        stats.forward_calls = 3
+        stats.drafted = 5
+        # 1 prefill token + (3 accepted + 1) + 1
+        assert stats.accepted(6) == 3
+        assert stats.accepted(1) == 0
+        assert stats.accepted(50) == 5
+
+    def test_disabled_tracks_nothing(self):
+        model = EchoModel()
+        with track_draft_acceptance(model, enabled=False) as stats:
+            model(input_ids=torch.zeros(1, 4))
+        assert stats is None
+        assert not getattr(model, "_draft_hook_installed", False)
+
+    def test_ignores_other_threads(self):
+        model = EchoModel()
+        with track_draft_acceptance(model) as stats:
+            model(input_ids=torch.zeros(1, 4))
+            other = threading.Thread(
+                target=model, kwargs={"input_ids": torch.zeros(1, 9)}
+            )
+            other.start()
+            other.join()
+        assert stats.forward_calls == 1
+        assert stats.drafted == 0
+
+    def test_record_acceptance(self):
+        before = accepted_total()
+        stats = DraftStats()
+        stats.forward_calls = 3
+        stats.drafted = 5
+
+        record_acceptance(stats, 6)
+        record_acceptance(None, 6)
+
+        assert accepted_total() - before == 3
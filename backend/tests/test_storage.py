@@ -0,0 +1,146 @@
+import io
+import os
+import tracemalloc
+
+import pytest
+from PIL import Image
+
+from backend.storage import (
+    Upload,
+    UploadTooLarge,
+    attach_thumbnails,
+    read_upload,
+    sniff_extension,
+    store_upload,
+    thumbnail_path,
+    thumbnail_urls,
+    write_thumbnails,
+)
+
+
+class FakeUploadFile:
+    """Just enough of starlette's UploadFile: async chunked reads."""
+
+    def __init__(self, content: bytes, filename: str = "photo.jpg", size=None):
+        self.file = io.BytesIO(content)
+        self.filename = filename
+        self.size = size
+        self.reads = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads += 1
+        return self.file.read(size)
+
+
+def jpeg_bytes(color="red"):
+    buffered = io.BytesIO()
+    Image.new("RGB", (10, 10), color=color).save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+class TestReadUpload:
+    @pytest.mark.asyncio
+    async def test_reads_in_chunks_and_hashes(self):
+        import hashlib
+
+        content = jpeg_bytes()
+        file = FakeUploadFile(content)
+
+        upload = await read_upload(file, max_bytes=1 << 20, chunk_size=64)
+
+        assert upload.content == content
+        assert upload.digest == hashlib.sha256(content).hexdigest()
+        assert upload.extension == "jpg"
+        assert file.reads > 2
+
+    @pytest.mark.asyncio
+    async def test_holds_the_upload_in_memory_once(self):
+        size = 8 * 1024 * 1024
+        file = FakeUploadFile(b"x" * size)
+
+        tracemalloc.start()
+        try:
+            upload = await read_upload(file, max_bytes=size)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert upload.size == size
+        assert peak < 1.5 * size
+
+    @pytest.mark.asyncio
+    async def test_stops_early_past_limit(self):
+        file = FakeUploadFile(b"x" * 10_000)
+
+        with pytest.raises(UploadTooLarge):
+            await read_upload(file, max_bytes=1000, chunk_size=100)
+
+        # Gave up right after the chunk that crossed the limit
+        assert file.reads == 11
+
+    @pytest.mark.asyncio
+    async def test_rejects_declared_size_without_reading(self):
+        file = FakeUploadFile(b"x" * 10, size=5000)
+
+        with pytest.raises(UploadTooLarge):
+            await read_upload(file, max_bytes=1000)
+        assert file.reads == 0
+
+
+class TestSniffExtension:
+    def test_magic_bytes_win_over_filename(self):
+        assert sniff_extension(jpeg_bytes()[:16], "scan.png") == "jpg"
+        assert sniff_extension(b"\x89PNG\r\n\x1a\n....", "x") == "png"
+        assert sniff_extension(b"RIFF\x00\x00\x00\x00WEBPVP8 ", "") == "webp"
+
+    def test_falls_back_to_safe_filename_extension(self):
+        assert sniff_extension(b"????", "scan.TIFF") == "tiff"
+        assert sniff_extension(b"????", "../../etc/passwd") == "bin"
+        assert sniff_extension(b"????", "noext") == "bin"
+
+
+class TestStoreUpload:
+    def test_duplicates_stored_once(self, tmp_path):
+        content = jpeg_bytes()
+        upload = Upload(content=content, digest="abc123", extension="jpg")
+
+        first = store_upload(upload, str(tmp_path))
+        second = store_upload(upload, str(tmp_path))
+
+        assert first == second == os.path.join(str(tmp_path), "ab", "c1", "abc123.jpg")
+        assert os.listdir(os.path.join(tmp_path, "ab", "c1")) == ["abc123.jpg"]
+        with open(first, "rb") as f:
+            assert f.read() == content
+
+
+class TestThumbnails:
+    def test_written_next_to_original(self, tmp_path):
+        image_path = os.path.join(str(tmp_path), "abc123.png")
+        image = Image.new("RGBA", (800, 400))
+
+        written = write_thumbnails(image, image_path, sizes=[128, 512])
+
+        assert written == [
+            os.path.join(str(tmp_path), "abc123_128.jpg"),
+            os.path.join(str(tmp_path), "abc123_512.jpg"),
+        ]
+        assert Image.open(written[0]).size == (128, 64)
+        assert Image.open(written[1]).size == (512, 256)
+
+    def test_existing_thumbnails_kept(self, tmp_path):
+        image_path = os.path.join(str(tmp_path), "abc123.jpg")
+        image = Image.new("RGB", (300, 300))
+        write_thumbnails(image, image_path, sizes=[128])
+
+        assert write_thumbnails(image, image_path, sizes=[128]) == []
+
+    def test_history_lists_only_existing_thumbnails(self, tmp_path):
+        image_path = os.path.join(str(tmp_path), "abc123.jpg")
+        write_thumbnails(Image.new("RGB", (300, 300)), image_path, sizes=[128])
+        history = [{"image_url": image_path}, {"image_url": None}]
+
+        attach_thumbnails(history, sizes=[128, 512])
+
+        assert history[0]["thumbnails"] == {"128": thumbnail_path(image_path, 128)}
+        assert history[1]["thumbnails"] == {}
+        assert thumbnail_urls("uploads/missing.jpg", sizes=[128]) == {}
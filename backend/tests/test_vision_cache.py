@@ -0,0 +1,60 @@
+import torch
+from cache.vision_cache import VisionFeatureCache, VisionFeatures
+
+
+def make_features(rows):
+    return VisionFeatures(
+        image_grid_thw=torch.tensor([[1, 2, 2]]),
+        image_embeds=(torch.zeros(rows, 4),),
+    )
+
+
+class TestVisionFeatures:
+    def test_nbytes(self):
+        features = make_features(10)
+        # 10x4 float32 embeddings + 3 int64 grid values
+        assert features.nbytes == 10 * 4 * 4 + 3 * 8
+
+
+class TestVisionFeatureCache:
+    def test_miss_then_hit(self):
+        cache = VisionFeatureCache(max_bytes=10_000)
+        features = make_features(2)
+
+        assert cache.get("img") is None
+        cache.put("img", features)
+        assert cache.get("img") is features
+        assert cache.total_bytes == features.nbytes
+
+    def test_evicts_lru_over_budget(self):
+        size = make_features(10).nbytes
+        cache = VisionFeatureCache(max_bytes=size * 2)
+        cache.put("a", make_features(10))
+        cache.put("b", make_features(10))
+        cache.get("a")  # "b" is now least recently used
+        cache.put("c", make_features(10))
+
+        assert len(cache) == 2
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.total_bytes <= cache.max_bytes
+
+    def test_oversized_entry_not_stored(self):
+        cache = VisionFeatureCache(max_bytes=16)
+        cache.put("big", make_features(100))
+        assert len(cache) == 0
+        assert cache.total_bytes == 0
+
+    def test_replace_existing_key(self):
+        cache = VisionFeatureCache(max_bytes=10_000)
+        cache.put("a", make_features(2))
+        cache.put("a", make_features(4))
+        assert len(cache) == 1
+        assert cache.total_bytes == make_features(4).nbytes
+
+    def test_clear(self):
+        cache = VisionFeatureCache(max_bytes=10_000)
+        cache.put("a", make_features(2))
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.total_bytes == 0
@@ -0,0 +1,136 @@
+import time
+
+import pytest
+from PIL import Image
+from worker_pool import LocalWorkerPool, split_cores
+
+from backend.cancellation import RequestCancelled, RequestContext
+
+
+class EchoEngine:
+    # Module-level so spawned workers can unpickle it
+    def query(self, image, question, context=None):
+        if question == "slow":
+            # Stands in for generate() polling its stopping criterion
+            while True:
+                context.check()
+                time.sleep(0.01)
+        if question == "boom":
+            raise ValueError("engine failed")
+        return f"{image.size[0]}x{image.size[1]}: {question}"
+
+    def stream(self, image, question, context=None):
+        for word in question.split():
+            yield word + " "
+
+
+class BrokenEngine:
+    def __init__(self):
+        raise RuntimeError("no weights")
+
+
+@pytest.fixture
+def sample_image():
+    return Image.new("RGB", (12, 8), color="blue")
+
+
+class TestSplitCores:
+    def test_even_split(self):
+        assert split_cores([0, 1, 2, 3], 2) == [[0, 1], [2, 3]]
+
+    def test_uneven_split(self):
+        assert split_cores([3, 2, 1, 0, 4], 2) == [[0, 1, 2], [3, 4]]
+
+    def test_more_workers_than_cores(self):
+        assert split_cores([0], 3) == [[0], [0], [0]]
+
+
+class TestLocalWorkerPool:
+    def test_rejects_empty_pool(self):
+        with pytest.raises(ValueError):
+            LocalWorkerPool(0, load_engine=EchoEngine)
+
+    def test_submit_before_start(self, sample_image):
+        pool = LocalWorkerPool(1, load_engine=EchoEngine, cores=[0])
+        with pytest.raises(RuntimeError, match="not running"):
+            pool.submit(sample_image, "hi")
+
+    def test_threads_default_to_core_slice(self):
+        pool = LocalWorkerPool(2, load_engine=EchoEngine, cores=[0, 1, 2, 3])
+        assert pool.core_sets == [[0, 1], [2, 3]]
+        assert pool.threads == [2, 2]
+
+        pool = LocalWorkerPool(
+            2, threads_per_worker=1, load_engine=EchoEngine, cores=[0, 1, 2, 3]
+        )
+        assert pool.threads == [1, 1]
+
+    def test_query_stream_and_errors(self, sample_image):
+        pool = LocalWorkerPool(2, threads_per_worker=1, load_engine=EchoEngine)
+        pool.start()
+        try:
+            assert pool.wait_ready(timeout=60)
+            futures = [pool.submit(sample_image, f"q{i}") for i in range(4)]
+            assert [f.result(timeout=30) for f in futures] == [
+                f"12x8: q{i}" for i in range(4)
+            ]
+
+            tokens = list(pool.submit_stream(sample_image, "one two"))
+            assert tokens == ["one ", "two "]
+
+            with pytest.raises(RuntimeError, match="engine failed"):
+                pool.submit(sample_image, "boom").result(timeout=30)
+        finally:
+            pool.stop()
+
+    def test_cancel_and_deadline(self, sample_image):
+        pool = LocalWorkerPool(1, threads_per_worker=1, load_engine=EchoEngine)
+        pool.start()
+        try:
+            assert pool.wait_ready(timeout=60)
+
+            context = RequestContext()
+            running = pool.submit(sample_image, "slow", context)
+            queued_context = RequestContext()
+            queued = pool.submit(sample_image, "slow", queued_context)
+            time.sleep(0.2)
+
+            # Queued requests fail straight away, running ones stop the worker
+            queued_context.cancel()
+            with pytest.raises(RequestCancelled):
+                queued.result(timeout=1)
+            context.cancel()
+            with pytest.raises(RequestCancelled):
+                running.result(timeout=1)
+
+            expired = RequestContext(timeout=0.2)
+            with pytest.raises(RequestCancelled) as error:
+                pool.submit(sample_image, "slow", expired).result(timeout=30)
+            assert error.value.reason == "timeout"
+
+            # The worker is free again
+            assert pool.submit(sample_image, "hi").result(timeout=30) == "12x8: hi"
+        finally:
+            pool.stop()
+
+    def test_cancelled_future_does_not_stop_listener(self, sample_image):
+        pool = LocalWorkerPool(1, threads_per_worker=1, load_engine=EchoEngine)
+        pool.start()
+        try:
+            assert pool.wait_ready(timeout=60)
+
+            assert pool.submit(sample_image, "abandoned").cancel()
+            assert pool.submit(sample_image, "hi").result(timeout=30) == "12x8: hi"
+        finally:
+            pool.stop()
+
+    def test_all_workers_failed(self, sample_image):
+        pool = LocalWorkerPool(1, load_engine=BrokenEngine)
+        pool.start()
+        try:
+            assert pool.wait_ready(timeout=60) is False
+            assert "no weights" in pool.failed_workers[0]
+            with pytest.raises(RuntimeError, match="failed to load"):
+                pool.submit(sample_image, "hi")
+        finally:
+            pool.stop()
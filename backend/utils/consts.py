@@ -1,5 +1,170 @@
+import os
+
 import torch
 
 BASE_MODEL = "Qwen/Qwen2-VL-2B-Instruct"
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 DB_PATH = "db/app.duckdb"
+
+# Local micro-batching: how many requests share one model.generate call and
+# how long the first request in a batch waits for company
+LOCAL_BATCH_MAX_SIZE = int(os.environ.get("LOCAL_BATCH_MAX_SIZE", "4"))
+LOCAL_BATCH_MAX_WAIT_MS = float(os.environ.get("LOCAL_BATCH_MAX_WAIT_MS", "50"))
+
+# Response cache: in-memory LRU size, optional DuckDB file for a persistent
+# tier (empty disables it) and whether images match by perceptual hash
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_DB_PATH = os.environ.get("RESPONSE_CACHE_DB_PATH", "")
+RESPONSE_CACHE_PERCEPTUAL = os.environ.get("RESPONSE_CACHE_PERCEPTUAL", "0") == "1"
+
+# Vision-encoder feature cache budget for follow-up questions on the same
+# image (0 disables it)
+VISION_CACHE_MAX_MB = int(os.environ.get("VISION_CACHE_MAX_MB", "512"))
+
+# Reuse the precomputed KV cache of the constant math-tutor prompt prefix
+LOCAL_PREFIX_CACHE = os.environ.get("LOCAL_PREFIX_CACHE", "1") == "1"
+
+# Local model precision: fp32, bf16 or int8 (dynamic quantization, CPU only)
+LOCAL_PRECISION = os.environ.get("LOCAL_PRECISION", "fp32")
+
+# Directory written by `python -m backend.snapshot`; when set, the local model
+# and processor load from it instead of BASE_MODEL on the hub
+LOCAL_MODEL_SNAPSHOT = os.environ.get("LOCAL_MODEL_SNAPSHOT", "")
+
+# Prompt-lookup speculative decoding for the local model: number of tokens to
+# draft from n-gram matches per step (0 disables it) and the longest n-gram
+# to match against the prompt and the text generated so far
+LOCAL_PROMPT_LOOKUP_TOKENS = int(os.environ.get("LOCAL_PROMPT_LOOKUP_TOKENS", "0"))
+LOCAL_PROMPT_LOOKUP_NGRAM = int(os.environ.get("LOCAL_PROMPT_LOOKUP_NGRAM", "3"))
+
+# Image preprocessing: bounds on Qwen2-VL vision tokens per image (each
+# token covers a 28x28 pixel cell, so 1024 tokens is roughly 1036x776)
+IMAGE_MAX_VISION_TOKENS = int(os.environ.get("IMAGE_MAX_VISION_TOKENS", "1024"))
+IMAGE_MIN_VISION_TOKENS = int(os.environ.get("IMAGE_MIN_VISION_TOKENS", "4"))
+
+# Local worker pool: number of model replicas in separate processes (0 keeps
+# the single in-process model) and intra-op threads per replica (0 uses one
+# thread per core in the replica's core slice)
+LOCAL_POOL_SIZE = int(os.environ.get("LOCAL_POOL_SIZE", "0"))
+LOCAL_POOL_THREADS = int(os.environ.get("LOCAL_POOL_THREADS", "0"))
+
+# Per-request inference deadline in seconds (0 disables it; callers may ask
+# for a shorter one) and how often a waiting request checks whether its
+# client is still connected
+INFERENCE_TIMEOUT_S = float(os.environ.get("INFERENCE_TIMEOUT_S", "300"))
+INFERENCE_POLL_INTERVAL_S = float(os.environ.get("INFERENCE_POLL_INTERVAL_S", "0.5"))
+
+# While the local model is still loading, send local requests to the remote
+# model instead of answering 503
+LOCAL_FALLBACK_TO_REMOTE = os.environ.get("LOCAL_FALLBACK_TO_REMOTE", "0") == "1"
+
+# Remote model: OpenAI-compatible endpoint and model id, calls in flight,
+# per-attempt timeout, retries on 429/5xx, and the latency percentile after
+# which a slow call gets a hedged duplicate (0 disables hedging)
+REMOTE_BASE_URL = os.environ.get("REMOTE_BASE_URL", "https://router.huggingface.co/v1")
+REMOTE_MODEL = os.environ.get("REMOTE_MODEL", "zai-org/GLM-4.5V")
+REMOTE_MAX_CONCURRENCY = int(os.environ.get("REMOTE_MAX_CONCURRENCY", "64"))
+REMOTE_TIMEOUT_S = float(os.environ.get("REMOTE_TIMEOUT_S", "60"))
+REMOTE_CONNECT_TIMEOUT_S = float(os.environ.get("REMOTE_CONNECT_TIMEOUT_S", "5"))
+REMOTE_MAX_RETRIES = int(os.environ.get("REMOTE_MAX_RETRIES", "3"))
+REMOTE_HEDGE_PERCENTILE = float(os.environ.get("REMOTE_HEDGE_PERCENTILE", "0"))
+
+# Remote image payload: uploads that are already JPEG/PNG within these bounds
+# are sent as-is; anything else is encoded once as JPEG at this quality
+REMOTE_IMAGE_MAX_BYTES = int(os.environ.get("REMOTE_IMAGE_MAX_BYTES", str(1024 * 1024)))
+REMOTE_IMAGE_MAX_SIDE = int(os.environ.get("REMOTE_IMAGE_MAX_SIDE", "2048"))
+REMOTE_JPEG_QUALITY = int(os.environ.get("REMOTE_JPEG_QUALITY", "85"))
+
+# mode=auto routing: latency SLO in seconds that local inference must meet
+# before requests overflow to the remote model, the latency percentile that
+# is compared against it, the remote error rate above which requests stay
+# local anyway, and how many recent requests per engine are considered
+AUTO_ROUTE_SLO_S = float(os.environ.get("AUTO_ROUTE_SLO_S", "10"))
+AUTO_ROUTE_PERCENTILE = float(os.environ.get("AUTO_ROUTE_PERCENTILE", "95"))
+AUTO_ROUTE_MAX_REMOTE_ERROR_RATE = float(
+    os.environ.get("AUTO_ROUTE_MAX_REMOTE_ERROR_RATE", "0.2")
+)
+AUTO_ROUTE_WINDOW = int(os.environ.get("AUTO_ROUTE_WINDOW", "200"))
+
+# Remote circuit breaker: opens when at least REMOTE_BREAKER_MIN_CALLS of the
+# last REMOTE_BREAKER_WINDOW calls were recorded and the share that failed or
+# took longer than REMOTE_BREAKER_SLOW_CALL_S (0 ignores latency) reaches
+# REMOTE_BREAKER_FAILURE_RATE. It stays open for REMOTE_BREAKER_OPEN_S, then
+# lets REMOTE_BREAKER_HALF_OPEN_CALLS probes through. While it is open,
+# remote requests fail fast with 503, or go to the local model if
+# REMOTE_FALLBACK_TO_LOCAL is set
+REMOTE_BREAKER_FAILURE_RATE = float(
+    os.environ.get("REMOTE_BREAKER_FAILURE_RATE", "0.5")
+)
+REMOTE_BREAKER_SLOW_CALL_S = float(os.environ.get("REMOTE_BREAKER_SLOW_CALL_S", "30"))
+REMOTE_BREAKER_WINDOW = int(os.environ.get("REMOTE_BREAKER_WINDOW", "20"))
+REMOTE_BREAKER_MIN_CALLS = int(os.environ.get("REMOTE_BREAKER_MIN_CALLS", "10"))
+REMOTE_BREAKER_OPEN_S = float(os.environ.get("REMOTE_BREAKER_OPEN_S", "30"))
+REMOTE_BREAKER_HALF_OPEN_CALLS = int(
+    os.environ.get("REMOTE_BREAKER_HALF_OPEN_CALLS", "2")
+)
+REMOTE_FALLBACK_TO_LOCAL = os.environ.get("REMOTE_FALLBACK_TO_LOCAL", "0") == "1"
+
+# Largest accepted image upload; bigger ones are rejected with 413 as soon as
+# the limit is passed
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Executor pools for blocking work in the API layer. Each DB thread gets its
+# own cursor on the shared DuckDB connection. Also the interval at which
+# event-loop lag is sampled
+EXECUTOR_DB_THREADS = int(os.environ.get("EXECUTOR_DB_THREADS", "4"))
+EXECUTOR_IO_THREADS = int(os.environ.get("EXECUTOR_IO_THREADS", "8"))
+EXECUTOR_DECODE_THREADS = int(
+    os.environ.get("EXECUTOR_DECODE_THREADS", str(min(4, os.cpu_count() or 1)))
+)
+LOOP_LAG_INTERVAL_S = float(os.environ.get("LOOP_LAG_INTERVAL_S", "0.25"))
+
+# Longest-side pixel sizes of the JPEG thumbnails written next to each upload
+THUMBNAIL_SIZES = [
+    int(size)
+    for size in os.environ.get("THUMBNAIL_SIZES", "128,512").split(",")
+    if size
+]
+
+# Upload retention job: how often it runs in the API (0 disables it), how
+# old an unreferenced upload must be before it counts as orphaned, and the
+# optional policies for originals: maximum age in days, total size budget in
+# bytes (oldest evicted first) and the age after which JPEG/PNG originals are
+# recompressed into new, smaller files (0 turns each of them off)
+RETENTION_INTERVAL_S = float(os.environ.get("RETENTION_INTERVAL_S", "3600"))
+RETENTION_ORPHAN_GRACE_S = float(os.environ.get("RETENTION_ORPHAN_GRACE_S", "3600"))
+RETENTION_MAX_AGE_DAYS = float(os.environ.get("RETENTION_MAX_AGE_DAYS", "0"))
+RETENTION_MAX_BYTES = int(os.environ.get("RETENTION_MAX_BYTES", "0"))
+RETENTION_RECOMPRESS_AFTER_DAYS = float(
+    os.environ.get("RETENTION_RECOMPRESS_AFTER_DAYS", "0")
+)
+RETENTION_RECOMPRESS_QUALITY = int(os.environ.get("RETENTION_RECOMPRESS_QUALITY", "75"))
+
+# Batched history writer: entries per transaction, how long a partial batch
+# waits for more before it's written, and the backlog at which requests
+# start waiting for the writer instead of queueing more
+HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL_S = float(os.environ.get("HISTORY_FLUSH_INTERVAL_S", "0.1"))
+HISTORY_MAX_PENDING = int(os.environ.get("HISTORY_MAX_PENDING", "10000"))
+
+# /history page size when the client doesn't ask for one, and the largest
+# page it may ask for
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get("HISTORY_MAX_PAGE_SIZE", "200"))
+
+# Rows per batch pulled from DuckDB while streaming a history export
+HISTORY_EXPORT_BATCH_SIZE = int(os.environ.get("HISTORY_EXPORT_BATCH_SIZE", "1000"))
+
+# Longest window /analytics/requests reports, in days
+ANALYTICS_MAX_DAYS = int(os.environ.get("ANALYTICS_MAX_DAYS", "366"))
+
+# Bearer token the /analytics routes require. They list user uuids, which are
+# all it takes to read someone's history, so empty keeps them switched off
+ANALYTICS_TOKEN = os.environ.get("ANALYTICS_TOKEN", "")
+
+# History archival: directory for the Parquet files (empty puts them next to
+# the database file), how often the job runs in the API (0 disables it) and
+# the age in days after which entries move out of the history table
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "")
+ARCHIVE_INTERVAL_S = float(os.environ.get("ARCHIVE_INTERVAL_S", "86400"))
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", "90"))
@@ -0,0 +1,270 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus Metrics Definitions
+
+# Metric to track inference requests by mode and status
+INFERENCE_COUNTER = Counter(
+    "app_inference_requests_total",
+    "Total number of inference requests",
+    ["mode", "status"],
+)
+
+# Inference Latency
+INFERENCE_DURATION = Histogram(
+    "app_inference_duration_seconds",
+    "Time taken for the AI model to generate a response",
+    ["mode"],  # Track local vs remote speed
+)
+
+# Local model startup: seconds spent loading weights and on the warmup
+# generation, and whether the model is ready to serve
+MODEL_STARTUP_SECONDS = Gauge(
+    "app_model_startup_seconds",
+    "Duration of the last local model startup phase",
+    ["phase"],
+)
+
+MODEL_READY = Gauge(
+    "app_model_ready",
+    "1 once the local model is loaded and warmed up",
+)
+
+# Local worker pool: replicas that finished loading the model
+LOCAL_POOL_WORKERS_READY = Gauge(
+    "app_local_pool_workers_ready",
+    "Local model replicas ready to serve requests",
+)
+
+# Local worker pool: 1 while a replica is generating, 0 when idle
+LOCAL_POOL_WORKER_BUSY = Gauge(
+    "app_local_pool_worker_busy",
+    "Whether a local model replica is currently serving a request",
+    ["worker"],
+)
+
+# Local worker pool: rate() of this is per-replica utilization
+LOCAL_POOL_BUSY_SECONDS = Counter(
+    "app_local_pool_busy_seconds_total",
+    "Time each local model replica spent serving requests",
+    ["worker"],
+)
+
+# Streaming: time until the first token reaches the client
+INFERENCE_TTFT = Histogram(
+    "app_inference_time_to_first_token_seconds",
+    "Time from request start until the first streamed token",
+    ["mode"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80),
+)
+
+# Local batching scheduler: requests waiting for a batch slot
+LOCAL_QUEUE_DEPTH = Gauge(
+    "app_local_queue_depth",
+    "Number of local inference requests waiting to be batched",
+)
+
+# Local batching scheduler: requests per model.generate call
+LOCAL_BATCH_SIZE = Histogram(
+    "app_local_batch_size",
+    "Number of requests served by a single local model.generate call",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
+
+# Response cache lookups by tier (memory/disk) and event (hit/miss/eviction)
+RESPONSE_CACHE_EVENTS = Counter(
+    "app_response_cache_events_total",
+    "Response cache hits, misses and evictions",
+    ["tier", "event"],
+)
+
+# Vision-encoder feature cache
+VISION_CACHE_EVENTS = Counter(
+    "app_vision_cache_events_total",
+    "Vision feature cache hits, misses and evictions",
+    ["event"],
+)
+
+VISION_CACHE_BYTES = Gauge(
+    "app_vision_cache_bytes",
+    "Memory held by cached vision-encoder outputs",
+)
+
+# Prompt-prefix KV cache reuse (hit, mismatch, stale_model)
+PREFIX_CACHE_EVENTS = Counter(
+    "app_prefix_cache_events_total",
+    "Prompt-prefix KV cache lookups by outcome",
+    ["event"],
+)
+
+# Prompt-lookup speculative decoding: drafted tokens the model accepted vs
+# rejected; accepted / (accepted + rejected) is the acceptance rate
+SPECULATIVE_DRAFT_TOKENS = Counter(
+    "app_speculative_draft_tokens_total",
+    "Prompt-lookup draft tokens by verification outcome",
+    ["outcome"],
+)
+
+SPECULATIVE_ACCEPTANCE = Histogram(
+    "app_speculative_acceptance_ratio",
+    "Share of drafted tokens accepted per local generation",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+
+# Remote engine: attempts by outcome, hedged requests and calls in flight
+REMOTE_ATTEMPTS = Counter(
+    "app_remote_attempts_total",
+    "Remote model HTTP attempts by result (success, retried or failed)",
+    ["result"],
+)
+REMOTE_HEDGES = Counter(
+    "app_remote_hedges_total",
+    "Hedged remote requests launched and how many of them won",
+    ["outcome"],
+)
+REMOTE_BYTES_SENT = Counter(
+    "app_remote_bytes_sent_total",
+    "Request body bytes sent to the remote model, retries and hedges included",
+)
+REMOTE_IN_FLIGHT = Gauge(
+    "app_remote_in_flight",
+    "Remote model HTTP requests currently in flight",
+)
+
+# Remote circuit breaker: current state (0 closed, 1 open, 2 half-open) and
+# transitions into each state
+REMOTE_CIRCUIT_STATE = Gauge(
+    "app_remote_circuit_state",
+    "Remote model circuit breaker state (0 closed, 1 open, 2 half-open)",
+)
+REMOTE_CIRCUIT_TRANSITIONS = Counter(
+    "app_remote_circuit_transitions_total",
+    "Remote model circuit breaker transitions by the state entered",
+    ["state"],
+)
+
+# Remote image payload: size by whether the upload was passed through or
+# re-encoded, and the time spent re-encoding
+REMOTE_PAYLOAD_BYTES = Histogram(
+    "app_remote_payload_bytes",
+    "Size of the image sent to the remote model in bytes (before base64)",
+    ["source"],
+    buckets=(10240, 51200, 102400, 262144, 524288, 1048576, 2097152, 5242880),
+)
+REMOTE_ENCODE_SECONDS = Histogram(
+    "app_remote_encode_seconds",
+    "Time spent re-encoding images for the remote model",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5),
+)
+
+# mode=auto routing decisions by chosen engine and reason
+ROUTING_DECISIONS = Counter(
+    "app_routing_decisions_total",
+    "Engine picked for mode=auto requests and why",
+    ["mode", "reason"],
+)
+
+# Event loop responsiveness: how late a fixed sleep wakes up, and how long
+# blocking work waits for a thread in each executor pool
+EVENT_LOOP_LAG = Histogram(
+    "app_event_loop_lag_seconds",
+    "Delay of the event loop past a scheduled wakeup",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+EXECUTOR_QUEUE_SECONDS = Histogram(
+    "app_executor_queue_seconds",
+    "Time blocking work waits for a free thread, by executor pool",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+
+# Vision tokens per image after resolution preprocessing
+IMAGE_VISION_TOKENS = Histogram(
+    "app_image_vision_tokens",
+    "Number of Qwen2-VL vision tokens per preprocessed image",
+    buckets=(64, 128, 256, 512, 768, 1024, 1536, 2048, 4096),
+)
+
+# Image Upload Size
+UPLOAD_SIZE = Histogram(
+    "app_image_upload_bytes",
+    "Size of uploaded images in bytes",
+    # Buckets from 10KB up to 10MB to categorize sizes
+    buckets=(10240, 51200, 102400, 1048576, 5242880, 10485760),
+)
+
+# Content-addressed upload storage: new files versus duplicates of an
+# already stored upload
+UPLOAD_STORE_EVENTS = Counter(
+    "app_upload_store_events_total",
+    "Uploads written to storage or deduplicated against an existing file",
+    ["result"],
+)
+
+THUMBNAILS_WRITTEN = Counter(
+    "app_thumbnails_written_total",
+    "History thumbnails generated for uploads",
+)
+
+# Upload storage footprint by file kind (original or thumbnail), refreshed
+# by each retention run, and what the retention job cleaned up
+STORAGE_FILES = Gauge(
+    "app_storage_files",
+    "Files in upload storage",
+    ["kind"],
+)
+STORAGE_BYTES = Gauge(
+    "app_storage_bytes",
+    "Bytes in upload storage",
+    ["kind"],
+)
+RETENTION_FILES_REMOVED = Counter(
+    "app_retention_files_removed_total",
+    "Upload files removed by the retention job",
+    ["reason"],
+)
+RETENTION_BYTES_RECLAIMED = Counter(
+    "app_retention_bytes_reclaimed_total",
+    "Upload storage bytes reclaimed by the retention job",
+    ["reason"],
+)
+
+# History rows moved to the Parquet archive
+HISTORY_ARCHIVED_ROWS = Counter(
+    "app_history_archived_rows_total",
+    "History rows moved out of the database by the archive job",
+)
+
+# User Activity
+USER_ACTIVITY = Counter(
+    "app_user_actions_total",
+    "Tracks distinct user actions",
+    ["action"],
+)
+
+# Internal Database Errors
+DB_ERRORS = Counter(
+    "app_db_errors_total",
+    "Tracks silent database failures",
+    ["operation"],
+)
+
+# DuckDB call latency by Database method
+DB_OPERATION_SECONDS = Histogram(
+    "app_db_operation_duration_seconds",
+    "Time spent in each database operation",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+# Batched history writer: entries queued but not yet written, and rows per
+# flushed transaction
+HISTORY_WRITER_PENDING = Gauge(
+    "app_history_writer_pending",
+    "History entries waiting to be written to the database",
+)
+
+HISTORY_WRITER_BATCH_SIZE = Histogram(
+    "app_history_writer_batch_size",
+    "Number of history entries written in one transaction",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
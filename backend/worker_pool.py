@@ -0,0 +1,459 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+
+from PIL import Image
+
+from backend.cancellation import RequestCancelled, RequestContext
+from backend.utils.metrics import (
+    LOCAL_POOL_BUSY_SECONDS,
+    LOCAL_POOL_WORKER_BUSY,
+    LOCAL_POOL_WORKERS_READY,
+    LOCAL_QUEUE_DEPTH,
+    MODEL_STARTUP_SECONDS,
+)
+
+
+class LocalEngine:
+    """One local model replica, loaded inside a pool worker process."""
+
+    def __init__(self):
+        # Imported here so the API process never pays for them in pool mode
+        from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+
+        from backend.cache.vision_cache import VisionFeatureCache
+        from backend.local_model import (
+            apply_precision,
+            build_prefix_cache,
+            precision_dtype,
+        )
+        from backend.snapshot import model_source
+        from backend.utils.consts import (
+            DEVICE,
+            LOCAL_PRECISION,
+            LOCAL_PREFIX_CACHE,
+            LOCAL_PROMPT_LOOKUP_NGRAM,
+            LOCAL_PROMPT_LOOKUP_TOKENS,
+            VISION_CACHE_MAX_MB,
+        )
+
+        source, source_kwargs = model_source(LOCAL_PRECISION)
+        self.model = Qwen2VLForConditionalGeneration.from_pretrained(
+            source, dtype=precision_dtype(LOCAL_PRECISION), **source_kwargs
+        )
+        self.model.to(DEVICE)
+        self.model = apply_precision(self.model, LOCAL_PRECISION, DEVICE)
+        self.processor = AutoProcessor.from_pretrained(source, **source_kwargs)
+        self.device = DEVICE
+        self.prompt_lookup = {
+            "prompt_lookup_tokens": LOCAL_PROMPT_LOOKUP_TOKENS,
+            "prompt_lookup_ngram": LOCAL_PROMPT_LOOKUP_NGRAM,
+        }
+
+        self.vision_cache = None
+        if VISION_CACHE_MAX_MB > 0:
+            self.vision_cache = VisionFeatureCache(VISION_CACHE_MAX_MB * 1024 * 1024)
+        self.prefix_cache = None
+        if LOCAL_PREFIX_CACHE:
+            self.prefix_cache = build_prefix_cache(
+                self.model, self.processor, self.device
+            )
+
+    def warmup(self):
+        from backend.local_model import warmup_local
+
+        warmup_local(
+            self.model,
+            self.processor,
+            self.device,
+            prefix_cache=self.prefix_cache,
+            **self.prompt_lookup,
+        )
+
+    def query(
+        self, image: Image.Image, question: str, context: RequestContext = None
+    ) -> str:
+        from backend.local_model import query_local
+
+        return query_local(
+            model=self.model,
+            processor=self.processor,
+            device=self.device,
+            image=image,
+            question=question,
+            vision_cache=self.vision_cache,
+            prefix_cache=self.prefix_cache,
+            **self.prompt_lookup,
+            context=context,
+        )
+
+    def stream(
+        self, image: Image.Image, question: str, context: RequestContext = None
+    ) -> Iterator[str]:
+        from backend.local_model import stream_local
+
+        return stream_local(
+            model=self.model,
+            processor=self.processor,
+            device=self.device,
+            image=image,
+            question=question,
+            vision_cache=self.vision_cache,
+            prefix_cache=self.prefix_cache,
+            **self.prompt_lookup,
+            context=context,
+        )
+
+
+def split_cores(cores: list[int], size: int) -> list[list[int]]:
+    # Contiguous, near-equal slices so replicas don't share physical cores
+    cores = sorted(cores)
+    chunk, extra = divmod(len(cores), size)
+    if chunk == 0:
+        return [cores for _ in range(size)]
+    slices = []
+    start = 0
+    for i in range(size):
+        end = start + chunk + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+def _worker_main(
+    worker_id, cores, threads, load_engine, requests, results, cancel_slot
+):
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    import torch
+
+    torch.set_num_threads(threads)
+
+    try:
+        start = time.perf_counter()
+        engine = load_engine()
+        durations = {"load": time.perf_counter() - start}
+    except Exception as e:  # noqa: BLE001 - reported to the parent process
+        results.put(("failed", worker_id, None, f"{type(e).__name__}: {e}"))
+        return
+
+    warmup = getattr(engine, "warmup", None)
+    if warmup is not None:
+        start = time.perf_counter()
+        try:
+            warmup()
+        except Exception as e:  # noqa: BLE001 - optional, serve without it
+            print(f"Local worker {worker_id} warmup failed: {e}")
+        durations["warmup"] = time.perf_counter() - start
+    results.put(("ready", worker_id, None, durations))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, kind, image, question, max_new_tokens, deadline = request
+        results.put(("start", worker_id, request_id, None))
+        # The API process cancels a running request by writing its id into
+        # this worker's shared slot
+        context = RequestContext(
+            max_new_tokens=max_new_tokens,
+            deadline=deadline,
+            cancel_check=lambda rid=request_id: cancel_slot.value == rid,
+        )
+        try:
+            context.check()
+            if kind == "stream":
+                for token in engine.stream(image, question, context=context):
+                    results.put(("token", worker_id, request_id, token))
+                results.put(("done", worker_id, request_id, None))
+            else:
+                output = engine.query(image, question, context=context)
+                results.put(("result", worker_id, request_id, output))
+        except RequestCancelled as e:
+            results.put(("cancelled", worker_id, request_id, e.reason))
+        except Exception as e:  # noqa: BLE001 - reported to the parent process
+            results.put(("error", worker_id, request_id, f"{type(e).__name__}: {e}"))
+
+
+_STREAM_END = object()
+
+
+class LocalWorkerPool:
+    """K local model replicas in separate processes fed by one shared queue.
+
+    Each worker is pinned to its own slice of the CPU cores and limited to
+    `threads_per_worker` intra-op threads, which scales better than one
+    process with every core fighting over a single model.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        threads_per_worker: int = 0,
+        load_engine: Callable = LocalEngine,
+        cores: list[int] | None = None,
+    ):
+        if size < 1:
+            raise ValueError("Worker pool needs at least one worker")
+        self.size = size
+        self.load_engine = load_engine
+        if cores is None:
+            cores = (
+                sorted(os.sched_getaffinity(0))
+                if hasattr(os, "sched_getaffinity")
+                else list(range(os.cpu_count() or 1))
+            )
+        self.core_sets = split_cores(cores, size)
+        self.threads = [threads_per_worker or max(1, len(c)) for c in self.core_sets]
+
+        self._ctx = mp.get_context("spawn")
+        self._requests = None
+        self._results = None
+        self._workers = []
+        self._cancel_slots = []
+        self._cancelled = set()  # Cancelled before a worker picked them up
+        self._listener = None
+        self._ids = itertools.count()
+        self._pending = {}
+        self._running_on = {}  # worker_id -> (request_id, start time)
+        self._lock = threading.Lock()
+        self._running = False
+        self.ready_workers = set()
+        self.failed_workers = {}
+
+    def start(self):
+        if self._running:
+            return
+        self._requests = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._cancel_slots = [self._ctx.Value("q", -1) for _ in range(self.size)]
+        for worker_id in range(self.size):
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(
+                    worker_id,
+                    self.core_sets[worker_id],
+                    self.threads[worker_id],
+                    self.load_engine,
+                    self._requests,
+                    self._results,
+                    self._cancel_slots[worker_id],
+                ),
+                name=f"local-worker-{worker_id}",
+                daemon=True,
+            )
+            process.start()
+            self._workers.append(process)
+        self._running = True
+        self._listener = threading.Thread(
+            target=self._listen, name="local-pool-listener", daemon=True
+        )
+        self._listener.start()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self.ready_workers) + len(self.failed_workers) < self.size:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return bool(self.ready_workers)
+
+    def stop(self, timeout: float = 10):
+        if not self._running:
+            return
+        self._running = False
+        for _ in self._workers:
+            self._requests.put(None)
+        for process in self._workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._results.put(None)
+        self._listener.join()
+
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for target in pending:
+            self._fail(target, RuntimeError("Local worker pool stopped"))
+
+        for worker_id in range(self.size):
+            LOCAL_POOL_WORKER_BUSY.labels(worker=str(worker_id)).set(0)
+        LOCAL_POOL_WORKERS_READY.set(0)
+        LOCAL_QUEUE_DEPTH.set(0)
+        self._workers = []
+        self.ready_workers = set()
+        self.failed_workers = {}
+        self._running_on = {}
+        self._cancelled = set()
+
+    def submit(
+        self,
+        image: Image.Image,
+        question: str,
+        context: RequestContext | None = None,
+    ) -> Future:
+        future = Future()
+        self._enqueue("query", image, question, future, context)
+        return future
+
+    def submit_stream(
+        self,
+        image: Image.Image,
+        question: str,
+        context: RequestContext | None = None,
+    ) -> Iterator[str]:
+        tokens = queue.Queue()
+        self._enqueue("stream", image, question, tokens, context)
+
+        def iterate():
+            while True:
+                token = tokens.get()
+                if token is _STREAM_END:
+                    return
+                if isinstance(token, Exception):
+                    raise token
+                yield token
+
+        return iterate()
+
+    def queue_depth(self) -> int:
+        # Accepted requests that no worker has picked up yet
+        with self._lock:
+            return max(0, len(self._pending) - len(self._running_on))
+
+    def capacity(self) -> int:
+        return max(1, len(self.ready_workers))
+
+    def _enqueue(self, kind, image, question, target, context):
+        if not self._running:
+            raise RuntimeError("Local worker pool is not running")
+        if len(self.failed_workers) == self.size:
+            raise RuntimeError("All local workers failed to load the model")
+        request_id = next(self._ids)
+        with self._lock:
+            self._pending[request_id] = target
+        LOCAL_QUEUE_DEPTH.inc()
+        max_new_tokens, deadline = None, None
+        if context is not None:
+            max_new_tokens, deadline = context.max_new_tokens, context.deadline
+            context.on_cancel(lambda reason: self._cancel(request_id, reason))
+        self._requests.put(
+            (request_id, kind, image, question, max_new_tokens, deadline)
+        )
+
+    def _cancel(self, request_id, reason):
+        # Fail the caller now; the worker stops at its next token
+        with self._lock:
+            target = self._pending.pop(request_id, None)
+            if target is None:
+                return
+            running = [w for w, r in self._running_on.items() if r[0] == request_id]
+            if running:
+                self._cancel_slots[running[0]].value = request_id
+            else:
+                self._cancelled.add(request_id)
+        self._fail(target, RequestCancelled(reason))
+
+    def _fail(self, target, error):
+        if isinstance(target, Future):
+            if not target.done():
+                target.set_exception(error)
+        else:
+            target.put(error)
+
+    def _finish(self, worker_id):
+        with self._lock:
+            started = self._running_on.pop(worker_id, None)
+        if started is not None:
+            LOCAL_POOL_BUSY_SECONDS.labels(worker=str(worker_id)).inc(
+                time.monotonic() - started[1]
+            )
+        LOCAL_POOL_WORKER_BUSY.labels(worker=str(worker_id)).set(0)
+
+    def _check_workers(self):
+        # A worker that died mid-request would otherwise leave its caller
+        # waiting forever
+        for worker_id, process in enumerate(self._workers):
+            if process.is_alive() or worker_id in self.failed_workers:
+                continue
+            self.failed_workers[worker_id] = f"exited with code {process.exitcode}"
+            self.ready_workers.discard(worker_id)
+            LOCAL_POOL_WORKERS_READY.set(len(self.ready_workers))
+            started = self._running_on.get(worker_id)
+            self._finish(worker_id)
+            if started is not None:
+                with self._lock:
+                    target = self._pending.pop(started[0], None)
+                if target is not None:
+                    self._fail(target, RuntimeError(f"Local worker {worker_id} died"))
+
+    def _listen(self):
+        while True:
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if self._running:
+                    self._check_workers()
+                continue
+            if message is None:
+                return
+
+            kind, worker_id, request_id, payload = message
+            if kind == "ready":
+                for phase, seconds in payload.items():
+                    MODEL_STARTUP_SECONDS.labels(phase=phase).set(seconds)
+                self.ready_workers.add(worker_id)
+                LOCAL_POOL_WORKERS_READY.set(len(self.ready_workers))
+                continue
+            if kind == "failed":
+                self.failed_workers[worker_id] = payload
+                print(f"Local worker {worker_id} failed to start: {payload}")
+                if len(self.failed_workers) == self.size:
+                    with self._lock:
+                        pending = list(self._pending.values())
+                        self._pending.clear()
+                    for target in pending:
+                        self._fail(
+                            target,
+                            RuntimeError("All local workers failed to load the model"),
+                        )
+                continue
+            if kind == "start":
+                with self._lock:
+                    self._running_on[worker_id] = (request_id, time.monotonic())
+                    if request_id in self._cancelled:
+                        self._cancelled.discard(request_id)
+                        self._cancel_slots[worker_id].value = request_id
+                LOCAL_QUEUE_DEPTH.dec()
+                LOCAL_POOL_WORKER_BUSY.labels(worker=str(worker_id)).set(1)
+                continue
+
+            with self._lock:
+                target = self._pending.get(request_id)
+                if kind != "token":
+                    self._pending.pop(request_id, None)
+            if kind != "token":
+                self._finish(worker_id)
+            if target is None:
+                continue
+
+            if kind == "token":
+                target.put(payload)
+            elif kind == "done":
+                target.put(_STREAM_END)
+            elif kind == "result":
+                # The caller may have cancelled its future meanwhile
+                if not target.done():
+                    target.set_result(payload)
+            elif kind == "cancelled":
+                self._fail(target, RequestCancelled(payload))
+            elif kind == "error":
+                self._fail(target, RuntimeError(payload))